@@ -89,6 +89,7 @@ if __name__ == '__main__':
     logger.info("="*60)
     logger.info("DOU+订单管理系统 API服务器启动")
     logger.info("三层解耦架构：同步层 → 统计层 → 查询层")
+    logger.info("开发服务器仅用于本地调试，生产环境请使用: gunicorn -c gunicorn.conf.py wsgi:app")
     logger.info("="*60)
     
     # 启动Flask服务
@@ -20,6 +20,8 @@ from sqlalchemy import text
 from app.api import account_bp
 from app.api.common import require_auth, success_response, error_response
 from app.models import SessionLocal
+from app.utils.token_cache import invalidate_account_credentials
+from app.utils.response_cache import bump_user_version
 
 logger = logging.getLogger(__name__)
 
@@ -246,6 +248,9 @@ def delete_account(account_id):
             'user_id': user_id
         })
         db.commit()
+        invalidate_account_credentials(account_id)
+        # 统计卡片、看板等缓存中不再包含已解绑账号
+        bump_user_version(user_id)
         
         logger.info(f"账号已删除: account_id={account_id}, user_id={user_id}")
         return success_response(None, message='账号已解绑')
@@ -354,6 +359,8 @@ def refresh_account_token(account_id):
             'user_id': user_id
         })
         db.commit()
+        invalidate_account_credentials(account_id)
+        bump_user_version(user_id)
         
         logger.info(f"Token刷新成功: account_id={account_id}, expires_at={expires_at}")
         
@@ -1,35 +1,38 @@
 """
 订单数据导出API
 
-职责：导出订单列表数据为Excel文件
+职责：
+1. 导出订单列表数据为Excel/CSV文件（流式响应，不限制行数）
+2. 异步导出任务：提交、查询进度、下载结果文件
 """
 
+import os
 import logging
 from datetime import datetime
-from flask import request, Response
-from io import BytesIO
-from sqlalchemy import text
+from urllib.parse import quote
+from flask import request, Response, stream_with_context, send_file
 from app.api import query_bp
-from app.api.common import require_auth, error_response
-from app.models import SessionLocal
+from app.api.common import require_auth, success_response, error_response
+from app.models import SessionLocal, SyncTaskLog
+from app.tasks.export_job import export_file_path
+from app.utils.order_filters import build_order_filters
+from app.utils.export_writer import (
+    XLSX_AVAILABLE, EXPORT_FORMATS, EXPORT_MIMETYPES,
+    build_export_sql, iter_export_rows, iter_csv,
+    write_xlsx_tempfile, iter_file_and_remove
+)
 
 logger = logging.getLogger(__name__)
 
-# 需要安装openpyxl: pip install openpyxl
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill
-    EXPORT_AVAILABLE = True
-except ImportError:
-    EXPORT_AVAILABLE = False
-    logger.warning("openpyxl未安装，导出功能不可用")
+if not XLSX_AVAILABLE:
+    logger.warning("openpyxl未安装，Excel导出不可用（CSV导出不受影响）")
 
 
 @query_bp.route('/task/export', methods=['GET'])
 @require_auth
 def export_task_data():
     """
-    导出订单数据为Excel
+    导出订单数据为Excel/CSV
     
     参数：与task/page接口相同
     - status: 状态筛选
@@ -37,11 +40,19 @@ def export_task_data():
     - keyword: 视频标题关键词搜索
     - startDate: 开始日期
     - endDate: 结束日期
+    - format: 导出格式 xlsx/csv（默认xlsx）
     
-    返回：Excel文件流
+    数据通过服务端游标分块读取：
+    - CSV边读边写，直接流式返回
+    - Excel以只写模式写入临时文件，完成后分块返回
+    
+    返回：文件流
     """
-    if not EXPORT_AVAILABLE:
-        return error_response('导出功能不可用，请联系管理员安装openpyxl'), 500
+    export_format = (request.args.get('format') or 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return error_response(f'不支持的导出格式: {export_format}', code=400)
+    if export_format == 'xlsx' and not XLSX_AVAILABLE:
+        return error_response('Excel导出不可用，请联系管理员安装openpyxl，或使用format=csv'), 500
     
     user_id = request.user_id
     status = request.args.get('status')
@@ -52,153 +63,199 @@ def export_task_data():
     
     db = SessionLocal()
     try:
-        # 构建查询条件
-        where_conditions = [
-            "o.user_id = :user_id",
-            "o.deleted = 0",
-            "a.deleted = 0"
-        ]
-        params = {'user_id': user_id}
-        
-        if status:
-            where_conditions.append("o.status = :status")
-            params['status'] = status
-        
-        if account_id:
-            where_conditions.append("o.account_id = :account_id")
-            params['account_id'] = int(account_id)
-        
-        # 优化：支持视频ID精确匹配或标题模糊搜索
-        if keyword:
-            where_conditions.append("(o.item_id = :keyword OR o.aweme_title LIKE :keyword_like)")
-            params['keyword'] = keyword
-            params['keyword_like'] = f'%{keyword}%'
-        
-        if start_date:
-            where_conditions.append("DATE(o.order_create_time) >= :start_date")
-            params['start_date'] = start_date
+        # 构建查询条件（与task/page接口共用，时间筛选为半开区间）
+        try:
+            where_conditions, params = build_order_filters(
+                user_id, status, account_id, keyword, start_date, end_date, db=db
+            )
+        except ValueError as e:
+            db.close()
+            return error_response(str(e), code=400)
         
-        if end_date:
-            where_conditions.append("DATE(o.order_create_time) <= :end_date")
-            params['end_date'] = end_date
+        data_sql = build_export_sql(" AND ".join(where_conditions))
         
-        where_clause = " AND ".join(where_conditions)
+        if export_format == 'csv':
+            # CSV：边读边写，会话在生成器结束（或客户端断开）时关闭
+            def generate():
+                try:
+                    yield from iter_csv(iter_export_rows(db, data_sql, params))
+                except Exception as e:
+                    logger.error(f"导出数据失败: {e}", exc_info=True)
+                    raise
+                finally:
+                    db.close()
+            
+            body = stream_with_context(generate())
+        else:
+            # Excel为zip格式，需写完才能输出；只写模式下行数据直接落盘
+            try:
+                path = write_xlsx_tempfile(iter_export_rows(db, data_sql, params))
+            finally:
+                db.close()
+            body = iter_file_and_remove(path)
         
-        # 查询订单数据（带效果数据）
-        data_sql = f"""
-            SELECT 
-                o.order_id,
-                o.item_id,
-                o.status,
-                o.budget,
-                o.aweme_title,
-                a.nickname as account_nickname,
-                o.order_create_time,
-                oa.total_cost,
-                oa.total_play,
-                oa.total_like,
-                oa.total_comment,
-                oa.total_share,
-                oa.total_follow,
-                oa.total_convert,
-                oa.play_per_100_cost,
-                oa.avg_convert_cost,
-                oa.share_rate,
-                oa.play_duration_5s
-            FROM douplus_order o
-            INNER JOIN douyin_account a ON o.account_id = a.id
-            LEFT JOIN douplus_order_agg oa ON o.order_id = oa.order_id
-            WHERE {where_clause}
-            ORDER BY o.order_create_time DESC
-            LIMIT 10000
-        """
+        # 生成文件名（使用URL编码处理中文）
+        filename = f"订单数据_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        filename_encoded = quote(filename)
         
-        results = db.execute(text(data_sql), params).fetchall()
+        # 返回文件流
+        return Response(
+            body,
+            mimetype=EXPORT_MIMETYPES[export_format],
+            headers={
+                'Content-Disposition': f'attachment; filename*=UTF-8\'\'{filename_encoded}',
+                'Access-Control-Expose-Headers': 'Content-Disposition',
+                'X-Accel-Buffering': 'no'
+            }
+        )
         
-        # 创建Excel工作簿
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "订单数据"
+    except Exception as e:
+        db.close()
+        logger.error(f"导出数据失败: {e}", exc_info=True)
+        return error_response(f'导出失败: {str(e)}'), 500
+
+
+EXPORT_FILTER_KEYS = ('status', 'accountId', 'keyword', 'startDate', 'endDate')
+
+
+def _export_task_data(task: SyncTaskLog) -> dict:
+    """构造导出任务状态数据"""
+    return {
+        'taskId': task.id,
+        'format': task.sync_mode,
+        'status': task.status,
+        'totalRecords': task.total_records,
+        'exportedRecords': task.success_count,
+        'progressPercent': round(task.success_count / task.total_records * 100, 1) if task.total_records else 0,
+        'errorMessage': task.error_message,
+        'createTime': task.create_time.strftime('%Y-%m-%d %H:%M:%S') if task.create_time else None,
+        'endTime': task.end_time.strftime('%Y-%m-%d %H:%M:%S') if task.end_time else None,
+        'downloadUrl': f"{query_bp.url_prefix}/task/export/{task.id}/download" if task.status == 'completed' else None
+    }
+
+
+@query_bp.route('/task/export', methods=['POST'])
+@require_auth
+def create_export_task():
+    """
+    提交异步导出任务（适合大数据量导出，不占用接口线程）
+    
+    请求体（JSON）：与task/page接口的筛选参数相同，另加
+    - format: 导出格式 xlsx/csv（默认xlsx）
+    
+    返回：任务ID，通过 /task/export/<taskId> 轮询进度，完成后下载
+    """
+    user_id = request.user_id
+    data = request.get_json(silent=True) or {}
+    filters = {key: data.get(key) for key in EXPORT_FILTER_KEYS if data.get(key) not in (None, '')}
+    
+    export_format = (data.get('format') or 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return error_response(f'不支持的导出格式: {export_format}', code=400)
+    if export_format == 'xlsx' and not XLSX_AVAILABLE:
+        return error_response('Excel导出不可用，请联系管理员安装openpyxl，或使用format=csv')
+    
+    # 提前校验筛选参数（日期格式等），不探测视频ID
+    try:
+        build_order_filters(
+            user_id, filters.get('status'), filters.get('accountId'), filters.get('keyword'),
+            filters.get('startDate'), filters.get('endDate')
+        )
+    except ValueError as e:
+        return error_response(str(e), code=400)
+    
+    db = SessionLocal()
+    try:
+        task_log = SyncTaskLog(
+            user_id=user_id,
+            task_type='export',
+            sync_mode=export_format,
+            status='pending',
+            total_records=0,
+            success_count=0,
+            fail_count=0
+        )
+        db.add(task_log)
+        db.commit()
         
-        # 设置标题行样式
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True)
-        header_alignment = Alignment(horizontal="center", vertical="center")
+        from celery_app import app as celery_app
+        result = celery_app.send_task(
+            'app.tasks.export_job.export_orders',
+            args=[task_log.id, user_id, filters, export_format]
+        )
+        task_log.celery_task_id = result.id
+        db.commit()
         
-        # 定义表头
-        headers = [
-            "订单ID", "视频ID", "状态", "预算(元)", "视频标题", "账号",
-            "下单时间", "实际消耗(元)", "播放量", "点赞数", "评论数",
-            "转发数", "关注数", "转化数", "百播放量", "转化成本(元)",
-            "百转发率", "5秒完播率"
-        ]
+        logger.info(f"已提交导出任务: task_id={task_log.id}, user_id={user_id}, format={export_format}")
+        return success_response(_export_task_data(task_log), message='导出任务已提交')
         
-        # 写入表头
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = header_alignment
+    except Exception as e:
+        logger.error(f"提交导出任务失败: {e}", exc_info=True)
+        db.rollback()
+        return error_response(f'提交导出任务失败: {str(e)}')
+    finally:
+        db.close()
+
+
+@query_bp.route('/task/export/<int:task_id>', methods=['GET'])
+@require_auth
+def get_export_task(task_id):
+    """查询异步导出任务进度"""
+    db = SessionLocal()
+    try:
+        task = db.query(SyncTaskLog).filter(
+            SyncTaskLog.id == task_id,
+            SyncTaskLog.user_id == request.user_id,
+            SyncTaskLog.task_type == 'export'
+        ).first()
         
-        # 状态映射
-        status_map = {
-            'UNPAID': '未支付',
-            'AUDITING': '审核中',
-            'DELIVERING': '投放中',
-            'DELIVERIED': '已完成',
-            'UNDELIVERIED': '投放终止',
-            'AUDIT_PAUSE': '审核暂停',
-            'AUDIT_REJECTED': '审核不通过'
-        }
+        if not task:
+            return error_response('导出任务不存在', code=404)
         
-        # 写入数据
-        for row_num, row_data in enumerate(results, 2):
-            ws.cell(row=row_num, column=1, value=str(row_data[0]))  # 订单ID
-            ws.cell(row=row_num, column=2, value=str(row_data[1]))  # 视频ID
-            ws.cell(row=row_num, column=3, value=status_map.get(row_data[2], row_data[2]))  # 状态
-            ws.cell(row=row_num, column=4, value=float(row_data[3]) if row_data[3] else 0)  # 预算
-            ws.cell(row=row_num, column=5, value=str(row_data[4] or ''))  # 标题
-            ws.cell(row=row_num, column=6, value=str(row_data[5] or ''))  # 账号
-            ws.cell(row=row_num, column=7, value=row_data[6].strftime('%Y-%m-%d %H:%M') if row_data[6] else '')  # 时间
-            ws.cell(row=row_num, column=8, value=float(row_data[7]) if row_data[7] else 0)  # 消耗
-            ws.cell(row=row_num, column=9, value=int(row_data[8]) if row_data[8] else 0)  # 播放量
-            ws.cell(row=row_num, column=10, value=int(row_data[9]) if row_data[9] else 0)  # 点赞
-            ws.cell(row=row_num, column=11, value=int(row_data[10]) if row_data[10] else 0)  # 评论
-            ws.cell(row=row_num, column=12, value=int(row_data[11]) if row_data[11] else 0)  # 转发
-            ws.cell(row=row_num, column=13, value=int(row_data[12]) if row_data[12] else 0)  # 关注
-            ws.cell(row=row_num, column=14, value=int(row_data[13]) if row_data[13] else 0)  # 转化
-            ws.cell(row=row_num, column=15, value=float(row_data[14]) if row_data[14] else 0)  # 百播放量
-            ws.cell(row=row_num, column=16, value=float(row_data[15]) if row_data[15] else 0)  # 转化成本
-            ws.cell(row=row_num, column=17, value=float(row_data[16]) if row_data[16] else 0)  # 百转发率
-            ws.cell(row=row_num, column=18, value=float(row_data[17]) * 100 if row_data[17] else 0)  # 5秒完播率
+        return success_response(_export_task_data(task))
         
-        # 调整列宽
-        column_widths = [20, 20, 12, 12, 40, 15, 18, 12, 12, 10, 10, 10, 10, 10, 12, 12, 12, 12]
-        for col_num, width in enumerate(column_widths, 1):
-            ws.column_dimensions[chr(64 + col_num)].width = width
+    except Exception as e:
+        logger.error(f"查询导出任务失败: {e}")
+        return error_response(str(e))
+    finally:
+        db.close()
+
+
+@query_bp.route('/task/export/<int:task_id>/download', methods=['GET'])
+@require_auth
+def download_export_file(task_id):
+    """下载异步导出任务的结果文件"""
+    user_id = request.user_id
+    
+    db = SessionLocal()
+    try:
+        task = db.query(SyncTaskLog).filter(
+            SyncTaskLog.id == task_id,
+            SyncTaskLog.user_id == user_id,
+            SyncTaskLog.task_type == 'export'
+        ).first()
         
-        # 保存到内存
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        if not task:
+            return error_response('导出任务不存在', code=404)
+        if task.status != 'completed':
+            return error_response('导出任务尚未完成', code=409)
         
-        # 生成文件名（使用URL编码处理中文）
-        from urllib.parse import quote
-        filename = f"订单数据_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filename_encoded = quote(filename)
+        path = export_file_path(user_id, task.id, task.sync_mode)
+        if not os.path.exists(path):
+            return error_response('导出文件已过期，请重新导出', code=410)
         
-        # 返回文件流
-        return Response(
-            output.read(),
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={
-                'Content-Disposition': f'attachment; filename*=UTF-8\'\'{filename_encoded}',
-                'Access-Control-Expose-Headers': 'Content-Disposition'
-            }
+        filename = f"订单数据_{task.create_time.strftime('%Y%m%d_%H%M%S')}.{task.sync_mode}"
+        response = send_file(
+            path,
+            mimetype=EXPORT_MIMETYPES[task.sync_mode],
+            as_attachment=True,
+            download_name=filename
         )
+        response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition'
+        return response
         
     except Exception as e:
-        logger.error(f"导出数据失败: {e}", exc_info=True)
-        return error_response(f'导出失败: {str(e)}'), 500
+        logger.error(f"下载导出文件失败: {e}")
+        return error_response(str(e))
     finally:
         db.close()
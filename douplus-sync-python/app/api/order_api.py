@@ -12,16 +12,24 @@
 - 记录操作日志
 """
 
+import asyncio
 import logging
+import time
 from flask import request
 from sqlalchemy import text
 from app.api import order_bp
 from app.api.common import require_auth, success_response, error_response
 from app.models import SessionLocal
-from app.douyin_client import DouyinClient, DouyinAPIError
-from app.utils.crypto import decrypt_access_token
+from app.douyin_client import DouyinClient, AsyncDouyinClient, DouyinAPIError, run_async
+from app.utils.crypto import decrypt_access_token, decrypt_access_token_cached
+from app.utils.task_id_lookup import resolve_task_ids
+from app.config import get_settings
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 允许续费的订单状态
+RENEWABLE_STATUSES = ('DELIVERING', 'RUNNING')
 
 
 @order_bp.route('/task/renew', methods=['POST'])
@@ -84,7 +92,8 @@ def renew_order():
     try:
         # 1. 查询订单信息
         order_sql = text("""
-            SELECT o.id, o.order_id, o.account_id, o.status, a.aweme_sec_uid, a.access_token
+            SELECT o.id, o.order_id, o.account_id, o.status, a.aweme_sec_uid, a.access_token,
+                   o.task_id, o.order_create_time
             FROM douplus_order o
             INNER JOIN douyin_account a ON o.account_id = a.id
             WHERE o.order_id = :order_id AND o.user_id = :user_id AND o.deleted = 0
@@ -98,40 +107,27 @@ def renew_order():
         if not order:
             return error_response('订单不存在或无权限', code=404)
         
-        order_internal_id, db_order_id, account_id, status, aweme_sec_uid, token_encrypted = order
+        order_internal_id, db_order_id, account_id, status, aweme_sec_uid, token_encrypted, task_id, order_create_time = order
+        
+        # 2. 验证订单状态（只有投放中的订单可以续费）
+        if status not in RENEWABLE_STATUSES:
+            return error_response(f'订单状态为{status}，不允许续费', code=400)
         
         # 解密Access Token
-        access_token = decrypt_access_token(token_encrypted)
+        access_token = decrypt_access_token_cached(token_encrypted)
         
-        # ⚠️ 重要：从抖音API查询订单，获取真正的task_id
-        # 数据库存储的是order_id，但续费API需要task_id
-        client = DouyinClient(access_token=access_token)
-        try:
-            order_list = client.get_order_list(
-                aweme_sec_uid=aweme_sec_uid,
-                page=1,
-                page_size=50
-            )
-            
-            # 查找匹配的订单
-            task_id = None
-            for order_data in order_list:
-                if order_data.get("order", {}).get("order_id") == int(db_order_id):
-                    task_id = str(order_data.get("order", {}).get("task_id"))
-                    break
+        # ⚠️ 重要：续费API需要task_id（订单同步时已写入），缺失时才查订单列表API补全
+        if not task_id:
+            try:
+                task_id = resolve_task_ids(
+                    db, access_token, aweme_sec_uid, {str(db_order_id): order_create_time}
+                ).get(str(db_order_id))
+            except Exception as e:
+                logger.error(f"查询订单task_id失败: {e}")
+                return error_response(f'查询订单信息失败：{str(e)}', code=500)
             
             if not task_id:
                 return error_response('无法获取订单task_id，请重新同步订单数据', code=500)
-                
-        except Exception as e:
-            logger.error(f"查询订单task_id失败: {e}")
-            return error_response(f'查询订单信息失败：{str(e)}', code=500)
-        finally:
-            client.close()
-        
-        # 2. 验证订单状态（只有投放中的订单可以续费）
-        if status not in ['DELIVERING', 'RUNNING']:
-            return error_response(f'订单状态为{status}，不允许续费', code=400)
         
         # 3. 验证投放密码
         user_sql = text("""
@@ -229,15 +225,20 @@ def batch_renew_orders():
     - duration: 每个订单延长的时长（小时）
     - investPassword: 投放密码（可选）
     
+    执行方式：
+    - 一次查询取出所有订单及所属账号，按账号分组
+    - 每个账号一个客户端（共享连接池），续费请求并发执行，并发数不超过RENEW_MAX_CONCURRENCY
+    
     返回：
     - successCount: 成功续费的订单数
     - failedCount: 失败的订单数
-    - details: 每个订单的处理结果
+    - details: 每个订单的处理结果（与orderIds顺序一致）
     """
     user_id = request.user_id
     data = request.json
     
-    order_ids = data.get('orderIds', [])  # order_id列表
+    # 去重并保持顺序
+    order_ids = list(dict.fromkeys(str(order_id) for order_id in data.get('orderIds', [])))
     budget = float(data.get('budget', 0))
     duration = float(data.get('duration', 0))
     invest_password = data.get('investPassword')
@@ -252,9 +253,7 @@ def batch_renew_orders():
         return error_response('追加预算必须大于0', code=400)
     
     db = SessionLocal()
-    success_count = 0
-    failed_count = 0
-    details = []
+    details = {}
     
     try:
         # 2. 获取投放密码
@@ -282,77 +281,143 @@ def batch_renew_orders():
                     if invest_password != stored_password:
                         return error_response('投放密码错误', code=401)
         
-        # 3. 遍历处理每个订单
+        # 3. 一次查询所有订单信息（需要aweme_sec_uid和task_id）
+        order_sql = text("""
+            SELECT o.order_id, o.task_id, o.status, o.account_id,
+                   a.access_token, a.advertiser_id, a.aweme_sec_uid, o.order_create_time
+            FROM douplus_order o
+            JOIN douyin_account a ON o.account_id = a.id
+            WHERE o.order_id IN :order_ids AND o.user_id = :user_id AND o.deleted = 0
+        """)
+        orders = db.execute(order_sql, {'order_ids': tuple(order_ids), 'user_id': user_id}).fetchall()
+        
+        # 4. 校验订单并按账号分组（每个账号只解密一次Token）
+        accounts = {}
+        invalid_accounts = {}
+        found = set()
+        for dy_order_id, task_id, status, account_id, token_encrypted, advertiser_id, aweme_sec_uid, order_create_time in orders:
+            order_id = str(dy_order_id)
+            found.add(order_id)
+            
+            if status not in RENEWABLE_STATUSES:
+                details[order_id] = _renew_result(order_id, False, f'订单状态为{status}，不允许续费')
+                continue
+            if not aweme_sec_uid:
+                details[order_id] = _renew_result(order_id, False, '缺少抖音号ID（aweme_sec_uid）')
+                continue
+            if account_id in invalid_accounts:
+                details[order_id] = _renew_result(order_id, False, invalid_accounts[account_id])
+                continue
+            
+            if account_id not in accounts:
+                try:
+                    access_token = decrypt_access_token_cached(token_encrypted)
+                except Exception as e:
+                    logger.error(f"解密token失败: account_id={account_id}, error={e}")
+                    invalid_accounts[account_id] = f'处理异常：{str(e)}'
+                    details[order_id] = _renew_result(order_id, False, invalid_accounts[account_id])
+                    continue
+                accounts[account_id] = {
+                    'access_token': access_token,
+                    'advertiser_id': advertiser_id,
+                    'aweme_sec_uid': aweme_sec_uid,
+                    'orders': [],
+                    'missing': {}
+                }
+            if task_id:
+                accounts[account_id]['orders'].append((order_id, task_id))
+            else:
+                accounts[account_id]['missing'][order_id] = order_create_time
+        
+        # 缺失task_id的订单（历史数据），每个账号查一次订单列表API补全
+        for account_id, group in accounts.items():
+            missing = group.pop('missing')
+            if not missing:
+                continue
+            try:
+                resolved = resolve_task_ids(db, group['access_token'], group['aweme_sec_uid'], missing)
+            except Exception as e:
+                logger.error(f"查询订单task_id失败: account_id={account_id}, error={e}")
+                resolved = {}
+            for order_id in missing:
+                if order_id in resolved:
+                    group['orders'].append((order_id, resolved[order_id]))
+                else:
+                    details[order_id] = _renew_result(order_id, False, '无法获取订单task_id，请重新同步订单数据')
+        accounts = {account_id: group for account_id, group in accounts.items() if group['orders']}
+        db.close()  # 续费请求耗时较长，提前归还数据库连接
+        
         for order_id in order_ids:
+            if order_id not in found:
+                details[order_id] = _renew_result(order_id, False, '订单不存在或无权操作')
+        
+        # 5. 并发调用抖音DOU+续费API
+        if accounts:
+            start = time.time()
+            renew_count = sum(len(group['orders']) for group in accounts.values())
+            results = run_async(_renew_accounts(accounts, int(budget * 100), duration))
+            for result in results:
+                details[result['orderId']] = result
+            logger.info(f"批量续费请求完成: {renew_count}个订单, {len(accounts)}个账号, 耗时{time.time() - start:.2f}秒")
+        
+        # 6. 返回汇总结果
+        detail_list = [details[order_id] for order_id in order_ids]
+        success_count = sum(1 for d in detail_list if d['success'])
+        failed_count = len(detail_list) - success_count
+        
+        return success_response(
+            data={
+                'successCount': success_count,
+                'failedCount': failed_count,
+                'totalCount': len(order_ids),
+                'details': detail_list
+            },
+            message=f'批量续费完成：成功{success_count}个，失败{failed_count}个'
+        )
+        
+    except Exception as e:
+        logger.error(f"批量续费失败: {str(e)}")
+        return error_response(f'系统错误：{str(e)}', code=500)
+    finally:
+        db.close()
+
+
+def _renew_result(order_id: str, success: bool, message: str) -> dict:
+    """单个订单的续费结果"""
+    return {
+        'orderId': order_id,
+        'success': success,
+        'message': message
+    }
+
+
+async def _renew_accounts(accounts: dict, renewal_budget: int, duration: float) -> list:
+    """
+    并发续费多个账号的订单
+    
+    Args:
+        accounts: {account_id: {access_token, advertiser_id, aweme_sec_uid, orders: [(order_id, task_id)]}}
+        renewal_budget: 追加预算（分）
+        duration: 延长时长（小时）
+    
+    Returns:
+        list: 每个订单的续费结果
+    """
+    semaphore = asyncio.Semaphore(settings.RENEW_MAX_CONCURRENCY)
+    budget_yuan = renewal_budget / 100
+    success_message = f'续费成功！已追加{budget_yuan}元预算' + (f'，延长{duration}小时' if duration > 0 else '')
+    
+    async def renew_one(client, aweme_sec_uid, order_id, task_id):
+        async with semaphore:
             try:
-                # 3.1 查询订单信息（需要aweme_sec_uid）
-                order_sql = text("""
-                    SELECT o.order_id, o.status, a.open_id, a.access_token, a.advertiser_id, a.aweme_sec_uid
-                    FROM douplus_order o
-                    JOIN douyin_account a ON o.account_id = a.id
-                    WHERE o.order_id = :order_id AND o.user_id = :user_id AND o.deleted = 0
-                """)
-                order = db.execute(order_sql, {'order_id': order_id, 'user_id': user_id}).fetchone()
-                
-                if not order:
-                    details.append({
-                        'orderId': order_id,
-                        'success': False,
-                        'message': '订单不存在或无权操作'
-                    })
-                    failed_count += 1
-                    continue
-                
-                dy_order_id, status, open_id, token_encrypted, advertiser_id, aweme_sec_uid = order
-                
-                # 3.2 验证订单状态
-                if status not in ['DELIVERING', 'RUNNING']:
-                    details.append({
-                        'orderId': order_id,
-                        'success': False,
-                        'message': f'订单状态为{status}，不允许续费'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # 3.3 验证aweme_sec_uid
-                if not aweme_sec_uid:
-                    details.append({
-                        'orderId': order_id,
-                        'success': False,
-                        'message': '缺少抖音号ID（aweme_sec_uid）'
-                    })
-                    failed_count += 1
-                    continue
-                
-                # 3.4 解密Access Token
-                access_token = decrypt_access_token(token_encrypted)
-                
-                # 3.5 调用抖音DOU+续费API
-                client = DouyinClient(access_token)
-                
-                client.advertiser_id = advertiser_id
-                
-                # 将元转为分（抖音API要求单位为分）
-                renewal_budget = int(budget * 100)
-                
-                result = client.renew_order(
+                await client.renew_order(
                     aweme_sec_uid=aweme_sec_uid,
-                    task_id=dy_order_id,
+                    task_id=task_id,
                     renewal_budget=renewal_budget,
                     renewal_delivery_hour=duration
                 )
-                
-                details.append({
-                    'orderId': order_id,
-                    'success': True,
-                    'message': f'续费成功！已追加{budget}元预算' + (f'，延长{duration}小时' if duration > 0 else '')
-                })
-                success_count += 1
-                logger.info(f"订单续费成功: order_id={order_id}")
-                
-                client.close()
-                
+                logger.info(f"订单续费成功: order_id={order_id}, task_id={task_id}")
+                return _renew_result(order_id, True, success_message)
             except DouyinAPIError as e:
                 logger.error(f"订单{order_id}续费失败: {e}")
                 # 特殊处理：抖音API各种错误
@@ -363,34 +428,19 @@ def batch_renew_orders():
                     error_msg = '订单不存在或已结束'
                 elif 'code=50000' in error_msg or '服务内部错误' in error_msg:
                     error_msg = '抖音服务器暂时异常，请稍后重试'
-                details.append({
-                    'orderId': order_id,
-                    'success': False,
-                    'message': f'续费失败：{error_msg}'
-                })
-                failed_count += 1
+                return _renew_result(order_id, False, f'续费失败：{error_msg}')
             except Exception as e:
                 logger.error(f"订单{order_id}处理异常: {e}")
-                details.append({
-                    'orderId': order_id,
-                    'success': False,
-                    'message': f'处理异常：{str(e)}'
-                })
-                failed_count += 1
+                return _renew_result(order_id, False, f'处理异常：{str(e)}')
         
-        # 4. 返回汇总结果
-        return success_response(
-            data={
-                'successCount': success_count,
-                'failedCount': failed_count,
-                'totalCount': len(order_ids),
-                'details': details
-            },
-            message=f'批量续费完成：成功{success_count}个，失败{failed_count}个'
+    coroutines = []
+    for group in accounts.values():
+        # 每个账号一个客户端，底层共享进程级连接池
+        client = AsyncDouyinClient(group['access_token'])
+        client.advertiser_id = group['advertiser_id']
+        coroutines.extend(
+            renew_one(client, group['aweme_sec_uid'], order_id, task_id)
+            for order_id, task_id in group['orders']
         )
         
-    except Exception as e:
-        logger.error(f"批量续费失败: {str(e)}")
-        return error_response(f'系统错误：{str(e)}', code=500)
-    finally:
-        db.close()
+    return await asyncio.gather(*coroutines)
@@ -12,13 +12,18 @@
 - 响应时间<200ms
 """
 
+import base64
+import json
 import logging
 from datetime import datetime, timedelta
+from decimal import Decimal
 from flask import request
 from sqlalchemy import text
 from app.api import query_bp
 from app.api.common import require_auth, success_response, error_response, paginated_response
 from app.models import SessionLocal
+from app.utils.response_cache import cached_response, cached_value
+from app.utils.order_filters import build_order_filters
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +41,47 @@ def parse_time_period(period='all'):
         return None
 
 
+# 游标分页单页最大条数
+CURSOR_PAGE_MAX_SIZE = 500
+
+
+def encode_page_cursor(sort_field, sort_order, sort_value, row_id):
+    """
+    生成不透明的分页游标（排序值 + 订单主键）
+    
+    游标中记录排序方式，排序变化后旧游标失效
+    """
+    if isinstance(sort_value, datetime):
+        value = {'t': 'dt', 'v': sort_value.isoformat()}
+    elif isinstance(sort_value, Decimal):
+        value = {'t': 'num', 'v': str(sort_value)}
+    else:
+        value = {'t': 'raw', 'v': sort_value}
+    payload = json.dumps({'s': sort_field, 'o': sort_order, 'k': value, 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_page_cursor(cursor, sort_field, sort_order):
+    """
+    解析分页游标
+    
+    Returns:
+        tuple: (排序值, 订单主键)
+    
+    Raises:
+        ValueError: 游标无效或与当前排序方式不一致
+    """
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if payload['s'] != sort_field or payload['o'] != sort_order:
+        raise ValueError('排序方式已变化，请从第一页重新查询')
+    value = payload['k']
+    if value['t'] == 'dt':
+        return datetime.fromisoformat(value['v']), int(payload['id'])
+    if value['t'] == 'num':
+        return Decimal(value['v']), int(payload['id'])
+    return value['v'], int(payload['id'])
+
+
 @query_bp.route('/task/page', methods=['GET'])
 @require_auth
 def get_task_page():
@@ -48,10 +94,16 @@ def get_task_page():
     - status: 状态筛选
     - accountId: 账号筛选
     - keyword: 视频标题关键词搜索
-    - startDate: 开始日期（YYYY-MM-DD）
-    - endDate: 结束日期（YYYY-MM-DD）
+    - startDate: 开始日期（YYYY-MM-DD，包含）
+    - endDate: 结束日期（YYYY-MM-DD，包含）
     - sortField: 排序字段
     - sortOrder: 排序方向
+    - cursor: 游标分页（传空字符串取第一页，之后传上一页返回的nextCursor），不传时按pageNum分页
+    - withTotal: 游标分页时是否返回总数（缓存），默认不返回
+    
+    游标分页只有按createTime排序时能沿 (user_id, deleted, create_time, id) 索引直接定位，
+    每页耗时与页数无关；按效果数据、预算等排序时排序值不在索引中，
+    每页仍需对该用户的全部筛选结果排序（只省去OFFSET跳过的行）
     """
     user_id = request.user_id
     page_num = int(request.args.get('pageNum', 1))
@@ -63,46 +115,28 @@ def get_task_page():
     end_date = request.args.get('endDate')
     sort_field = request.args.get('sortField', 'createTime')
     sort_order = request.args.get('sortOrder', 'desc')
+    cursor = request.args.get('cursor')
+    use_cursor = cursor is not None
+    with_total = request.args.get('withTotal', 'false').lower() == 'true'
     
-    if page_size == -1:
+    if use_cursor:
+        # 游标分页：每页耗时与翻到第几页无关，单页条数有上限
+        if page_size <= 0 or page_size > CURSOR_PAGE_MAX_SIZE:
+            page_size = CURSOR_PAGE_MAX_SIZE
+    elif page_size == -1:
         page_size = 10000
     
     db = SessionLocal()
     try:
-        # 构建查询条件（包含账号表JOIN，过滤已解绑账号）
-        where_conditions = [
-            "o.user_id = :user_id", 
-            "o.deleted = 0",
-            "a.deleted = 0"  # 新增：过滤已解绑的账号
-        ]
-        params = {
-            'user_id': user_id,
-            'limit': page_size,
-            'offset': (page_num - 1) * page_size
-        }
-        
-        if status:
-            where_conditions.append("o.status = :status")
-            params['status'] = status
-        
-        if account_id:
-            where_conditions.append("o.account_id = :account_id")
-            params['account_id'] = int(account_id)
-        
-        # 优化：支持视频ID精确匹配或标题模糊搜索
-        if keyword:
-            where_conditions.append("(o.item_id = :keyword OR o.aweme_title LIKE :keyword_like)")
-            params['keyword'] = keyword
-            params['keyword_like'] = f'%{keyword}%'
-        
-        # 时间范围筛选
-        if start_date:
-            where_conditions.append("DATE(o.order_create_time) >= :start_date")
-            params['start_date'] = start_date
-        
-        if end_date:
-            where_conditions.append("DATE(o.order_create_time) <= :end_date")
-            params['end_date'] = end_date
+        # 构建查询条件（包含账号表JOIN，过滤已解绑账号；时间筛选为半开区间，可走索引）
+        try:
+            where_conditions, params = build_order_filters(
+                user_id, status, account_id, keyword, start_date, end_date, db=db
+            )
+        except ValueError as e:
+            return error_response(str(e), code=400)
+        params['limit'] = page_size
+        params['offset'] = (page_num - 1) * page_size
         
         where_clause = " AND ".join(where_conditions)
         
@@ -113,7 +147,17 @@ def get_task_page():
             INNER JOIN douyin_account a ON o.account_id = a.id
             WHERE {where_clause}
         """
-        total = db.execute(text(count_sql), params).fetchone()[0]
+        count_params = {k: v for k, v in params.items() if k not in ('limit', 'offset')}
+        if not use_cursor:
+            total = db.execute(text(count_sql), params).fetchone()[0]
+        elif with_total:
+            # 游标分页的总数可选，按筛选条件缓存，数据同步后随版本号失效
+            total = cached_value(
+                user_id, 'task_page_total', count_params,
+                lambda: db.execute(text(count_sql), count_params).fetchone()[0]
+            )
+        else:
+            total = None
         
         # 判断是否需要JOIN效果表进行排序
         effect_sort_fields = ['playCount', 'actualCost', 'likeCount', 'shareCount', 'commentCount', 
@@ -136,59 +180,74 @@ def get_task_page():
                     # 升序：空值排最后
                     sort_column = 'COALESCE(oa.avg_convert_cost, 999999)'
             else:
-                # 其他字段直接使用预聚合表的字段
+                # 其他字段直接使用预聚合表的字段（无效果数据的订单按0处理，游标比较需要非空值）
                 stats_field_mapping = {
-                    'playCount': 'oa.play_per_100_cost',  # 百播放量
-                    'actualCost': 'oa.total_cost',
-                    'likeCount': 'oa.total_like',
-                    'shareCount': 'oa.total_share',
-                    'commentCount': 'oa.total_comment',
-                    'followCount': 'oa.total_follow',
-                    'dpTargetConvertCnt': 'oa.total_convert',
-                    'shareRate': 'oa.share_rate'  # 百转发率
+                    'playCount': 'COALESCE(oa.play_per_100_cost, 0)',  # 百播放量
+                    'actualCost': 'COALESCE(oa.total_cost, 0)',
+                    'likeCount': 'COALESCE(oa.total_like, 0)',
+                    'shareCount': 'COALESCE(oa.total_share, 0)',
+                    'commentCount': 'COALESCE(oa.total_comment, 0)',
+                    'followCount': 'COALESCE(oa.total_follow, 0)',
+                    'dpTargetConvertCnt': 'COALESCE(oa.total_convert, 0)',
+                    'shareRate': 'COALESCE(oa.share_rate, 0)'  # 百转发率
                 }
-                sort_column = stats_field_mapping.get(sort_field, 'oa.total_cost')
+                sort_column = stats_field_mapping.get(sort_field, 'COALESCE(oa.total_cost, 0)')
             
-            # LEFT JOIN订单预聚合表（无需子查询），INNER JOIN账号表（过滤已解绑）
-            data_sql = f"""
-                SELECT 
-                    o.id, o.user_id, o.account_id, o.item_id, o.order_id, o.task_id,
-                    o.status, o.budget, o.duration, o.target_type,
-                    o.aweme_title, o.aweme_cover, o.aweme_nick, o.aweme_avatar,
-                    o.order_create_time, o.order_start_time, o.order_end_time,
-                    o.create_time, o.update_time
-                FROM douplus_order o
-                INNER JOIN douyin_account a ON o.account_id = a.id
-                LEFT JOIN douplus_order_agg oa ON o.order_id = oa.order_id
-                WHERE {where_clause}
-                ORDER BY {sort_column} {order_direction}
-                LIMIT :limit OFFSET :offset
-            """
+            # LEFT JOIN订单预聚合表（无需子查询）
+            stats_join = "LEFT JOIN douplus_order_agg oa ON o.order_id = oa.order_id"
         else:
             # 按订单表字段排序（如创建时间、预算等）
             order_mapping = {
                 'createTime': 'o.create_time',
-                'budget': 'o.budget',
-                'scheduledTime': 'o.order_create_time'
+                'budget': 'COALESCE(o.budget, 0)',
+                'scheduledTime': 'COALESCE(o.order_create_time, o.create_time)'
             }
-            order_column = order_mapping.get(sort_field, 'o.create_time')
-            
-            data_sql = f"""
-                SELECT 
-                    o.id, o.user_id, o.account_id, o.item_id, o.order_id, o.task_id,
-                    o.status, o.budget, o.duration, o.target_type,
-                    o.aweme_title, o.aweme_cover, o.aweme_nick, o.aweme_avatar,
-                    o.order_create_time, o.order_start_time, o.order_end_time,
-                    o.create_time, o.update_time
-                FROM douplus_order o
-                INNER JOIN douyin_account a ON o.account_id = a.id
-                WHERE {where_clause}
-                ORDER BY {order_column} {order_direction}
-                LIMIT :limit OFFSET :offset
-            """
+            sort_column = order_mapping.get(sort_field, 'o.create_time')
+            stats_join = ""
+        
+        # 游标分页：从上一页最后一条（排序值, id）之后继续，以id作为同值时的次序
+        if use_cursor and cursor:
+            try:
+                params['cursor_value'], params['cursor_id'] = decode_page_cursor(cursor, sort_field, sort_order.lower())
+            except Exception as e:
+                return error_response(f'无效的分页游标: {e}', code=400)
+            compare = '>' if order_direction == 'ASC' else '<'
+            # 行构造器比较，按createTime排序时可走索引范围扫描
+            where_clause += f"""
+                  AND ({sort_column}, o.id) {compare} (:cursor_value, :cursor_id)"""
+        
+        if use_cursor:
+            # 多取一条判断是否还有下一页
+            params['limit'] = page_size + 1
+            limit_clause = "LIMIT :limit"
+        else:
+            limit_clause = "LIMIT :limit OFFSET :offset"
+        
+        # INNER JOIN账号表（过滤已解绑）
+        data_sql = f"""
+            SELECT 
+                o.id, o.user_id, o.account_id, o.item_id, o.order_id, o.task_id,
+                o.status, o.budget, o.duration, o.target_type,
+                o.aweme_title, o.aweme_cover, o.aweme_nick, o.aweme_avatar,
+                o.order_create_time, o.order_start_time, o.order_end_time,
+                o.create_time, o.update_time,
+                {sort_column} as sort_value
+            FROM douplus_order o
+            INNER JOIN douyin_account a ON o.account_id = a.id
+            {stats_join}
+            WHERE {where_clause}
+            ORDER BY {sort_column} {order_direction}, o.id {order_direction}
+            {limit_clause}
+        """
         
         results = db.execute(text(data_sql), params).fetchall()
         
+        next_cursor = None
+        if use_cursor and len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            next_cursor = encode_page_cursor(sort_field, sort_order.lower(), last[19], last[0])
+        
         # 获取效果数据（从订单预聚合表）
         order_ids = [row[4] for row in results if row[4]]  # order_id字段
         video_stats_map = {}
@@ -270,6 +329,15 @@ def get_task_page():
             }
             records.append(record)
         
+        if use_cursor:
+            return success_response({
+                'records': records,
+                'total': total,
+                'pageSize': page_size,
+                'nextCursor': next_cursor,
+                'hasMore': next_cursor is not None
+            })
+        
         return paginated_response(records, total, page_num, page_size)
         
     except Exception as e:
@@ -292,6 +360,9 @@ def get_video_stats_by_account(account_id):
     - sortBy: 排序字段
     - sortOrder: 排序方向
     - pageNum/pageSize: 分页参数
+    
+    period筛选与/video/stats/all相同：只列出最早订单在时间段内创建的视频，
+    此时视频的累计指标只包含时间段内创建的订单，与统计卡片口径一致
     """
     user_id = request.user_id
     period = request.args.get('period', 'all')
@@ -322,7 +393,8 @@ def get_video_stats_by_account(account_id):
         params = {'account_id': account_id, 'user_id': user_id, 'limit': page_size, 'offset': (page_num - 1) * page_size}
         
         if start_time:
-            time_filter = "AND o.order_create_time >= :start_time"
+            # 视频的全部订单都在该时间段内创建（见接口说明）
+            time_filter = "AND v.min_order_create_time >= :start_time"
             params['start_time'] = start_time
         
         # 排序字段映射（包含计算字段）
@@ -342,54 +414,38 @@ def get_video_stats_by_account(account_id):
         sort_column = sort_mapping.get(sort_by, 'total_cost')
         sort_dir = 'ASC' if sort_order.lower() == 'asc' else 'DESC'
         
-        # 方案A：从预聚合表查询（5分钟粒度），按天聚合
-        # 优势：查询解耦，无JOIN，性能优异
+        # 从视频最新数据表查询：每个视频一行（按订单最新累计值汇总），无需跨窗口SUM和JOIN订单表
         video_sql = text(f"""
             SELECT 
                 v.item_id,
-                MAX(o.aweme_title) as title,
-                MAX(o.aweme_cover) as cover,
-                COUNT(DISTINCT o.order_id) as order_count,
-                COALESCE(SUM(o.budget), 0) as total_budget,
-                COALESCE(SUM(v.total_cost), 0) as total_cost,
-                COALESCE(SUM(v.total_play), 0) as total_play,
-                COALESCE(SUM(v.total_like), 0) as total_like,
-                COALESCE(SUM(v.total_comment), 0) as total_comment,
-                COALESCE(SUM(v.total_share), 0) as total_share,
-                COALESCE(SUM(v.total_follow), 0) as total_follow,
-                COALESCE(SUM(v.total_convert), 0) as total_convert,
-                CASE 
-                    WHEN SUM(v.total_cost) > 0 
-                    THEN SUM(v.total_play) / SUM(v.total_cost) * 100
-                    ELSE 0 
-                END as play_per_100_cost,
-                CASE 
-                    WHEN SUM(v.total_play) > 0 
-                    THEN SUM(v.total_share) / SUM(v.total_play) * 100
-                    ELSE 0 
-                END as share_per_100_play,
-                CASE 
-                    WHEN SUM(v.total_convert) > 0 
-                    THEN SUM(v.total_cost) / SUM(v.total_convert)
-                    ELSE 0 
-                END as avg_convert_cost
-            FROM douplus_video_stats_agg v
-            INNER JOIN douplus_order o ON v.item_id = o.item_id AND o.account_id = v.account_id
+                v.title,
+                v.cover,
+                v.order_count,
+                v.total_budget,
+                v.total_cost,
+                v.total_play,
+                v.total_like,
+                v.total_comment,
+                v.total_share,
+                v.total_follow,
+                v.total_convert,
+                v.play_per_100_cost,
+                v.share_per_100_play,
+                v.avg_convert_cost
+            FROM douplus_video_stats_latest v
             WHERE v.account_id = :account_id 
               AND v.user_id = :user_id
               {time_filter}
-            GROUP BY v.item_id
-            ORDER BY {sort_column} {sort_dir}
+            ORDER BY v.{sort_column} {sort_dir}
             LIMIT :limit OFFSET :offset
         """)
         
         results = db.execute(video_sql, params).fetchall()
         
-        # 查询总数（需要JOIN订单表才能按订单创建时间筛选）
+        # 查询总数
         count_sql = text(f"""
-            SELECT COUNT(DISTINCT v.item_id) 
-            FROM douplus_video_stats_agg v
-            INNER JOIN douplus_order o ON v.item_id = o.item_id AND o.account_id = v.account_id
+            SELECT COUNT(*) 
+            FROM douplus_video_stats_latest v
             WHERE v.account_id = :account_id 
               AND v.user_id = :user_id
               {time_filter}
@@ -415,6 +471,7 @@ def get_video_stats_by_account(account_id):
 
 @query_bp.route('/video/stats/all', methods=['GET'])
 @require_auth
+@cached_response()
 def get_all_video_stats():
     """
     获取所有账号的视频维度统计列表（支持时间维度 + 账号筛选）
@@ -424,7 +481,8 @@ def get_all_video_stats():
     - accountId: 筛选指定抖音账号的数据（可选）
     - sortBy/sortOrder/pageNum/pageSize: 排序和分页
     
-    修复：按订单创建时间筛选，从原始订单表聚合
+    period筛选：只列出最早订单在时间段内创建的视频。视频最新数据表保存的是累计值，
+    按最早订单筛选后，列出视频的指标只包含时间段内创建的订单，与统计卡片口径一致
     """
     user_id = request.user_id
     period = request.args.get('period', 'all')
@@ -440,19 +498,17 @@ def get_all_video_stats():
     try:
         # 筛选条件（包含账号过滤）
         time_filter = ""
-        account_filter_order = ""  # 用于主查询（有订单表JOIN）
-        account_filter_video = ""  # 用于COUNT查询（只有视频表）
+        account_filter_video = ""
         params = {'user_id': user_id, 'limit': page_size, 'offset': (page_num - 1) * page_size}
         
         # 如果指定了accountId，则筛选该账号的数据
         if account_id:
-            account_filter_order = "AND o.account_id = :account_id"
             account_filter_video = "AND v.account_id = :account_id"
             params['account_id'] = int(account_id)
         
         if start_time:
             # 修复：使用订单创建时间筛选，与统计卡片保持一致
-            time_filter = "AND o.order_create_time >= :start_time"
+            time_filter = "AND v.min_order_create_time >= :start_time"
             params['start_time'] = start_time
         
         # 排序字段映射（包含计算字段）
@@ -471,15 +527,14 @@ def get_all_video_stats():
         sort_column = sort_mapping.get(sort_by, 'total_cost')
         sort_dir = 'ASC' if sort_order.lower() == 'asc' else 'DESC'
         
-        # 使用预聚合表 + min_order_create_time精确筛选
-        # 核心：预聚合表新增了min_order_create_time字段，记录视频最早订单创建时间
-        # 优势：时间精度完全准确，与统计卡片完全一致
+        # 从视频最新数据表查询（每个视频每个账号一行），min_order_create_time精确筛选
+        # 核心：视频最早订单创建时间在时间段内，与统计卡片保持一致；多账号投放同一视频时按视频合并
         video_sql = text(f"""
             SELECT 
                 v.item_id,
-                MAX(o.aweme_title) as title,
-                MAX(o.aweme_cover) as cover,
-                MAX(v.order_count) as order_count,
+                MAX(v.title) as title,
+                MAX(v.cover) as cover,
+                SUM(v.order_count) as order_count,
                 COALESCE(SUM(v.total_cost), 0) as total_cost,
                 COALESCE(SUM(v.total_play), 0) as total_play,
                 COALESCE(SUM(v.total_like), 0) as total_like,
@@ -500,12 +555,12 @@ def get_all_video_stats():
                     WHEN SUM(v.total_convert) > 0 
                     THEN SUM(v.total_cost) / SUM(v.total_convert)
                     ELSE 0 
-                END as avg_convert_cost
-            FROM douplus_video_stats_agg v
-            INNER JOIN douplus_order o ON v.item_id = o.item_id AND v.account_id = o.account_id
+                END as avg_convert_cost,
+                COALESCE(SUM(v.total_convert), 0) as total_convert
+            FROM douplus_video_stats_latest v
             WHERE v.user_id = :user_id
-              {account_filter_video.replace('v.', 'v.')}
-              {time_filter.replace('o.order_create_time', 'v.min_order_create_time')}
+              {account_filter_video}
+              {time_filter}
             GROUP BY v.item_id
             ORDER BY {sort_column} {sort_dir}
             LIMIT :limit OFFSET :offset
@@ -516,10 +571,10 @@ def get_all_video_stats():
         # 统计总数（使用相同的筛选逻辑）
         count_sql = text(f"""
             SELECT COUNT(DISTINCT v.item_id)
-            FROM douplus_video_stats_agg v
+            FROM douplus_video_stats_latest v
             WHERE v.user_id = :user_id
               {account_filter_video}
-              {time_filter.replace('o.order_create_time', 'v.min_order_create_time')}
+              {time_filter}
         """)
         total = db.execute(count_sql, params).fetchone()[0]
         
@@ -537,6 +592,76 @@ def get_all_video_stats():
         db.close()
 
 
+
+@query_bp.route('/video/trend/<item_id>', methods=['GET'])
+@require_auth
+def get_video_trend(item_id):
+    """
+    获取视频效果数据趋势（累计值随时间变化）
+    
+    参数：
+    - period: 时间周期，today按小时汇总，其余按天汇总
+    - accountId: 筛选指定抖音账号的数据（可选）
+    
+    按时间段选择最粗的汇总层级，长周期只扫描日汇总表
+    """
+    user_id = request.user_id
+    period = request.args.get('period', '7d')
+    account_id = request.args.get('accountId')
+    
+    start_time = parse_time_period(period)
+    # today需要小时粒度，其余时间段日粒度足够
+    table = 'douplus_video_stats_hourly' if period == 'today' else 'douplus_video_stats_daily'
+    
+    db = SessionLocal()
+    try:
+        filters = ""
+        params = {'item_id': item_id, 'user_id': user_id}
+        if account_id:
+            filters += " AND t.account_id = :account_id"
+            params['account_id'] = int(account_id)
+        if start_time:
+            filters += " AND t.bucket_time >= :start_time"
+            params['start_time'] = start_time
+        
+        trend_sql = text(f"""
+            SELECT 
+                t.bucket_time,
+                COALESCE(SUM(t.total_cost), 0) as total_cost,
+                COALESCE(SUM(t.total_play), 0) as total_play,
+                COALESCE(SUM(t.total_like), 0) as total_like,
+                COALESCE(SUM(t.total_comment), 0) as total_comment,
+                COALESCE(SUM(t.total_share), 0) as total_share,
+                COALESCE(SUM(t.total_follow), 0) as total_follow,
+                COALESCE(SUM(t.total_convert), 0) as total_convert
+            FROM {table} t
+            WHERE t.item_id = :item_id
+              AND t.user_id = :user_id
+              {filters}
+            GROUP BY t.bucket_time
+            ORDER BY t.bucket_time
+        """)
+        
+        results = db.execute(trend_sql, params).fetchall()
+        
+        points = [{'time': r[0].isoformat() if r[0] else None,
+                   'totalCost': float(r[1]) if r[1] else 0, 'totalPlay': int(r[2]) if r[2] else 0,
+                   'totalLike': int(r[3]) if r[3] else 0, 'totalComment': int(r[4]) if r[4] else 0,
+                   'totalShare': int(r[5]) if r[5] else 0, 'totalFollow': int(r[6]) if r[6] else 0,
+                   'totalConvert': int(r[7]) if r[7] else 0} for r in results]
+        
+        return success_response({
+            'itemId': item_id,
+            'granularity': 'hour' if period == 'today' else 'day',
+            'points': points
+        })
+        
+    except Exception as e:
+        logger.error(f"查询视频趋势失败: {str(e)}")
+        return error_response(str(e))
+    finally:
+        db.close()
+
 @query_bp.route('/task/<int:task_id>', methods=['GET'])
 @require_auth
 def get_task_detail(task_id):
@@ -7,7 +7,7 @@
 3. 支持多时间周期（today/7d/30d/all）
 
 架构原则：
-- 从预聚合表douplus_video_stats_agg查询
+- 从预聚合表douplus_order_agg查询（每个订单一行最新效果数据）
 - 不做复杂JOIN，性能优先
 - 统一时间维度处理逻辑
 """
@@ -19,6 +19,7 @@ from sqlalchemy import text
 from app.api import stats_bp
 from app.api.common import require_auth, success_response, error_response, paginated_response
 from app.models import SessionLocal
+from app.utils.response_cache import cached_response
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +47,7 @@ def parse_time_period(period='all'):
 
 @stats_bp.route('/task/stats/<int:account_id>', methods=['GET'])
 @require_auth
+@cached_response()
 def get_account_stats(account_id):
     """
     获取指定账号的统计数据（支持时间维度）
@@ -90,30 +92,21 @@ def get_account_stats(account_id):
             params['start_time'] = start_time
         
         # 从原始订单表和效果表查询（按订单创建时间筛选）
-        # 修复：只JOIN每个订单的最新效果数据（避免重复）
+        # 每个订单的最新效果数据来自douplus_order_agg（效果数据写入时同步维护，每个订单一行）
         # 注意：使用COALESCE包裹SUM，确保无数据时返回0而不是NULL
         stats_sql = text(f"""
             SELECT 
-                COALESCE(SUM(COALESCE(s.stat_cost, 0)), 0) as total_cost,
+                COALESCE(SUM(COALESCE(s.total_cost, 0)), 0) as total_cost,
                 COALESCE(SUM(COALESCE(s.total_play, 0)), 0) as total_play,
-                COALESCE(SUM(COALESCE(s.custom_like, 0)), 0) as total_like,
-                COALESCE(SUM(COALESCE(s.dy_comment, 0)), 0) as total_comment,
-                COALESCE(SUM(COALESCE(s.dy_share, 0)), 0) as total_share,
-                COALESCE(SUM(COALESCE(s.dy_follow, 0)), 0) as total_follow,
-                COALESCE(SUM(COALESCE(s.dp_target_convert_cnt, 0)), 0) as total_convert,
+                COALESCE(SUM(COALESCE(s.total_like, 0)), 0) as total_like,
+                COALESCE(SUM(COALESCE(s.total_comment, 0)), 0) as total_comment,
+                COALESCE(SUM(COALESCE(s.total_share, 0)), 0) as total_share,
+                COALESCE(SUM(COALESCE(s.total_follow, 0)), 0) as total_follow,
+                COALESCE(SUM(COALESCE(s.total_convert, 0)), 0) as total_convert,
                 COUNT(DISTINCT o.item_id) as video_count,
                 COUNT(DISTINCT o.id) as order_count
             FROM douplus_order o
-            LEFT JOIN (
-                SELECT s1.order_id, s1.stat_cost, s1.total_play, s1.custom_like,
-                       s1.dy_comment, s1.dy_share, s1.dy_follow, s1.dp_target_convert_cnt
-                FROM douplus_order_stats s1
-                INNER JOIN (
-                    SELECT order_id, MAX(stat_time) as max_time
-                    FROM douplus_order_stats
-                    GROUP BY order_id
-                ) s2 ON s1.order_id = s2.order_id AND s1.stat_time = s2.max_time
-            ) s ON o.order_id = s.order_id
+            LEFT JOIN douplus_order_agg s ON o.order_id = s.order_id
             WHERE o.account_id = :account_id 
               AND o.user_id = :user_id 
               AND o.deleted = 0
@@ -150,6 +143,7 @@ def get_account_stats(account_id):
 
 @stats_bp.route('/task/stats', methods=['GET'])
 @require_auth
+@cached_response()
 def get_all_accounts_stats():
     """
     获取用户所有账号的汇总统计（支持时间维度 + 账号筛选）
@@ -184,31 +178,22 @@ def get_all_accounts_stats():
             params['start_time'] = start_time
         
         # 从原始订单表和效果表查询（按订单创建时间筛选，过滤已解绑账号）
-        # 修复：只JOIN每个订单的最新效果数据（避免重复）
+        # 每个订单的最新效果数据来自douplus_order_agg（效果数据写入时同步维护，每个订单一行）
         # 注意：使用COALESCE包裹SUM，确保无数据时返回0而不是NULL
         stats_sql = text(f"""
             SELECT 
-                COALESCE(SUM(COALESCE(s.stat_cost, 0)), 0) as total_cost,
+                COALESCE(SUM(COALESCE(s.total_cost, 0)), 0) as total_cost,
                 COALESCE(SUM(COALESCE(s.total_play, 0)), 0) as total_play,
-                COALESCE(SUM(COALESCE(s.custom_like, 0)), 0) as total_like,
-                COALESCE(SUM(COALESCE(s.dy_comment, 0)), 0) as total_comment,
-                COALESCE(SUM(COALESCE(s.dy_share, 0)), 0) as total_share,
-                COALESCE(SUM(COALESCE(s.dy_follow, 0)), 0) as total_follow,
-                COALESCE(SUM(COALESCE(s.dp_target_convert_cnt, 0)), 0) as total_convert,
+                COALESCE(SUM(COALESCE(s.total_like, 0)), 0) as total_like,
+                COALESCE(SUM(COALESCE(s.total_comment, 0)), 0) as total_comment,
+                COALESCE(SUM(COALESCE(s.total_share, 0)), 0) as total_share,
+                COALESCE(SUM(COALESCE(s.total_follow, 0)), 0) as total_follow,
+                COALESCE(SUM(COALESCE(s.total_convert, 0)), 0) as total_convert,
                 COUNT(DISTINCT o.item_id) as video_count,
                 COUNT(DISTINCT o.id) as order_count
             FROM douplus_order o
             INNER JOIN douyin_account a ON o.account_id = a.id
-            LEFT JOIN (
-                SELECT s1.order_id, s1.stat_cost, s1.total_play, s1.custom_like,
-                       s1.dy_comment, s1.dy_share, s1.dy_follow, s1.dp_target_convert_cnt
-                FROM douplus_order_stats s1
-                INNER JOIN (
-                    SELECT order_id, MAX(stat_time) as max_time
-                    FROM douplus_order_stats
-                    GROUP BY order_id
-                ) s2 ON s1.order_id = s2.order_id AND s1.stat_time = s2.max_time
-            ) s ON o.order_id = s.order_id
+            LEFT JOIN douplus_order_agg s ON o.order_id = s.order_id
             WHERE o.user_id = :user_id 
               AND o.deleted = 0
               AND a.deleted = 0
@@ -252,8 +237,8 @@ def get_dashboard():
     
     返回：用户全部统计数据
     """
-    # 复用全部统计接口
-    return get_user_all_stats()
+    # 复用全部统计接口（其响应缓存按请求路径区分，Dashboard同样走缓存）
+    return get_all_accounts_stats()
 
 
 @stats_bp.route('/video/rankings', methods=['GET'])
@@ -288,7 +273,7 @@ def refresh_account_stats(account_id):
         account_id: 抖音账号ID
     
     Returns:
-        同步的订单数量
+        同步的订单数量；该账号正在由其他任务同步时返回409
     """
     user_id = request.user_id
     
@@ -311,7 +296,9 @@ def refresh_account_stats(account_id):
         from app.tasks.stats_sync import sync_single_account_stats
         
         try:
-            sync_single_account_stats(account_id)
+            if sync_single_account_stats(account_id) is None:
+                # 账号正在由其他任务同步，本次没有刷新
+                return error_response('该账号的效果数据正在同步中，请稍后再试', 409)
             
             # 查询该账号有多少订单有效果数据
             count_sql = text("""
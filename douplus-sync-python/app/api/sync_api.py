@@ -218,7 +218,7 @@ def get_sync_history():
     查询用户的同步历史记录
     
     参数：
-    - taskType: 任务类型（order/stats），可选
+    - taskType: 任务类型（order/stats/export），可选
     - pageNum: 页码
     - pageSize: 每页条数
     
@@ -260,9 +260,15 @@ def get_sync_history():
             records.append({
                 'taskId': task.id,
                 'taskType': task.task_type,
-                'taskTypeName': '订单同步' if task.task_type == 'order' else '效果同步',
+                'taskTypeName': {
+                    'order': '订单同步',
+                    'export': '数据导出'
+                }.get(task.task_type, '效果同步'),
                 'syncMode': task.sync_mode,
-                'syncModeName': '全量' if task.sync_mode == 'full' else '增量',
+                'syncModeName': {
+                    'full': '全量',
+                    'incremental': '增量'
+                }.get(task.sync_mode, task.sync_mode),
                 'status': task.status,
                 'statusName': {
                     'pending': '等待中',
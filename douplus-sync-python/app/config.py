@@ -20,6 +20,18 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     
+    # 数据库连接池配置（每个进程独立）
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30  # 获取连接的最长等待时间（秒）
+    DB_POOL_RECYCLE: int = 3600  # 连接最长复用时间（秒），需小于MySQL wait_timeout
+    
+    # API服务配置（gunicorn，见gunicorn.conf.py）
+    API_BIND: str = "0.0.0.0:5000"
+    API_WORKERS: int = 0  # 进程数，0表示按CPU核数自动计算
+    API_THREADS: int = 8  # 每个进程的线程数，不应超过DB_POOL_SIZE + DB_MAX_OVERFLOW
+    API_TIMEOUT: int = 120  # 单个请求最长处理时间（秒），大数据量导出请使用异步导出
+    
     # 日志配置
     LOG_LEVEL: str = "INFO"
     LOG_PATH: str = "/opt/douplus/douplus-sync-python/logs"
@@ -27,6 +39,44 @@ class Settings(BaseSettings):
     # 同步配置
     SYNC_INCREMENTAL_DAYS: int = 7
     SYNC_FULL_DAYS: int = 90
+    SYNC_MAX_WORKERS: int = 8  # 多账号同步的最大并发数
+    SYNC_CURSOR_OVERLAP_MINUTES: int = 30  # 增量同步在高水位之前额外回看的分钟数
+    STATS_SETTLE_POLLS: int = 3  # 订单结束后再拉取几次效果数据，之后冻结不再拉取
+    VIDEO_AGG_DEBOUNCE_SECONDS: int = 30  # 效果数据同步后延迟多少秒合并执行视频聚合
+    VIDEO_AGG_REBUILD_WORKERS: int = 4  # 重建视频预聚合表的并行分片数
+    
+    # 巨量引擎API限流与重试配置
+    API_RATE_LIMIT_APP_QPS: float = 20  # 应用级总QPS（所有Worker共享）
+    API_RATE_LIMIT_ACCOUNT_QPS: float = 5  # 单账号QPS
+    API_MAX_RETRIES: int = 3  # 临时性错误最大重试次数
+    API_RETRY_BASE_DELAY: float = 0.5  # 重试退避基数（秒）
+    API_RETRY_MAX_DELAY: float = 8.0  # 单次重试最大等待（秒）
+    
+    # 账号凭证缓存
+    TOKEN_CACHE_TTL: int = 300  # 进程内缓存access_token的时间（秒），刷新token后通过Redis广播立即失效
+    
+    # 订单续费
+    RENEW_MAX_CONCURRENCY: int = 10  # 批量续费时同时进行的续费请求数（单账号QPS仍受API_RATE_LIMIT_ACCOUNT_QPS限制）
+    TASK_ID_LOOKUP_MAX_PAGES: int = 20  # 订单缺失task_id时，最多翻查订单列表API的页数
+    
+    # 订单列表关键词搜索
+    ORDER_FULLTEXT_SEARCH: bool = True  # 标题搜索使用ngram全文索引（需执行add_order_title_fulltext.sql），关闭后使用LIKE
+    
+    # 订单导出
+    EXPORT_CHUNK_SIZE: int = 2000  # 导出时服务端游标每次拉取的行数
+    EXPORT_DIR: str = "/opt/douplus/douplus-sync-python/exports"  # 异步导出文件目录
+    EXPORT_FILE_RETENTION_HOURS: int = 24  # 异步导出文件保留时间（小时）
+    
+    # 接口响应缓存
+    RESPONSE_CACHE_TTL: int = 300  # 统计类接口响应缓存时间（秒），数据变化时按版本号提前失效
+    
+    # Token刷新调度
+    TOKEN_REFRESH_LEAD_MINUTES: int = 30  # 在token过期前多少分钟刷新
+    TOKEN_REFRESH_SCAN_MINUTES: int = 30  # 扫描间隔（与celery_app中的定时任务一致），下一次扫描前到期的账号投递延时任务
+    TOKEN_REFRESH_MAX_WORKERS: int = 8  # 并发刷新的账号数
+    
+    # 同步任务租约（Redis），防止同一账号/同一定时任务重叠执行
+    SYNC_LEASE_TTL: int = 120  # 租约时长（秒），持有期间每1/3时长续期一次，Worker崩溃后最多该时长即可被重新获取
     
     # DOU+开发者配置（用于token刷新）
     DOUPLUS_APP_ID: str = ""
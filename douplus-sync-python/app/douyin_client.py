@@ -1,18 +1,51 @@
 """
 抖音DOU+ API客户端
 """
+import os
+import json
+import time
+import random
+import asyncio
+import threading
 import httpx
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from loguru import logger
 
+from app.config import get_settings
+from app.utils import rate_limiter
+
+
+settings = get_settings()
+
+# 频控类错误码：请求被平台直接拒绝、未执行，任何请求都可以安全重试
+RATE_LIMIT_CODES = {40100, 40110}
+# 平台临时故障错误码：只对幂等请求重试
+TRANSIENT_CODES = {50000, 50001, 50002}
+
 
 class DouyinAPIError(Exception):
-    """抖音API异常"""
-    pass
+    """
+    抖音API异常
+    
+    Attributes:
+        code: API错误码（HTTP层错误时为None）
+        retryable: 是否为临时性错误，可以重试
+        rejected: 请求是否确定未被执行（频控/未建立连接），非幂等请求也可以重试
+    """
+    
+    def __init__(self, message: str, code: int = None, retryable: bool = False, rejected: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.retryable = retryable
+        self.rejected = rejected
 
 
-class DouyinClient:
-    """抖音API客户端"""
+class _DouyinClientBase:
+    """
+    同步/异步客户端共用逻辑
+    
+    负责请求参数构造和响应解析，不涉及具体的HTTP传输
+    """
     
     BASE_URL = "https://api.oceanengine.com/open_api/v3.0"
     
@@ -24,19 +57,18 @@ class DouyinClient:
             access_token: 访问令牌
         """
         self.access_token = access_token
-        self.client = httpx.Client(timeout=30.0)
     
-    def _request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
+    def _prepare_request(self, method: str, endpoint: str, kwargs: Dict[str, Any]) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         """
-        发送HTTP请求
+        构造请求URL、请求头和参数
         
         Args:
             method: HTTP方法
             endpoint: API端点
-            **kwargs: 其他参数
+            kwargs: 其他参数
         
         Returns:
-            API响应数据
+            (url, headers, kwargs)
         """
         url = f"{self.BASE_URL}{endpoint}"
         headers = {
@@ -46,60 +78,94 @@ class DouyinClient:
         
         # 处理GET请求的params参数：嵌套对象需要JSON序列化
         if method.upper() == "GET" and "params" in kwargs:
-            import json
-            from six import string_types
             params = kwargs.pop("params")
             # 将非字符串的值（如dict、list）转为JSON字符串
             kwargs["params"] = {
-                k: v if isinstance(v, string_types) else json.dumps(v) 
+                k: v if isinstance(v, str) else json.dumps(v)
                 for k, v in params.items()
             }
         
-        try:
-            response = self.client.request(method, url, headers=headers, **kwargs)
-            response.raise_for_status()
-            
-            data = response.json()
-            code = data.get("code", -1)
-            
-            if code != 0:
-                error_msg = data.get("message", "Unknown error")
-                raise DouyinAPIError(f"API错误: code={code}, message={error_msg}")
-            
-            return data.get("data", {})
-            
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP请求失败: {e}")
-            raise DouyinAPIError(f"HTTP请求失败: {e}")
+        return url, headers, kwargs
     
-    def get_order_list(
-        self,
-        aweme_sec_uid: str,
-        page: int = 1,
-        page_size: int = 100
-    ) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _parse_response(response: httpx.Response) -> Dict[str, Any]:
         """
-        获取DOU+订单列表
+        解析API响应
         
         Args:
-            aweme_sec_uid: 账号secUid
-            page: 页码
-            page_size: 每页数量
+            response: HTTP响应
         
         Returns:
-            订单列表
+            API响应中的data字段
         """
-        endpoint = "/douplus/order/list/"
+        if response.status_code == 429:
+            raise DouyinAPIError("HTTP请求失败: 429 Too Many Requests", retryable=True, rejected=True)
+        if response.status_code >= 500:
+            raise DouyinAPIError(f"HTTP请求失败: {response.status_code}", retryable=True)
+        response.raise_for_status()
+        
+        data = response.json()
+        code = data.get("code", -1)
         
-        params = {
+        if code != 0:
+            error_msg = data.get("message", "Unknown error")
+            raise DouyinAPIError(
+                f"API错误: code={code}, message={error_msg}",
+                code=code,
+                retryable=code in RATE_LIMIT_CODES or code in TRANSIENT_CODES,
+                rejected=code in RATE_LIMIT_CODES
+            )
+        
+        return data.get("data", {})
+    
+    @staticmethod
+    def _wrap_http_error(e: httpx.HTTPError) -> DouyinAPIError:
+        """将httpx异常转换为DouyinAPIError，并标记是否可重试"""
+        logger.error(f"HTTP请求失败: {e}")
+        # 连接未建立，请求一定没有发出
+        rejected = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+        retryable = isinstance(e, httpx.TransportError)
+        return DouyinAPIError(f"HTTP请求失败: {e}", retryable=retryable, rejected=rejected)
+    
+    @staticmethod
+    def _rate_limit_key(kwargs: Dict[str, Any]) -> Optional[str]:
+        """从请求参数中取出账号标识，用于账号级限流"""
+        payload = kwargs.get("params") or kwargs.get("json") or {}
+        return payload.get("aweme_sec_uid")
+    
+    @staticmethod
+    def _retry_delay(error: DouyinAPIError, attempt: int, idempotent: bool) -> Optional[float]:
+        """
+        计算重试等待时间（指数退避 + 随机抖动）
+        
+        Args:
+            error: 本次请求的异常
+            attempt: 已重试次数（从0开始）
+            idempotent: 请求是否幂等；非幂等请求只在确定未执行时重试
+        
+        Returns:
+            等待秒数，不应重试时返回None
+        """
+        if not error.retryable or attempt >= settings.API_MAX_RETRIES:
+            return None
+        if not idempotent and not error.rejected:
+            return None
+        
+        delay = min(settings.API_RETRY_MAX_DELAY, settings.API_RETRY_BASE_DELAY * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+    
+    @staticmethod
+    def _order_list_params(aweme_sec_uid: str, page: int, page_size: int) -> Dict[str, Any]:
+        """构造订单列表请求参数"""
+        return {
             "aweme_sec_uid": aweme_sec_uid,
             "page": page,
             "page_size": page_size
         }
-        
-        logger.info(f"调用订单列表API: aweme_sec_uid={aweme_sec_uid}, page={page}")
-        
-        data = self._request("GET", endpoint, params=params)
+    
+    @staticmethod
+    def _parse_order_list(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """解析订单列表响应"""
         # 修复：API返回的字段是order_list，不是list
         orders = data.get("order_list", [])
         
@@ -114,27 +180,14 @@ class DouyinClient:
         
         return orders
     
-    def get_order_report(
-        self,
+    @staticmethod
+    def _order_report_body(
         aweme_sec_uid: str,
-        order_ids: Optional[List[str]] = None,
-        begin_time: Optional[str] = None,
-        end_time: Optional[str] = None
-    ) -> Dict[str, Dict[str, Any]]:
-        """
-        获取订单效果数据
-        
-        Args:
-            aweme_sec_uid: 账号secUid
-            order_ids: 订单ID列表(可选)
-            begin_time: 开始时间 YYYY-MM-DD
-            end_time: 结束时间 YYYY-MM-DD
-        
-        Returns:
-            订单效果数据字典 {order_id: stats}
-        """
-        endpoint = "/douplus/order/report/"
-        
+        order_ids: Optional[List[str]],
+        begin_time: Optional[str],
+        end_time: Optional[str]
+    ) -> Dict[str, Any]:
+        """构造效果报告请求参数"""
         # 根据官方文档，使用POST方法，参数通过request body传递
         body = {
             "aweme_sec_uid": aweme_sec_uid,
@@ -158,9 +211,11 @@ class DouyinClient:
                    f"order_count={len(order_ids) if order_ids else 'all'}, "
                    f"time_range={begin_time}~{end_time}")
         
-        data = self._request("GET", endpoint, params=body)
-        
-        # 解析返回数据
+        return body
+    
+    @staticmethod
+    def _parse_order_report(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """解析效果报告响应"""
         # 官方确认：正确结构为 data.order_metrics，不是 data.data
         result = {}
         for item in data.get("order_metrics", []):
@@ -194,6 +249,116 @@ class DouyinClient:
         logger.info(f"获取到{len(result)}条效果数据")
         return result
     
+    @staticmethod
+    def _renew_body(
+        aweme_sec_uid: str,
+        task_id: str,
+        renewal_budget: int,
+        renewal_delivery_hour: float
+    ) -> Dict[str, Any]:
+        """构造续费请求参数"""
+        logger.info(f"调用续费API: task_id={task_id}, budget={renewal_budget/100}元, hour={renewal_delivery_hour}, aweme_sec_uid={aweme_sec_uid}")
+        return {
+            "aweme_sec_uid": aweme_sec_uid,
+            "task_id": int(task_id),
+            "renewal_budget": renewal_budget,
+            "renewal_delivery_hour": renewal_delivery_hour
+        }
+
+
+class DouyinClient(_DouyinClientBase):
+    """抖音API客户端"""
+    
+    def __init__(self, access_token: str):
+        """
+        初始化客户端
+        
+        Args:
+            access_token: 访问令牌
+        """
+        super().__init__(access_token)
+        self.client = httpx.Client(timeout=30.0)
+    
+    def _request(self, method: str, endpoint: str, idempotent: bool = True, **kwargs) -> Dict[str, Any]:
+        """
+        发送HTTP请求（经过分布式限流，临时性错误自动重试）
+        
+        Args:
+            method: HTTP方法
+            endpoint: API端点
+            idempotent: 请求是否幂等，非幂等请求只在确定未执行时重试
+            **kwargs: 其他参数
+        
+        Returns:
+            API响应数据
+        """
+        url, headers, kwargs = self._prepare_request(method, endpoint, kwargs)
+        account_key = self._rate_limit_key(kwargs)
+        
+        attempt = 0
+        while True:
+            rate_limiter.acquire(account_key)
+            try:
+                response = self.client.request(method, url, headers=headers, **kwargs)
+                return self._parse_response(response)
+            except httpx.HTTPError as e:
+                error = self._wrap_http_error(e)
+            except DouyinAPIError as e:
+                error = e
+            
+            delay = self._retry_delay(error, attempt, idempotent)
+            if delay is None:
+                raise error
+            attempt += 1
+            logger.warning(f"请求失败，{delay:.2f}秒后第{attempt}次重试: endpoint={endpoint}, error={error}")
+            time.sleep(delay)
+    
+    def get_order_list(
+        self,
+        aweme_sec_uid: str,
+        page: int = 1,
+        page_size: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        获取DOU+订单列表
+        
+        Args:
+            aweme_sec_uid: 账号secUid
+            page: 页码
+            page_size: 每页数量
+        
+        Returns:
+            订单列表
+        """
+        logger.info(f"调用订单列表API: aweme_sec_uid={aweme_sec_uid}, page={page}")
+        
+        params = self._order_list_params(aweme_sec_uid, page, page_size)
+        data = self._request("GET", "/douplus/order/list/", params=params)
+        return self._parse_order_list(data)
+    
+    def get_order_report(
+        self,
+        aweme_sec_uid: str,
+        order_ids: Optional[List[str]] = None,
+        begin_time: Optional[str] = None,
+        end_time: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        获取订单效果数据
+        
+        Args:
+            aweme_sec_uid: 账号secUid
+            order_ids: 订单ID列表(可选)
+            begin_time: 开始时间 YYYY-MM-DD
+            end_time: 结束时间 YYYY-MM-DD
+        
+        Returns:
+            订单效果数据字典 {order_id: stats}
+        """
+        body = self._order_report_body(aweme_sec_uid, order_ids, begin_time, end_time)
+        data = self._request("GET", "/douplus/order/report/", params=body)
+        return self._parse_order_report(data)
+    
     def renew_order(
         self,
         aweme_sec_uid: str,
@@ -217,19 +382,10 @@ class DouyinClient:
         - 不可以仅增加投放时长（renewal_budget必须>0）
         - 可以仅增加投放预算（renewal_delivery_hour可以为0）
         """
-        endpoint = "/douplus/order/renew/"
-        
-        json_data = {
-            "aweme_sec_uid": aweme_sec_uid,
-            "task_id": int(task_id),
-            "renewal_budget": renewal_budget,
-            "renewal_delivery_hour": renewal_delivery_hour
-        }
-        
-        logger.info(f"调用续费API: task_id={task_id}, budget={renewal_budget/100}元, hour={renewal_delivery_hour}, aweme_sec_uid={aweme_sec_uid}")
+        json_data = self._renew_body(aweme_sec_uid, task_id, renewal_budget, renewal_delivery_hour)
         
         try:
-            data = self._request("POST", endpoint, json=json_data)
+            data = self._request("POST", "/douplus/order/renew/", idempotent=False, json=json_data)
             logger.info(f"续费成功: {data}")
             return data
         except DouyinAPIError as e:
@@ -239,3 +395,163 @@ class DouyinClient:
     def close(self):
         """关闭客户端"""
         self.client.close()
+
+
+# ==================== 异步客户端 ====================
+# 进程级共享的事件循环和连接池：所有账号复用同一个httpx.AsyncClient，
+# 保持keep-alive连接，避免每次同步都重新建立TLS连接
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+_shared_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取进程级后台事件循环（懒加载）
+    
+    Celery prefork模式下，fork后的子进程会重新创建自己的事件循环
+    """
+    global _loop, _loop_pid, _shared_async_client
+    
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _shared_async_client = None
+            threading.Thread(
+                target=_loop.run_forever,
+                name="douyin-async-loop",
+                daemon=True
+            ).start()
+        return _loop
+
+
+def get_shared_async_client() -> httpx.AsyncClient:
+    """
+    获取进程级共享的httpx.AsyncClient
+    
+    必须在run_async()驱动的事件循环内调用
+    """
+    global _shared_async_client
+    
+    if _shared_async_client is None:
+        _shared_async_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    return _shared_async_client
+
+
+def run_async(coro):
+    """
+    在进程级后台事件循环中执行协程并等待结果
+    
+    供同步代码（Celery任务、Flask接口）调用异步客户端
+    
+    Args:
+        coro: 协程对象
+    
+    Returns:
+        协程返回值
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+class AsyncDouyinClient(_DouyinClientBase):
+    """
+    抖音API异步客户端
+    
+    所有实例共享进程级连接池，实例本身只持有access_token，
+    可以为每个账号创建一个实例，无需关闭
+    """
+    
+    async def _request(self, method: str, endpoint: str, idempotent: bool = True, **kwargs) -> Dict[str, Any]:
+        """
+        发送HTTP请求（经过分布式限流，临时性错误自动重试）
+        
+        Args:
+            method: HTTP方法
+            endpoint: API端点
+            idempotent: 请求是否幂等，非幂等请求只在确定未执行时重试
+            **kwargs: 其他参数
+        
+        Returns:
+            API响应数据
+        """
+        url, headers, kwargs = self._prepare_request(method, endpoint, kwargs)
+        account_key = self._rate_limit_key(kwargs)
+        
+        attempt = 0
+        while True:
+            await rate_limiter.acquire_async(account_key)
+            try:
+                response = await get_shared_async_client().request(method, url, headers=headers, **kwargs)
+                return self._parse_response(response)
+            except httpx.HTTPError as e:
+                error = self._wrap_http_error(e)
+            except DouyinAPIError as e:
+                error = e
+            
+            delay = self._retry_delay(error, attempt, idempotent)
+            if delay is None:
+                raise error
+            attempt += 1
+            logger.warning(f"请求失败，{delay:.2f}秒后第{attempt}次重试: endpoint={endpoint}, error={error}")
+            await asyncio.sleep(delay)
+    
+    async def get_order_list(
+        self,
+        aweme_sec_uid: str,
+        page: int = 1,
+        page_size: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        获取DOU+订单列表（异步）
+        
+        参数和返回值同DouyinClient.get_order_list
+        """
+        logger.info(f"调用订单列表API(async): aweme_sec_uid={aweme_sec_uid}, page={page}")
+        
+        params = self._order_list_params(aweme_sec_uid, page, page_size)
+        data = await self._request("GET", "/douplus/order/list/", params=params)
+        return self._parse_order_list(data)
+    
+    async def get_order_report(
+        self,
+        aweme_sec_uid: str,
+        order_ids: Optional[List[str]] = None,
+        begin_time: Optional[str] = None,
+        end_time: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        获取订单效果数据（异步）
+        
+        参数和返回值同DouyinClient.get_order_report
+        """
+        body = self._order_report_body(aweme_sec_uid, order_ids, begin_time, end_time)
+        data = await self._request("GET", "/douplus/order/report/", params=body)
+        return self._parse_order_report(data)
+    
+    async def renew_order(
+        self,
+        aweme_sec_uid: str,
+        task_id: str,
+        renewal_budget: int,
+        renewal_delivery_hour: float
+    ) -> Dict[str, Any]:
+        """
+        续费DOU+订单（异步）
+        
+        参数和返回值同DouyinClient.renew_order
+        """
+        json_data = self._renew_body(aweme_sec_uid, task_id, renewal_budget, renewal_delivery_hour)
+        
+        try:
+            data = await self._request("POST", "/douplus/order/renew/", idempotent=False, json=json_data)
+            logger.info(f"续费成功: {data}")
+            return data
+        except DouyinAPIError as e:
+            logger.error(f"续费失败: {e}")
+            raise
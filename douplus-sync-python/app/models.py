@@ -1,7 +1,7 @@
 """
 数据库ORM模型
 """
-from sqlalchemy import Column, BigInteger, String, DateTime, Integer, DECIMAL, Float, Text, create_engine, SmallInteger
+from sqlalchemy import Column, BigInteger, String, DateTime, Integer, DECIMAL, Float, Text, create_engine, SmallInteger, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime
@@ -9,14 +9,15 @@ from app.config import get_settings
 
 Base = declarative_base()
 
-# 数据库引擎
+# 数据库引擎（连接池为每个进程独立，多进程部署时总连接数 = 进程数 × (pool_size + max_overflow)）
 settings = get_settings()
 engine = create_engine(
     settings.database_url,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
     pool_pre_ping=True,
-    pool_recycle=3600,
+    pool_recycle=settings.DB_POOL_RECYCLE,
     echo=False
 )
 
@@ -24,6 +25,30 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def warm_up_pool(size: int = None) -> int:
+    """
+    预先建立数据库连接，避免服务启动后的首批请求等待建连
+    
+    Args:
+        size: 预热连接数，默认DB_POOL_SIZE
+    
+    Returns:
+        成功建立的连接数
+    """
+    size = min(size or settings.DB_POOL_SIZE, settings.DB_POOL_SIZE)
+    connections = []
+    try:
+        for _ in range(size):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            connections.append(conn)
+    finally:
+        # 归还连接池，连接保持打开供后续请求复用
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+
 def get_db() -> Session:
     """获取数据库会话"""
     db = SessionLocal()
@@ -81,6 +106,10 @@ class DouyinAccount(Base):
     deleted = Column(Integer, default=0)
 
 
+# 订单终态：投放完成/投放终止/审核不通过，进入终态后订单信息不再变化
+ORDER_TERMINAL_STATUSES = ('DELIVERIED', 'UNDELIVERIED', 'AUDIT_REJECTED')
+
+
 class DouplusOrder(Base):
     """DOU+订单基础表"""
     __tablename__ = 'douplus_order'
@@ -110,9 +139,22 @@ class DouplusOrder(Base):
     last_sync_time = Column(DateTime)
     sync_source = Column(String(32), default='API')
     
+    stats_final_polls = Column(Integer, default=0)  # 进入终态后已拉取效果数据的次数
+    stats_frozen = Column(SmallInteger, default=0)  # 1=效果数据已稳定，不再拉取
+    
     create_time = Column(DateTime, default=datetime.now)
     update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     deleted = Column(Integer, default=0)
+    
+    # 联合索引和全文索引（见migrations/add_order_composite_indexes.sql、add_stats_freeze_to_order.sql、add_order_title_fulltext.sql）
+    __table_args__ = (
+        Index('idx_user_deleted_order_create', 'user_id', 'deleted', 'order_create_time'),
+        Index('idx_user_deleted_create', 'user_id', 'deleted', 'create_time'),
+        Index('idx_account_status', 'account_id', 'status'),
+        Index('idx_account_deleted_order_create', 'account_id', 'deleted', 'order_create_time'),
+        Index('idx_account_stats_frozen', 'account_id', 'stats_frozen'),
+        Index('ft_aweme_title', 'aweme_title', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
 
 
 class DouplusOrderStats(Base):
@@ -145,7 +187,7 @@ class DouplusOrderStats(Base):
     live_follow_count = Column(Integer, default=0)
     live_gift_cnt = Column(Integer, default=0)
     
-    sync_time = Column(DateTime)
+    sync_time = Column(DateTime, index=True)
     create_time = Column(DateTime, default=datetime.now)
     update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -218,14 +260,104 @@ class DouplusVideoStatsAgg(Base):
     update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class DouplusVideoStatsHourly(Base):
+    """视频维度效果数据小时汇总表（每小时最后一个窗口的快照）"""
+    __tablename__ = 'douplus_video_stats_hourly'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    item_id = Column(String(64), nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    
+    bucket_time = Column(DateTime, nullable=False)  # 整点时间
+    snapshot_time = Column(DateTime, nullable=False)  # 该时段内最后一个5分钟窗口（累计值快照）
+    
+    order_count = Column(Integer, default=0)
+    total_budget = Column(DECIMAL(10, 2), default=0)
+    total_cost = Column(DECIMAL(10, 2), default=0)
+    total_play = Column(BigInteger, default=0)
+    total_like = Column(BigInteger, default=0)
+    total_comment = Column(BigInteger, default=0)
+    total_share = Column(BigInteger, default=0)
+    total_follow = Column(BigInteger, default=0)
+    total_convert = Column(BigInteger, default=0)
+    
+    play_per_100_cost = Column(DECIMAL(10, 2))
+    share_per_100_play = Column(DECIMAL(10, 2))
+    avg_convert_cost = Column(DECIMAL(10, 2))
+    
+    update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class DouplusVideoStatsDaily(Base):
+    """视频维度效果数据日汇总表（每天最后一个窗口的快照）"""
+    __tablename__ = 'douplus_video_stats_daily'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    item_id = Column(String(64), nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    
+    bucket_time = Column(DateTime, nullable=False)  # 当天零点
+    snapshot_time = Column(DateTime, nullable=False)  # 该时段内最后一个5分钟窗口（累计值快照）
+    
+    order_count = Column(Integer, default=0)
+    total_budget = Column(DECIMAL(10, 2), default=0)
+    total_cost = Column(DECIMAL(10, 2), default=0)
+    total_play = Column(BigInteger, default=0)
+    total_like = Column(BigInteger, default=0)
+    total_comment = Column(BigInteger, default=0)
+    total_share = Column(BigInteger, default=0)
+    total_follow = Column(BigInteger, default=0)
+    total_convert = Column(BigInteger, default=0)
+    
+    play_per_100_cost = Column(DECIMAL(10, 2))
+    share_per_100_play = Column(DECIMAL(10, 2))
+    avg_convert_cost = Column(DECIMAL(10, 2))
+    
+    update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class DouplusVideoStatsLatest(Base):
+    """视频维度最新效果数据表（按订单最新累计值汇总，每个视频每个账号一行）"""
+    __tablename__ = 'douplus_video_stats_latest'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    item_id = Column(String(64), nullable=False)
+    account_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    
+    title = Column(String(500))
+    cover = Column(String(500))
+    
+    order_count = Column(Integer, default=0)
+    total_budget = Column(DECIMAL(10, 2), default=0)
+    total_cost = Column(DECIMAL(10, 2), default=0)
+    total_play = Column(BigInteger, default=0)
+    total_like = Column(BigInteger, default=0)
+    total_comment = Column(BigInteger, default=0)
+    total_share = Column(BigInteger, default=0)
+    total_follow = Column(BigInteger, default=0)
+    total_convert = Column(BigInteger, default=0)
+    
+    play_per_100_cost = Column(DECIMAL(10, 2))
+    share_per_100_play = Column(DECIMAL(10, 2))
+    avg_convert_cost = Column(DECIMAL(10, 2))
+    
+    min_order_create_time = Column(DateTime)  # 最早订单创建时间
+    max_order_create_time = Column(DateTime)  # 最新订单创建时间
+    stat_time = Column(DateTime)  # 最新效果数据的统计时间
+    update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
 class SyncTaskLog(Base):
     """同步任务日志表"""
     __tablename__ = 'sync_task_log'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, nullable=False)
-    task_type = Column(String(20), nullable=False)  # order/stats
-    sync_mode = Column(String(20))  # full/incremental
+    task_type = Column(String(20), nullable=False)  # order/stats/export
+    sync_mode = Column(String(20))  # full/incremental，导出任务为导出格式xlsx/csv
     status = Column(String(20), nullable=False, default='pending')  # pending/running/completed/failed
     total_accounts = Column(Integer, default=0)
     completed_accounts = Column(Integer, default=0)
@@ -248,10 +380,22 @@ class SyncTaskDetail(Base):
     task_id = Column(BigInteger, nullable=False)
     account_id = Column(BigInteger, nullable=False)
     account_name = Column(String(100))
-    status = Column(String(20), nullable=False, default='pending')  # pending/running/completed/failed
+    status = Column(String(20), nullable=False, default='pending')  # pending/running/completed/failed/skipped
     record_count = Column(Integer, default=0)
     error_message = Column(Text)
     start_time = Column(DateTime)
     end_time = Column(DateTime)
     create_time = Column(DateTime, default=datetime.now)
     update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class SyncCursor(Base):
+    """同步游标表（增量同步/增量聚合的高水位）"""
+    __tablename__ = 'douplus_sync_cursor'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    cursor_key = Column(String(100), unique=True, nullable=False)  # 如 order_sync:{account_id}
+    cursor_time = Column(DateTime)  # 时间高水位
+    cursor_value = Column(String(255))  # 辅助值（如最新order_id）
+    create_time = Column(DateTime, default=datetime.now)
+    update_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,144 @@
+"""
+订单异步导出任务
+
+流程：
+1. 接口创建 SyncTaskLog（task_type='export'，sync_mode=导出格式）并提交任务
+2. Worker按筛选条件用服务端游标分块读取，写入 EXPORT_DIR/{user_id}/{task_id}.{格式}
+3. 进度写回 SyncTaskLog：total_records=待导出行数，success_count=已写入行数
+4. 前端轮询状态，完成后通过下载接口获取文件
+"""
+import os
+import time
+from datetime import datetime
+from sqlalchemy import text
+from loguru import logger
+
+from app.models import SyncTaskLog, get_db
+from app.utils.order_filters import build_order_filters
+from app.utils.export_writer import build_export_sql, iter_export_rows, write_xlsx, write_csv
+from app.config import get_settings
+
+
+settings = get_settings()
+
+# 每写入多少行更新一次进度
+PROGRESS_INTERVAL = 5000
+
+
+def export_file_path(user_id: int, task_id: int, export_format: str) -> str:
+    """导出文件路径"""
+    return os.path.join(settings.EXPORT_DIR, str(user_id), f"{task_id}.{export_format}")
+
+
+def _update_export_task(task_id: int, **fields):
+    """
+    更新导出任务记录
+    
+    使用独立会话：导出会话上的服务端游标未读完前不能执行其他语句
+    """
+    db = get_db()
+    try:
+        db.query(SyncTaskLog).filter(SyncTaskLog.id == task_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def export_orders(task_id: int, user_id: int, filters: dict, export_format: str = 'xlsx'):
+    """
+    导出订单数据到文件
+    
+    Args:
+        task_id: 导出任务ID（SyncTaskLog.id）
+        user_id: 用户ID
+        filters: 筛选条件（status/accountId/keyword/startDate/endDate，与task/page接口相同）
+        export_format: 导出格式 xlsx/csv
+    """
+    start = time.time()
+    path = export_file_path(user_id, task_id, export_format)
+    part_path = path + '.part'
+    db = get_db()
+    
+    try:
+        _update_export_task(task_id, status='running', start_time=datetime.now())
+        
+        where_conditions, params = build_order_filters(
+            user_id,
+            filters.get('status'),
+            filters.get('accountId'),
+            filters.get('keyword'),
+            filters.get('startDate'),
+            filters.get('endDate'),
+            db=db
+        )
+        where_clause = " AND ".join(where_conditions)
+        
+        total = db.execute(text(f"""
+            SELECT COUNT(*)
+            FROM douplus_order o
+            INNER JOIN douyin_account a ON o.account_id = a.id
+            WHERE {where_clause}
+        """), params).scalar() or 0
+        _update_export_task(task_id, total_records=total)
+        
+        def rows_with_progress():
+            written = 0
+            for row in iter_export_rows(db, build_export_sql(where_clause), params):
+                yield row
+                written += 1
+                if written % PROGRESS_INTERVAL == 0:
+                    _update_export_task(task_id, success_count=written)
+        
+        # 先写临时文件，完成后原子替换，下载接口不会读到半截文件
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if export_format == 'csv':
+            with open(part_path, 'wb') as f:
+                count = write_csv(rows_with_progress(), f)
+        else:
+            count = write_xlsx(rows_with_progress(), part_path)
+        os.replace(part_path, path)
+        
+        _update_export_task(
+            task_id,
+            status='completed',
+            total_records=count,
+            success_count=count,
+            end_time=datetime.now()
+        )
+        logger.info(f"导出任务{task_id}完成: {count}行, 耗时{time.time() - start:.1f}秒, 文件={path}")
+        return {'task_id': task_id, 'rows': count, 'path': path}
+    
+    except Exception as e:
+        logger.error(f"导出任务{task_id}失败: {e}", exc_info=True)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        _update_export_task(
+            task_id,
+            status='failed',
+            error_message=str(e)[:500],
+            end_time=datetime.now()
+        )
+    finally:
+        db.close()
+
+
+def cleanup_expired_exports():
+    """清理超过保留时间的导出文件"""
+    if not os.path.isdir(settings.EXPORT_DIR):
+        return 0
+    
+    expire_before = time.time() - settings.EXPORT_FILE_RETENTION_HOURS * 3600
+    removed = 0
+    for root, _, files in os.walk(settings.EXPORT_DIR):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(file_path) < expire_before:
+                    os.remove(file_path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"清理导出文件失败: {file_path}, error={e}")
+    
+    if removed:
+        logger.info(f"已清理{removed}个过期导出文件")
+    return removed
@@ -5,117 +5,264 @@
 1. 从douplus_order_stats明细表聚合数据到douplus_order_agg
 2. 计算百播放量、转化成本等指标
 3. 避免查询时多层JOIN，提升性能
+4. 增量聚合：按douplus_order_stats.sync_time高水位只处理有变化的订单
+5. 写入时聚合：效果数据同步时直接计算并写入预聚合行（见build_order_agg_values）
 """
 
 import logging
-from sqlalchemy import text
-from app.models import get_db
-from datetime import datetime
+from sqlalchemy import text, case
+from sqlalchemy.dialects.mysql import insert
+from app.models import DouplusOrderAgg, get_db
+from app.utils.sync_cursor import get_cursor, save_cursor
+from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
 
-def aggregate_order_stats():
+# 增量聚合高水位的游标键
+ORDER_AGG_CURSOR_KEY = 'order_agg'
+# 高水位回看缓冲：效果数据在sync_time之后才提交，回看一段时间避免漏掉
+ORDER_AGG_OVERLAP_MINUTES = 10
+# 每条聚合语句处理的订单数
+ORDER_AGG_CHUNK_SIZE = 1000
+
+# 订单预聚合SQL（INSERT ... SELECT部分），注意：抖音API返回的效果数据是全量累计值，不是增量，所以取最新一条记录
+_AGG_INSERT_SELECT = """
+    INSERT INTO douplus_order_agg (
+        order_id, item_id, account_id,
+        total_cost, total_play, total_like, total_comment, total_share, 
+        total_follow, total_convert, play_duration_5s,
+        play_per_100_cost, avg_convert_cost, share_rate, like_rate, follow_rate,
+        stat_time
+    )
+    SELECT 
+        s.order_id,
+        s.item_id,
+        o.account_id,
+        
+        -- 原始指标：取最新值（因为API返回的是全量累计，不是增量）
+        s.stat_cost as total_cost,
+        s.total_play as total_play,
+        s.custom_like as total_like,
+        s.dy_comment as total_comment,
+        s.dy_share as total_share,
+        s.dy_follow as total_follow,
+        s.dp_target_convert_cnt as total_convert,
+        s.play_duration_5s_rank as play_duration_5s,
+        
+        -- 预聚合计算指标
+        CASE 
+            WHEN s.stat_cost > 0 
+            THEN s.total_play / s.stat_cost * 100 
+            ELSE 0 
+        END as play_per_100_cost,
+        
+        CASE 
+            WHEN s.dp_target_convert_cnt > 0 
+            THEN s.stat_cost / s.dp_target_convert_cnt
+            ELSE NULL 
+        END as avg_convert_cost,
+        
+        CASE 
+            WHEN s.total_play > 0 
+            THEN s.dy_share / s.total_play * 100 
+            ELSE 0 
+        END as share_rate,
+        
+        CASE 
+            WHEN s.total_play > 0 
+            THEN s.custom_like / s.total_play
+            ELSE 0 
+        END as like_rate,
+        
+        CASE 
+            WHEN s.total_play > 0 
+            THEN s.dy_share / s.total_play
+            ELSE 0 
+        END as follow_rate,
+        
+        s.stat_time as stat_time
+"""
+
+_AGG_ON_DUPLICATE = """
+    ON DUPLICATE KEY UPDATE
+        account_id = VALUES(account_id),
+        total_cost = VALUES(total_cost),
+        total_play = VALUES(total_play),
+        total_like = VALUES(total_like),
+        total_comment = VALUES(total_comment),
+        total_share = VALUES(total_share),
+        total_follow = VALUES(total_follow),
+        total_convert = VALUES(total_convert),
+        play_duration_5s = VALUES(play_duration_5s),
+        play_per_100_cost = VALUES(play_per_100_cost),
+        avg_convert_cost = VALUES(avg_convert_cost),
+        share_rate = VALUES(share_rate),
+        like_rate = VALUES(like_rate),
+        follow_rate = VALUES(follow_rate),
+        stat_time = VALUES(stat_time),
+        update_time = CURRENT_TIMESTAMP
+"""
+
+
+def _build_agg_sql(latest_filter: str = "", outer_filter: str = ""):
     """
-    聚合所有订单的效果数据到预聚合表
+    构造订单预聚合SQL
     
-    执行频率：效果数据同步后立即执行
+    Args:
+        latest_filter: 取每个订单最新效果数据子查询的WHERE条件
+        outer_filter: 外层WHERE条件
     """
-    db = get_db()
-    try:
-        # 使用INSERT ... ON DUPLICATE KEY UPDATE聚合数据
-        # 注意：抖音API返回的效果数据是全量累计值，不是增量，所以取最新一条记录
-        sql = text("""
-            INSERT INTO douplus_order_agg (
-                order_id, item_id, account_id,
-                total_cost, total_play, total_like, total_comment, total_share, 
-                total_follow, total_convert, play_duration_5s,
-                play_per_100_cost, avg_convert_cost, share_rate, like_rate, follow_rate,
-                stat_time
-            )
-            SELECT 
-                s.order_id,
-                s.item_id,
-                o.account_id,
-                
-                -- 原始指标：取最新值（因为API返回的是全量累计，不是增量）
-                s.stat_cost as total_cost,
-                s.total_play as total_play,
-                s.custom_like as total_like,
-                s.dy_comment as total_comment,
-                s.dy_share as total_share,
-                s.dy_follow as total_follow,
-                s.dp_target_convert_cnt as total_convert,
-                s.play_duration_5s_rank as play_duration_5s,
-                
-                -- 预聚合计算指标
-                CASE 
-                    WHEN s.stat_cost > 0 
-                    THEN s.total_play / s.stat_cost * 100 
-                    ELSE 0 
-                END as play_per_100_cost,
-                
-                CASE 
-                    WHEN s.dp_target_convert_cnt > 0 
-                    THEN s.stat_cost / s.dp_target_convert_cnt
-                    ELSE NULL 
-                END as avg_convert_cost,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.dy_share / s.total_play * 100 
-                    ELSE 0 
-                END as share_rate,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.custom_like / s.total_play
-                    ELSE 0 
-                END as like_rate,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.dy_share / s.total_play
-                    ELSE 0 
-                END as follow_rate,
-                
-                s.stat_time as stat_time
-                
+    return text(f"""
+        {_AGG_INSERT_SELECT}
             FROM douplus_order_stats s
             INNER JOIN douplus_order o ON s.order_id = o.order_id
             INNER JOIN (
                 -- 每个订单只取最新一条效果数据
                 SELECT order_id, MAX(stat_time) as max_stat_time
                 FROM douplus_order_stats
+                {latest_filter}
                 GROUP BY order_id
             ) latest ON s.order_id = latest.order_id AND s.stat_time = latest.max_stat_time
+            {outer_filter}
+            {_AGG_ON_DUPLICATE}
+    """)
+
+
+def _ratio(numerator, denominator, scale=1):
+    """计算比值，分母为0时返回None"""
+    numerator = float(numerator or 0)
+    denominator = float(denominator or 0)
+    if denominator <= 0:
+        return None
+    return numerator / denominator * scale
+
+
+def build_order_agg_values(stats_row: dict, account_id: int) -> dict:
+    """
+    由一条最新效果数据直接计算订单预聚合行
+    
+    计算口径与_AGG_INSERT_SELECT保持一致，供效果数据写入时同步维护预聚合表
+    
+    Args:
+        stats_row: douplus_order_stats行数据（全量累计值）
+        account_id: 账号ID
+    
+    Returns:
+        dict: douplus_order_agg行数据
+    """
+    cost = stats_row.get("stat_cost", 0)
+    play = stats_row.get("total_play", 0)
+    like = stats_row.get("custom_like", 0)
+    share = stats_row.get("dy_share", 0)
+    convert = stats_row.get("dp_target_convert_cnt", 0)
+    
+    return {
+        "order_id": stats_row["order_id"],
+        "item_id": stats_row["item_id"],
+        "account_id": account_id,
+        
+        "total_cost": cost,
+        "total_play": play,
+        "total_like": like,
+        "total_comment": stats_row.get("dy_comment", 0),
+        "total_share": share,
+        "total_follow": stats_row.get("dy_follow", 0),
+        "total_convert": convert,
+        "play_duration_5s": stats_row.get("play_duration_5s_rank", 0),
+        
+        "play_per_100_cost": _ratio(play, cost, 100) or 0,
+        "avg_convert_cost": _ratio(cost, convert),
+        "share_rate": _ratio(share, play, 100) or 0,
+        "like_rate": _ratio(like, play) or 0,
+        "follow_rate": _ratio(share, play) or 0,
+        
+        "stat_time": stats_row["stat_time"],
+    }
+
+
+def order_agg_upsert_stmt(rows: list):
+    """
+    构造订单预聚合表的多行 INSERT ... ON DUPLICATE KEY UPDATE 语句
+    
+    只在新数据的stat_time不早于已有数据时覆盖，避免补拉的旧窗口回退预聚合结果；
+    MySQL按顺序求值SET子句，stat_time必须最后更新
+    
+    Args:
+        rows: douplus_order_agg行数据列表
+    """
+    stmt = insert(DouplusOrderAgg).values(rows)
+    is_newer = stmt.inserted.stat_time >= DouplusOrderAgg.stat_time
+    
+    def newer(column):
+        return case((is_newer, stmt.inserted[column]), else_=DouplusOrderAgg.__table__.c[column])
+    
+    columns = [
+        'account_id', 'total_cost', 'total_play', 'total_like', 'total_comment',
+        'total_share', 'total_follow', 'total_convert', 'play_duration_5s',
+        'play_per_100_cost', 'avg_convert_cost', 'share_rate', 'like_rate', 'follow_rate',
+    ]
+    updates = [(column, newer(column)) for column in columns]
+    updates.append(('update_time', datetime.now()))
+    updates.append(('stat_time', newer('stat_time')))
+    return stmt.on_duplicate_key_update(updates)
+
+
+def aggregate_order_stats(full: bool = False):
+    """
+    增量聚合订单效果数据到预聚合表
+    
+    只处理上次聚合之后有效果数据写入（sync_time推进）的订单，
+    耗时与变化量成正比，与历史数据量无关
+    
+    Args:
+        full: 是否全量重算所有订单（用于修复数据）
+    
+    执行频率：效果数据同步后立即执行
+    """
+    db = get_db()
+    try:
+        cursor = None if full else get_cursor(db, ORDER_AGG_CURSOR_KEY)
+        
+        # 1. 本次聚合的新高水位（先取水位再取变化订单，之后写入的数据留给下一次）
+        new_watermark = db.execute(text("SELECT MAX(sync_time) FROM douplus_order_stats")).scalar()
+        if new_watermark is None:
+            logger.info("没有效果数据，跳过订单预聚合")
+            return 0
+        
+        if cursor is None or cursor.cursor_time is None:
+            # 2a. 首次执行或全量重算
+            logger.info("订单预聚合: 全量重算")
+            result = db.execute(_build_agg_sql())
+            affected_rows = result.rowcount
+        else:
+            # 2b. 只聚合sync_time超过高水位的订单
+            since = cursor.cursor_time - timedelta(minutes=ORDER_AGG_OVERLAP_MINUTES)
+            changed = db.execute(text("""
+                SELECT DISTINCT order_id
+                FROM douplus_order_stats
+                WHERE sync_time > :since
+            """), {'since': since}).fetchall()
+            order_ids = [row[0] for row in changed]
+            logger.info(f"订单预聚合: {since}之后有{len(order_ids)}个订单的效果数据变化")
             
-            ON DUPLICATE KEY UPDATE
-                account_id = VALUES(account_id),
-                total_cost = VALUES(total_cost),
-                total_play = VALUES(total_play),
-                total_like = VALUES(total_like),
-                total_comment = VALUES(total_comment),
-                total_share = VALUES(total_share),
-                total_follow = VALUES(total_follow),
-                total_convert = VALUES(total_convert),
-                play_duration_5s = VALUES(play_duration_5s),
-                play_per_100_cost = VALUES(play_per_100_cost),
-                avg_convert_cost = VALUES(avg_convert_cost),
-                share_rate = VALUES(share_rate),
-                like_rate = VALUES(like_rate),
-                follow_rate = VALUES(follow_rate),
-                stat_time = VALUES(stat_time),
-                update_time = CURRENT_TIMESTAMP
-        """)
-        
-        result = db.execute(sql)
+            affected_rows = 0
+            sql = _build_agg_sql(
+                latest_filter="WHERE order_id IN :order_ids",
+                outer_filter="WHERE s.order_id IN :order_ids"
+            )
+            for i in range(0, len(order_ids), ORDER_AGG_CHUNK_SIZE):
+                chunk = tuple(order_ids[i:i+ORDER_AGG_CHUNK_SIZE])
+                result = db.execute(sql, {'order_ids': chunk})
+                affected_rows += result.rowcount
+        
+        # 3. 推进高水位，与聚合结果在同一事务中提交
+        save_cursor(db, ORDER_AGG_CURSOR_KEY, new_watermark)
         db.commit()
         
-        affected_rows = result.rowcount
-        logger.info(f"订单预聚合完成: 更新{affected_rows}个订单")
+        logger.info(f"订单预聚合完成: 更新{affected_rows}个订单, 高水位={new_watermark}")
         return affected_rows
-        
+    
     except Exception as e:
         logger.error(f"订单预聚合失败: {e}")
         db.rollback()
@@ -130,98 +277,17 @@ def aggregate_single_account_orders(account_id: int):
     
     Args:
         account_id: 账号ID
-        
+    
     用途：效果数据刷新后立即更新该账号的预聚合数据
     """
     db = get_db()
     try:
-        sql = text("""
-            INSERT INTO douplus_order_agg (
-                order_id, item_id, account_id,
-                total_cost, total_play, total_like, total_comment, total_share, 
-                total_follow, total_convert, play_duration_5s,
-                play_per_100_cost, avg_convert_cost, share_rate, like_rate, follow_rate,
-                stat_time
-            )
-            SELECT 
-                s.order_id,
-                s.item_id,
-                o.account_id,
-                
-                -- 原始指标：取最新值（因为API返回的是全量累计，不是增量）
-                s.stat_cost as total_cost,
-                s.total_play as total_play,
-                s.custom_like as total_like,
-                s.dy_comment as total_comment,
-                s.dy_share as total_share,
-                s.dy_follow as total_follow,
-                s.dp_target_convert_cnt as total_convert,
-                s.play_duration_5s_rank as play_duration_5s,
-                
-                -- 预聚合计算指标
-                CASE 
-                    WHEN s.stat_cost > 0 
-                    THEN s.total_play / s.stat_cost * 100 
-                    ELSE 0 
-                END as play_per_100_cost,
-                
-                CASE 
-                    WHEN s.dp_target_convert_cnt > 0 
-                    THEN s.stat_cost / s.dp_target_convert_cnt
-                    ELSE NULL 
-                END as avg_convert_cost,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.dy_share / s.total_play * 100 
-                    ELSE 0 
-                END as share_rate,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.custom_like / s.total_play
-                    ELSE 0 
-                END as like_rate,
-                
-                CASE 
-                    WHEN s.total_play > 0 
-                    THEN s.dy_share / s.total_play
-                    ELSE 0 
-                END as follow_rate,
-                
-                s.stat_time as stat_time
-                
-            FROM douplus_order_stats s
-            INNER JOIN douplus_order o ON s.order_id = o.order_id
-            INNER JOIN (
-                -- 每个订单只取最新一条效果数据
-                SELECT order_id, MAX(stat_time) as max_stat_time
-                FROM douplus_order_stats
-                WHERE order_id IN (
+        sql = _build_agg_sql(
+            latest_filter="""WHERE order_id IN (
                     SELECT order_id FROM douplus_order WHERE account_id = :account_id
-                )
-                GROUP BY order_id
-            ) latest ON s.order_id = latest.order_id AND s.stat_time = latest.max_stat_time
-            WHERE o.account_id = :account_id
-            
-            ON DUPLICATE KEY UPDATE
-                account_id = VALUES(account_id),
-                total_cost = VALUES(total_cost),
-                total_play = VALUES(total_play),
-                total_like = VALUES(total_like),
-                total_comment = VALUES(total_comment),
-                total_share = VALUES(total_share),
-                total_follow = VALUES(total_follow),
-                total_convert = VALUES(total_convert),
-                play_duration_5s = VALUES(play_duration_5s),
-                play_per_100_cost = VALUES(play_per_100_cost),
-                avg_convert_cost = VALUES(avg_convert_cost),
-                share_rate = VALUES(share_rate),
-                like_rate = VALUES(like_rate),
-                follow_rate = VALUES(follow_rate),
-                stat_time = VALUES(stat_time),
-                update_time = CURRENT_TIMESTAMP
-        """)
+                )""",
+            outer_filter="WHERE o.account_id = :account_id"
+        )
         
         result = db.execute(sql, {'account_id': account_id})
         db.commit()
@@ -229,7 +295,7 @@ def aggregate_single_account_orders(account_id: int):
         affected_rows = result.rowcount
         logger.info(f"账号{account_id}订单预聚合完成: 更新{affected_rows}个订单")
         return affected_rows
-        
+    
     except Exception as e:
         logger.error(f"账号{account_id}订单预聚合失败: {e}")
         db.rollback()
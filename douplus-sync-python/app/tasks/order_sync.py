@@ -1,20 +1,30 @@
 """
 订单同步任务
 """
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from celery import Task
 from datetime import datetime, timedelta
+from typing import Optional
 from sqlalchemy.dialects.mysql import insert
-from sqlalchemy import update
+from sqlalchemy import update, func
 from loguru import logger
 
-from app.models import DouyinAccount, DouplusOrder, SyncTaskLog, SyncTaskDetail, get_db
+from app.models import DouyinAccount, DouplusOrder, SyncTaskLog, SyncTaskDetail, ORDER_TERMINAL_STATUSES, get_db
 from app.douyin_client import DouyinClient, DouyinAPIError
-from app.utils.crypto import decrypt_access_token
+from app.utils.sync_cursor import get_cursor, save_cursor
+from app.utils.response_cache import bump_user_version
+from app.utils.task_id_lookup import resolve_task_ids, filter_backfill_untried, mark_backfill_tried
+from app.utils.token_cache import AccountCredentials, get_account_credentials
+from app.utils.locks import redis_lease, single_flight
 from app.config import get_settings
 
 
 settings = get_settings()
 
+# task_id补全任务每次最多扫描 limit * BACKFILL_SCAN_FACTOR 个候选订单（跳过近期已尝试过的）
+BACKFILL_SCAN_FACTOR = 10
+
 
 class OrderSyncTask(Task):
     """订单同步任务基类"""
@@ -32,83 +42,44 @@ class OrderSyncTask(Task):
     
     def sync_account_orders(self, account_id: int, sync_mode: str = "incremental"):
         """
-        同步单个账号的订单
+        同步单个账号的订单（异常只记录日志，不向上抛出）
         
         Args:
             account_id: 账号ID
             sync_mode: full(全量) / incremental(增量)
         """
-        db = get_db()
         try:
-            # 1. 获取账号信息
-            account = db.query(DouyinAccount).filter(
-                DouyinAccount.id == account_id
-            ).first()
-            
-            if not account:
-                logger.warning(f"账号不存在: account_id={account_id}")
-                return
-            
-            # 2. 解密AccessToken
-            try:
-                access_token = decrypt_access_token(account.access_token)
-            except Exception as e:
-                logger.error(f"解密token失败: account_id={account_id}, error={e}")
-                return
-            
-            # 3. 创建API客户端
-            client = DouyinClient(access_token)
-            
-            try:
-                # 4. 获取订单列表(分页)
-                page = 1
-                page_size = 100
-                total_synced = 0
-                
-                while True:
-                    orders = client.get_order_list(
-                        aweme_sec_uid=account.aweme_sec_uid,
-                        page=page,
-                        page_size=page_size
-                    )
-                    
-                    if not orders:
-                        break
-                    
-                    # 5. 批量插入/更新订单
-                    for order_data in orders:
-                        try:
-                            self._upsert_order(db, order_data, account)
-                            total_synced += 1
-                        except Exception as e:
-                            logger.error(f"保存订单失败: order_id={order_data.get('order_id')}, error={e}")
-                    
-                    db.commit()
-                    
-                    # 如果返回数量小于page_size,说明已经是最后一页
-                    if len(orders) < page_size:
-                        break
-                    
-                    page += 1
-                
-                logger.info(f"账号{account_id}订单同步完成: 共{total_synced}条")
-                
-            finally:
-                client.close()
-                
-        except DouyinAPIError as e:
-            logger.error(f"抖音API调用失败: account_id={account_id}, error={e}")
-            db.rollback()
+            self.sync_account_orders_with_count(account_id, sync_mode)
         except Exception as e:
-            logger.error(f"订单同步异常: account_id={account_id}, error={e}", exc_info=True)
-            db.rollback()
-        finally:
-            db.close()
+            logger.error(f"账号{account_id}订单同步失败: {e}")
+    
+    def sync_account_orders_with_count(self, account_id: int, sync_mode: str = "incremental") -> Optional[int]:
+        """
+        同步单个账号的订单（持有账号租约，同一账号的同步不会重叠执行）
+        
+        定时增量同步、全量同步、手动同步共用同一个账号租约，
+        账号正在同步时直接跳过，不重复调用API
+        
+        Returns:
+            同步的订单数量，跳过时返回None
+        """
+        with redis_lease(f"order_sync:{account_id}") as acquired:
+            if not acquired:
+                logger.info(f"账号{account_id}正在同步订单，跳过本次{sync_mode}同步")
+                return None
+            return self._sync_account_orders(account_id, sync_mode)
     
-    def sync_account_orders_with_count(self, account_id: int, sync_mode: str = "incremental") -> int:
+    def _sync_account_orders(self, account_id: int, sync_mode: str = "incremental") -> int:
         """
         同步单个账号的订单（返回同步数量）
         
+        订单列表API按创建时间倒序返回：
+        - full: 翻到SYNC_FULL_DAYS天之前即停止
+        - incremental: 翻到高水位（上次同步到的最新订单创建时间）之前即停止，
+          若还有未结束的订单则继续翻到最早一个未结束订单为止；
+          尚无高水位时退化为全量
+        两种模式完成后都会推进该账号的高水位
+        
         Args:
             account_id: 账号ID
             sync_mode: full(全量) / incremental(增量)
@@ -120,29 +91,35 @@ class OrderSyncTask(Task):
         total_synced = 0
         
         try:
-            # 1. 获取账号信息
-            account = db.query(DouyinAccount).filter(
-                DouyinAccount.id == account_id
-            ).first()
+            # 1. 获取账号凭证（进程内缓存，AccessToken已解密）
+            try:
+                account = get_account_credentials(account_id, db)
+            except Exception as e:
+                logger.error(f"解密token失败: account_id={account_id}, error={e}")
+                return 0
             
             if not account:
                 logger.warning(f"账号不存在: account_id={account_id}")
                 return 0
             
-            # 2. 解密AccessToken
-            try:
-                access_token = decrypt_access_token(account.access_token)
-            except Exception as e:
-                logger.error(f"解密token失败: account_id={account_id}, error={e}")
-                return 0
+            # 2. AccessToken
+            access_token = account.access_token
             
-            # 3. 创建API客户端
+            # 3. 确定增量同步的停止边界
+            cursor_key = f"order_sync:{account_id}"
+            stop_before = datetime.now() - timedelta(days=settings.SYNC_FULL_DAYS)
+            if sync_mode == "incremental":
+                stop_before = self._incremental_boundary(db, account_id, cursor_key) or stop_before
+            
+            # 4. 创建API客户端
             client = DouyinClient(access_token)
             
             try:
-                # 4. 获取订单列表(分页)
+                # 5. 获取订单列表(分页)
                 page = 1
                 page_size = 100
+                newest_time = None
+                newest_order_id = None
                 
                 while True:
                     orders = client.get_order_list(
@@ -154,23 +131,43 @@ class OrderSyncTask(Task):
                     if not orders:
                         break
                     
-                    # 5. 批量插入/更新订单
-                    for order_data in orders:
-                        try:
-                            self._upsert_order(db, order_data, account)
-                            total_synced += 1
-                        except Exception as e:
-                            logger.error(f"保存订单失败: order_id={order_data.get('order_id')}, error={e}")
+                    # 6. 批量插入/更新订单（整页一条多行UPSERT）
+                    total_synced += self._upsert_orders(db, orders, account)
                     
                     db.commit()
                     
+                    page_times = []
+                    for order_data in orders:
+                        order_info = order_data.get("order", {})
+                        create_time = self._parse_order_time(order_info.get("order_create_time"))
+                        if create_time:
+                            page_times.append(create_time)
+                            if newest_time is None or create_time > newest_time:
+                                newest_time = create_time
+                                newest_order_id = order_info.get("order_id")
+                    
                     # 如果返回数量小于page_size,说明已经是最后一页
                     if len(orders) < page_size:
                         break
                     
+                    # 本页已翻过停止边界：增量模式下更早的订单都已同步且已结束，全量模式下超出同步范围
+                    if stop_before and page_times and min(page_times) < stop_before:
+                        logger.info(f"账号{account_id}{sync_mode}同步到达停止边界{stop_before}, 共翻{page}页")
+                        break
+                    
                     page += 1
                 
-                logger.info(f"账号{account_id}订单同步完成: 共{total_synced}条")
+                # 7. 推进高水位（只前进不后退）
+                if newest_time:
+                    cursor = get_cursor(db, cursor_key)
+                    if not cursor or not cursor.cursor_time or newest_time > cursor.cursor_time:
+                        save_cursor(db, cursor_key, newest_time, str(newest_order_id) if newest_order_id else None)
+                        db.commit()
+                
+                if total_synced:
+                    bump_user_version(account.user_id)
+                
+                logger.info(f"账号{account_id}订单同步完成({sync_mode}): 共{total_synced}条")
                 return total_synced
                 
             finally:
@@ -187,14 +184,62 @@ class OrderSyncTask(Task):
         finally:
             db.close()
     
-    def _upsert_order(self, db, order_data: dict, account: DouyinAccount):
+    def _incremental_boundary(self, db, account_id: int, cursor_key: str):
         """
-        插入或更新订单
+        计算增量同步的停止边界
+        
+        边界 = 高水位 - 回看缓冲；若还有未结束的订单，边界前移到其中最早的订单创建时间，
+        保证这些订单的状态会被重新拉取（续费后订单最长可投放720小时，不能只看最近几天）。
+        未结束订单最多回看SYNC_FULL_DAYS天，与全量同步范围一致
         
         Args:
             db: 数据库会话
+            account_id: 账号ID
+            cursor_key: 游标键
+        
+        Returns:
+            datetime: 停止边界；没有高水位时返回None（退化为全量）
+        """
+        cursor = get_cursor(db, cursor_key)
+        if not cursor or not cursor.cursor_time:
+            logger.info(f"账号{account_id}尚无同步高水位，本次增量同步按全量执行")
+            return None
+        
+        boundary = cursor.cursor_time - timedelta(minutes=settings.SYNC_CURSOR_OVERLAP_MINUTES)
+        
+        lookback = datetime.now() - timedelta(days=settings.SYNC_FULL_DAYS)
+        oldest_open = db.query(func.min(DouplusOrder.order_create_time)).filter(
+            DouplusOrder.account_id == account_id,
+            DouplusOrder.deleted == 0,
+            DouplusOrder.status.notin_(ORDER_TERMINAL_STATUSES),
+            DouplusOrder.order_create_time >= lookback
+        ).scalar()
+        
+        if oldest_open and oldest_open < boundary:
+            boundary = oldest_open
+        
+        return boundary
+    
+    @staticmethod
+    def _parse_order_time(time_str: str):
+        """解析API返回的时间字符串，格式错误时返回None"""
+        if not time_str:
+            return None
+        try:
+            return datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+        except:
+            return None
+    
+    def _build_order_values(self, order_data: dict, account: AccountCredentials) -> dict:
+        """
+        将API返回的订单数据转换为数据库行
+        
+        Args:
             order_data: 订单数据（API返回的完整结构）
-            account: 账号对象
+            account: 账号凭证
+        
+        Returns:
+            dict: douplus_order行数据
         """
         # API返回的数据结构是嵌套的，需要从order字段中提取
         order_info = order_data.get("order", {})
@@ -202,18 +247,10 @@ class OrderSyncTask(Task):
         item_info = item_info_list[0] if item_info_list else {}
         
         # 解析时间
-        order_create_time = None
-        create_time_str = order_info.get("order_create_time")
-        if create_time_str:
-            try:
-                order_create_time = datetime.strptime(
-                    create_time_str, "%Y-%m-%d %H:%M:%S"
-                )
-            except:
-                pass
+        order_create_time = self._parse_order_time(order_info.get("order_create_time"))
         
         # 构建数据
-        values = {
+        return {
             "order_id": order_info.get("order_id"),
             "task_id": order_info.get("task_id"),  # DOU+后台订单号(PC端可见)
             "item_id": item_info.get("aweme_item_id"),
@@ -231,54 +268,222 @@ class OrderSyncTask(Task):
             "last_sync_time": datetime.now(),
             "sync_source": "API",
         }
+    
+    def _order_upsert_stmt(self, rows: list):
+        """
+        构造多行 INSERT ... ON DUPLICATE KEY UPDATE 语句
         
-        # 使用INSERT ... ON DUPLICATE KEY UPDATE
-        stmt = insert(DouplusOrder).values(**values)
-        stmt = stmt.on_duplicate_key_update(
-            account_id=values["account_id"],  # 重要：更新account_id，支持账号重新绑定
-            status=values["status"],
-            budget=values["budget"],  # 重要：更新预算，支持续费后同步最新预算
-            aweme_title=values["aweme_title"],
-            aweme_cover=values["aweme_cover"],
+        Args:
+            rows: douplus_order行数据列表
+        """
+        stmt = insert(DouplusOrder).values(rows)
+        return stmt.on_duplicate_key_update(
+            account_id=stmt.inserted.account_id,  # 重要：更新account_id，支持账号重新绑定
+            status=stmt.inserted.status,
+            budget=stmt.inserted.budget,  # 重要：更新预算，支持续费后同步最新预算
+            task_id=func.coalesce(stmt.inserted.task_id, DouplusOrder.task_id),  # 补全历史订单缺失的task_id
+            aweme_title=stmt.inserted.aweme_title,
+            aweme_cover=stmt.inserted.aweme_cover,
             sync_version=DouplusOrder.sync_version + 1,
-            last_sync_time=datetime.now(),
+            last_sync_time=stmt.inserted.last_sync_time,
             update_time=datetime.now()
         )
+    
+    def _upsert_orders(self, db, orders: list, account: AccountCredentials) -> int:
+        """
+        批量插入或更新一页订单
         
-        db.execute(stmt)
+        整页订单合并为一条多行UPSERT；该批次失败时回滚到保存点，
+        再逐条写入以定位并记录出错的订单
+        
+        Args:
+            db: 数据库会话
+            orders: 订单数据列表（API返回的完整结构）
+            account: 账号凭证
+        
+        Returns:
+            int: 成功写入的订单数
+        """
+        rows = []
+        for order_data in orders:
+            try:
+                rows.append(self._build_order_values(order_data, account))
+            except Exception as e:
+                logger.error(f"解析订单失败: order_id={order_data.get('order', {}).get('order_id')}, error={e}")
+        
+        if not rows:
+            return 0
+        
+        try:
+            with db.begin_nested():
+                db.execute(self._order_upsert_stmt(rows))
+            return len(rows)
+        except Exception as e:
+            logger.warning(f"批量保存订单失败，回退为逐条保存: account_id={account.id}, count={len(rows)}, error={e}")
+        
+        saved = 0
+        for values in rows:
+            try:
+                with db.begin_nested():
+                    db.execute(self._order_upsert_stmt([values]))
+                saved += 1
+            except Exception as e:
+                logger.error(f"保存订单失败: order_id={values.get('order_id')}, error={e}")
+        return saved
+
+
+def _sync_accounts_concurrently(accounts, sync_mode: str) -> dict:
+    """
+    并发同步多个账号的订单
+    
+    使用有界线程池分发账号，每个账号使用独立的数据库会话和API客户端，
+    单个账号失败不影响其他账号
+    
+    Args:
+        accounts: 账号列表
+        sync_mode: 同步模式 (full/incremental)
+    
+    Returns:
+        dict: 同步汇总 {total, success, failed, skipped, records, failed_accounts, elapsed}
+    """
+    summary = {
+        'total': len(accounts),
+        'success': 0,
+        'failed': 0,
+        'skipped': 0,
+        'records': 0,
+        'failed_accounts': [],
+        'elapsed': 0.0,
+    }
+    if not accounts:
+        return summary
+    
+    task = OrderSyncTask()
+    started = time.monotonic()
+    max_workers = max(1, min(settings.SYNC_MAX_WORKERS, len(accounts)))
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='order-sync') as executor:
+        futures = {
+            executor.submit(task.sync_account_orders_with_count, account.id, sync_mode): account.id
+            for account in accounts
+        }
+        for future in as_completed(futures):
+            account_id = futures[future]
+            try:
+                records = future.result()
+                if records is None:
+                    # 账号正在由其他任务同步
+                    summary['skipped'] += 1
+                    continue
+                summary['records'] += records
+                summary['success'] += 1
+            except Exception as e:
+                summary['failed'] += 1
+                summary['failed_accounts'].append(account_id)
+                logger.error(f"账号{account_id}同步失败: {e}")
+    
+    summary['elapsed'] = round(time.monotonic() - started, 2)
+    return summary
 
 
 # Celery任务装饰器会在celery_app.py中应用
+@single_flight('order_sync_incremental')
 def sync_all_accounts_incremental():
     """增量同步所有账号的订单"""
     task = OrderSyncTask()
     accounts = task.get_active_accounts()
     
-    logger.info(f"开始增量同步订单: 共{len(accounts)}个账号")
+    logger.info(f"开始增量同步订单: 共{len(accounts)}个账号, 并发数={settings.SYNC_MAX_WORKERS}")
     
-    for account in accounts:
-        try:
-            task.sync_account_orders(account.id, "incremental")
-        except Exception as e:
-            logger.error(f"账号{account.id}同步失败: {e}")
+    summary = _sync_accounts_concurrently(accounts, "incremental")
     
-    logger.info("增量同步完成")
+    logger.info(f"增量同步完成: 成功{summary['success']}个账号, 失败{summary['failed']}个账号, "
+                f"跳过{summary['skipped']}个账号(正在同步), "
+                f"共{summary['records']}条订单, 耗时{summary['elapsed']}秒")
+    return summary
 
 
+@single_flight('order_sync_full')
 def sync_all_accounts_full():
     """全量同步所有账号的订单"""
     task = OrderSyncTask()
     accounts = task.get_active_accounts()
     
-    logger.info(f"开始全量同步订单: 共{len(accounts)}个账号")
+    logger.info(f"开始全量同步订单: 共{len(accounts)}个账号, 并发数={settings.SYNC_MAX_WORKERS}")
     
-    for account in accounts:
-        try:
-            task.sync_account_orders(account.id, "full")
-        except Exception as e:
-            logger.error(f"账号{account.id}同步失败: {e}")
+    summary = _sync_accounts_concurrently(accounts, "full")
+    
+    logger.info(f"全量同步完成: 成功{summary['success']}个账号, 失败{summary['failed']}个账号, "
+                f"跳过{summary['skipped']}个账号(正在同步), "
+                f"共{summary['records']}条订单, 耗时{summary['elapsed']}秒")
+    return summary
+
+
+@single_flight('backfill_task_ids')
+def backfill_missing_task_ids(limit: int = 500):
+    """
+    补全缺失task_id的订单（task_id字段上线前同步的历史订单）
+    
+    按账号分组，每个账号查一次订单列表API，续费时无需再实时查找。
+    查找过仍未补全的订单（如超出翻页上限）记录为已尝试，TASK_ID_BACKFILL_RETRY_TTL内不再选中，
+    不会每次占满本次的处理名额，更早的订单也能轮到
     
-    logger.info("全量同步完成")
+    Args:
+        limit: 本次最多处理的订单数（按下单时间倒序，优先补全近期订单）
+    """
+    db = get_db()
+    try:
+        # 只选可用账号的订单；按 (下单时间, id) 倒序分批扫描，跳过近期已尝试过的订单，直到凑满limit
+        query = db.query(
+            DouplusOrder.id, DouplusOrder.account_id, DouplusOrder.order_id, DouplusOrder.order_create_time
+        ).join(
+            DouyinAccount, DouyinAccount.id == DouplusOrder.account_id
+        ).filter(
+            DouplusOrder.task_id.is_(None),
+            DouplusOrder.deleted == 0,
+            DouyinAccount.status == 1,
+            DouyinAccount.deleted == 0,
+            DouyinAccount.aweme_sec_uid.isnot(None),
+            DouyinAccount.aweme_sec_uid != ''
+        ).order_by(DouplusOrder.order_create_time.desc(), DouplusOrder.id.desc())
+        
+        orders = []
+        scanned = 0
+        offset = 0
+        while len(orders) < limit and scanned < limit * BACKFILL_SCAN_FACTOR:
+            batch = query.offset(offset).limit(limit).all()
+            if not batch:
+                break
+            offset += len(batch)
+            scanned += len(batch)
+            untried = set(filter_backfill_untried([str(row.order_id) for row in batch]))
+            orders.extend(row for row in batch if str(row.order_id) in untried)
+        orders = orders[:limit]
+        
+        if not orders:
+            return {'total': 0, 'resolved': 0}
+        
+        targets = {}
+        for _, account_id, order_id, order_create_time in orders:
+            targets.setdefault(account_id, {})[str(order_id)] = order_create_time
+        
+        accounts = db.query(DouyinAccount).filter(DouyinAccount.id.in_(list(targets))).all()
+        
+        resolved = 0
+        for account in accounts:
+            try:
+                access_token = get_account_credentials(account.id, db).access_token
+                found = resolve_task_ids(db, access_token, account.aweme_sec_uid, targets[account.id])
+                resolved += len(found)
+                mark_backfill_tried([order_id for order_id in targets[account.id] if order_id not in found])
+            except Exception as e:
+                db.rollback()
+                logger.error(f"账号{account.id}补全task_id失败: {e}")
+        
+        logger.info(f"补全task_id完成: 待补全{len(orders)}个订单, 补全{resolved}个")
+        return {'total': len(orders), 'resolved': resolved}
+    finally:
+        db.close()
 
 
 def sync_single_account(account_id: int, sync_mode: str = "incremental", task_id: int = None):
@@ -310,6 +515,20 @@ def sync_single_account(account_id: int, sync_mode: str = "incremental", task_id
         task = OrderSyncTask()
         total_synced = task.sync_account_orders_with_count(account_id, sync_mode)
         
+        # 账号正在由其他任务同步，本次未执行，记录为skipped
+        if total_synced is None:
+            if detail:
+                detail.status = 'skipped'
+                detail.record_count = 0
+                detail.error_message = '账号正在由其他任务同步，本次跳过'
+                detail.end_time = datetime.now()
+                db.commit()
+                
+                _update_task_progress(db, task_id)
+            
+            logger.info(f"账号{account_id}同步任务跳过: 账号正在由其他任务同步")
+            return
+        
         # 更新明细状态为completed
         if detail:
             detail.status = 'completed'
@@ -361,9 +580,10 @@ def _update_task_progress(db, task_id: int):
     # 查询明细统计
     details = db.query(SyncTaskDetail).filter(SyncTaskDetail.task_id == task_id).all()
     
-    completed = sum(1 for d in details if d.status in ['completed', 'failed'])
+    completed = sum(1 for d in details if d.status in ['completed', 'failed', 'skipped'])
     success = sum(1 for d in details if d.status == 'completed')
     failed = sum(1 for d in details if d.status == 'failed')
+    skipped = sum(1 for d in details if d.status == 'skipped')
     total_records = sum(d.record_count for d in details if d.record_count)
     
     # 更新任务
@@ -378,6 +598,8 @@ def _update_task_progress(db, task_id: int):
         task.end_time = datetime.now()
         if failed > 0:
             task.error_message = f'{failed}个账号同步失败'
+        elif skipped > 0:
+            task.error_message = f'{skipped}个账号正在由其他任务同步，本次跳过'
     
     db.commit()
-    logger.info(f"任务{task_id}进度更新: {completed}/{task.total_accounts}, 成功{success}, 失败{failed}")
+    logger.info(f"任务{task_id}进度更新: {completed}/{task.total_accounts}, 成功{success}, 失败{failed}, 跳过{skipped}")
@@ -1,15 +1,21 @@
 """
 效果数据同步任务
 """
+import asyncio
 from celery import Task
 from datetime import datetime, timedelta
+from sqlalchemy import update, case
 from sqlalchemy.dialects.mysql import insert
 from loguru import logger
 
-from app.models import DouyinAccount, DouplusOrder, DouplusOrderStats, get_db
-from app.douyin_client import DouyinClient, DouyinAPIError
-from app.utils.crypto import decrypt_access_token
+from app.models import DouyinAccount, DouplusOrder, DouplusOrderStats, ORDER_TERMINAL_STATUSES, get_db
+from app.douyin_client import AsyncDouyinClient, DouyinAPIError, run_async
+from app.utils.token_cache import get_account_credentials
+from app.utils.locks import redis_lease, single_flight
 from app.utils.time_window import get_current_window
+from app.tasks.order_agg import build_order_agg_values, order_agg_upsert_stmt
+from app.tasks.video_agg import mark_videos_dirty
+from app.utils.response_cache import bump_user_version
 from app.config import get_settings
 
 
@@ -20,6 +26,21 @@ class StatsSyncTask(Task):
     """效果数据同步任务基类"""
     
     def sync_account_stats(self, account_id: int):
+        """
+        同步单个账号的效果数据（持有账号租约，同一账号的同步不会重叠执行）
+        
+        定时同步与手动刷新共用同一个账号租约，账号正在同步时直接跳过
+        
+        Returns:
+            tuple: (成功数, 失败数)，跳过时返回None
+        """
+        with redis_lease(f"stats_sync:{account_id}") as acquired:
+            if not acquired:
+                logger.info(f"账号{account_id}正在同步效果数据，跳过本次同步")
+                return None
+            return self._sync_account_stats(account_id)
+    
+    def _sync_account_stats(self, account_id: int):
         """
         同步单个账号的效果数据
         
@@ -31,19 +52,24 @@ class StatsSyncTask(Task):
         """
         db = get_db()
         try:
-            # 1. 获取账号
-            account = db.query(DouyinAccount).filter(
-                DouyinAccount.id == account_id
-            ).first()
+            # 1. 获取账号凭证（进程内缓存，AccessToken已解密）
+            try:
+                account = get_account_credentials(account_id, db)
+            except Exception as e:
+                logger.error(f"解密token失败: account_id={account_id}, error={e}")
+                return (0, 1)
             
             if not account:
                 logger.warning(f"账号不存在: account_id={account_id}")
                 return (0, 1)
             
-            # 2. 获取需要同步效果数据的订单(最近7天有更新的)
+            # 2. 获取需要同步效果数据的订单(最近SYNC_INCREMENTAL_DAYS天内订单同步有更新的)
+            # 未结束的订单每次订单同步都会更新；已结束的订单再成功拉取STATS_SETTLE_POLLS次后冻结
             cutoff_time = datetime.now() - timedelta(days=settings.SYNC_INCREMENTAL_DAYS)
             orders = db.query(DouplusOrder).filter(
                 DouplusOrder.account_id == account_id,
+                DouplusOrder.deleted == 0,
+                DouplusOrder.stats_frozen == 0,
                 DouplusOrder.last_sync_time >= cutoff_time
             ).all()
             
@@ -53,81 +79,56 @@ class StatsSyncTask(Task):
             
             logger.info(f"账号{account_id}需要同步{len(orders)}个订单的效果数据")
             
-            # 3. 解密Token并创建客户端
-            try:
-                access_token = decrypt_access_token(account.access_token)
-            except Exception as e:
-                logger.error(f"解密token失败: account_id={account_id}, error={e}")
+            # 3. AccessToken
+            access_token = account.access_token
+            
+            # 4. 调用效果报告API（按订单ID批量查询，避免时间范围查询漏数据）
+            # stat_time参数设置为覆盖所有可能的时间范围
+            current_month_start = datetime.now().replace(day=1).strftime("%Y-%m-%d")
+            current_month_end = (datetime.now() + timedelta(days=32)).replace(day=1).strftime("%Y-%m-%d")
+            
+            # 提取订单ID列表
+            order_ids = [o.order_id for o in orders]
+            
+            # API限制：每次最多查询100个订单，需要分批查询
+            # 各批次通过共享连接池的异步客户端并发请求
+            stats_dict = run_async(self._fetch_reports(
+                access_token,
+                account.aweme_sec_uid,
+                order_ids,
+                current_month_start,
+                current_month_end
+            ))
+            
+            if not stats_dict:
+                logger.info(f"账号{account_id}未获取到效果数据")
                 return (0, len(orders))
             
-            client = DouyinClient(access_token)
+            # 5. 保存效果数据（item_id从已加载的订单预取，批量多行写入），同一事务内维护订单预聚合表
+            stat_time = get_current_window()
+            item_id_map = {str(o.order_id): o.item_id for o in orders}
+            saved_order_ids = self._upsert_stats(db, stats_dict, stat_time, item_id_map, account_id)
+            total_saved = len(saved_order_ids)
+            
+            # 已结束的订单累计拉取次数（只计效果数据已保存的），达到阈值后冻结
+            terminal_order_ids = {str(o.order_id) for o in orders if o.status in ORDER_TERMINAL_STATUSES}
+            self._mark_final_polls(db, [order_id for order_id in saved_order_ids if order_id in terminal_order_ids])
+            
+            db.commit()
+            bump_user_version(account.user_id)
+            logger.info(f"账号{account_id}效果数据同步完成: 共{total_saved}条")
             
+            # 【预聚合优化】标记本窗口受影响的视频，由防抖任务合并聚合
             try:
-                # 4. 调用效果报告API（按订单ID批量查询，避免时间范围查询漏数据）
-                # stat_time参数设置为覆盖所有可能的时间范围
-                current_month_start = datetime.now().replace(day=1).strftime("%Y-%m-%d")
-                current_month_end = (datetime.now() + timedelta(days=32)).replace(day=1).strftime("%Y-%m-%d")
-                
-                # 提取订单ID列表
-                order_ids = [o.order_id for o in orders]
-                
-                # API限制：每次最多查询100个订单，需要分批查询
-                batch_size = 100
-                stats_dict = {}
-                
-                for i in range(0, len(order_ids), batch_size):
-                    batch = order_ids[i:i+batch_size]
-                    logger.info(f"查询第{i//batch_size + 1}批订单效果数据: {len(batch)}个订单")
-                    
-                    batch_stats = client.get_order_report(
-                        aweme_sec_uid=account.aweme_sec_uid,
-                        begin_time=current_month_start,
-                        end_time=current_month_end,
-                        order_ids=batch
-                    )
-                    stats_dict.update(batch_stats)
-                
-                if not stats_dict:
-                    logger.info(f"账号{account_id}未获取到效果数据")
-                    return (0, len(orders))
-                
-                # 5. 保存效果数据
-                stat_time = get_current_window()
-                total_saved = 0
-                
-                for order_id, stats_data in stats_dict.items():
-                    try:
-                        self._upsert_stats(db, stats_data, stat_time)
-                        total_saved += 1
-                    except Exception as e:
-                        logger.error(f"保存效果数据失败: order_id={order_id}, error={e}")
-                
-                db.commit()
-                logger.info(f"账号{account_id}效果数据同步完成: 共{total_saved}条")
-                
-                # 【预聚合优化】同步完成后更新订单预聚合表，提升查询性能
-                try:
-                    from app.tasks.order_agg import aggregate_single_account_orders
-                    aggregate_single_account_orders(account_id)
-                except Exception as e:
-                    logger.error(f"账号{account_id}订单预聚合失败: {e}")
-                    # 预聚合失败不影响主流程
-                
-                # 【预聚合优化】更新视频预聚合表，支持视频排行榜统计
-                try:
-                    from app.tasks.video_agg import VideoAggTask
-                    video_task = VideoAggTask()
-                    video_task.aggregate_video_stats()  # 聚合当前时间窗口
-                    logger.info(f"账号{account_id}视频预聚合完成")
-                except Exception as e:
-                    logger.error(f"账号{account_id}视频预聚合失败: {e}")
-                    # 预聚合失败不影响主流程
-                
-                return (total_saved, len(orders) - total_saved)
-                
-            finally:
-                client.close()
-                
+                mark_videos_dirty(stat_time, [
+                    d.get("item_id") or item_id_map.get(str(d["order_id"])) for d in stats_dict.values()
+                ])
+            except Exception as e:
+                logger.error(f"账号{account_id}标记视频预聚合失败: {e}")
+                # 预聚合失败不影响主流程
+            
+            return (total_saved, len(orders) - total_saved)
+            
         except DouyinAPIError as e:
             logger.error(f"抖音API调用失败: account_id={account_id}, error={e}")
             db.rollback()
@@ -139,25 +140,102 @@ class StatsSyncTask(Task):
         finally:
             db.close()
     
-    def _upsert_stats(self, db, stats_data: dict, stat_time: datetime):
+    async def _fetch_reports(
+        self,
+        access_token: str,
+        aweme_sec_uid: str,
+        order_ids: list,
+        begin_time: str,
+        end_time: str,
+        batch_size: int = 100
+    ) -> dict:
         """
-        插入或更新效果数据
+        并发查询多批订单的效果数据
+        
+        单个批次失败不影响其他批次，只合并成功批次的结果；全部批次失败时抛出第一个异常
+        
+        Args:
+            access_token: 访问令牌
+            aweme_sec_uid: 账号secUid
+            order_ids: 订单ID列表
+            begin_time: 开始时间 YYYY-MM-DD
+            end_time: 结束时间 YYYY-MM-DD
+            batch_size: 每批订单数（API限制最多100）
+        
+        Returns:
+            dict: 订单效果数据 {order_id: stats}
+        """
+        client = AsyncDouyinClient(access_token)
+        batches = [order_ids[i:i+batch_size] for i in range(0, len(order_ids), batch_size)]
+        logger.info(f"查询订单效果数据: 共{len(order_ids)}个订单, 分{len(batches)}批并发请求")
+        
+        results = await asyncio.gather(*[
+            client.get_order_report(
+                aweme_sec_uid=aweme_sec_uid,
+                begin_time=begin_time,
+                end_time=end_time,
+                order_ids=batch
+            )
+            for batch in batches
+        ], return_exceptions=True)
+        
+        stats_dict = {}
+        errors = []
+        for batch, batch_stats in zip(batches, results):
+            if isinstance(batch_stats, Exception):
+                errors.append(batch_stats)
+                logger.error(f"查询订单效果数据失败: 批次{len(batch)}个订单({batch[0]}...), error={batch_stats}")
+                continue
+            stats_dict.update(batch_stats)
+        
+        if errors and len(errors) == len(batches):
+            raise errors[0]
+        if errors:
+            logger.warning(f"查询订单效果数据部分失败: {len(errors)}/{len(batches)}批失败，保存成功批次的数据")
+        return stats_dict
+    
+    def _mark_final_polls(self, db, order_ids: list):
+        """
+        记录已结束订单的效果数据拉取次数，达到STATS_SETTLE_POLLS次后冻结
+        
+        冻结后的订单不再占用效果报告API配额和数据库写入，视频聚合沿用其最后一次的累计值，
+        由调用者负责提交
         
         Args:
             db: 数据库会话
+            order_ids: 本次效果数据已保存的已结束订单ID
+        """
+        if not order_ids:
+            return
+        
+        # MySQL按顺序求值SET子句，stats_frozen必须在stats_final_polls自增之前计算
+        stmt = update(DouplusOrder).where(
+            DouplusOrder.order_id.in_(order_ids)
+        ).ordered_values(
+            (DouplusOrder.stats_frozen, case(
+                (DouplusOrder.stats_final_polls + 1 >= settings.STATS_SETTLE_POLLS, 1),
+                else_=0
+            )),
+            (DouplusOrder.stats_final_polls, DouplusOrder.stats_final_polls + 1),
+        ).execution_options(synchronize_session=False)
+        db.execute(stmt)
+    
+    def _build_stats_values(self, stats_data: dict, stat_time: datetime, item_id_map: dict) -> dict:
+        """
+        将效果数据转换为数据库行
+        
+        Args:
             stats_data: 效果数据
             stat_time: 统计时间
+            item_id_map: 预取的 {order_id: item_id} 映射
+        
+        Returns:
+            dict: douplus_order_stats行数据
         """
-        # item_id必填，如果API没返回就从订单表查询
-        item_id = stats_data.get("item_id")
-        if not item_id:
-            order = db.query(DouplusOrder).filter_by(order_id=stats_data["order_id"]).first()
-            if order:
-                item_id = order.item_id
-            else:
-                item_id = ''  # 兜底值
-        
-        values = {
+        # item_id必填，如果API没返回就从预取的订单映射中取
+        item_id = stats_data.get("item_id") or item_id_map.get(str(stats_data["order_id"])) or ''  # 兜底值
+        
+        return {
             "order_id": stats_data["order_id"],
             "item_id": item_id,
             "stat_time": stat_time,
@@ -180,27 +258,100 @@ class StatsSyncTask(Task):
             "live_gift_cnt": stats_data.get("live_gift_cnt", 0),
             "sync_time": datetime.now(),
         }
+    
+    def _stats_upsert_stmt(self, rows: list):
+        """
+        构造多行 INSERT ... ON DUPLICATE KEY UPDATE 语句
         
-        # INSERT ... ON DUPLICATE KEY UPDATE
-        stmt = insert(DouplusOrderStats).values(**values)
-        stmt = stmt.on_duplicate_key_update(
-            stat_cost=values["stat_cost"],
-            total_play=values["total_play"],
-            custom_like=values["custom_like"],
-            dy_comment=values["dy_comment"],
-            dy_share=values["dy_share"],
-            dy_follow=values["dy_follow"],
-            play_duration_5s_rank=values["play_duration_5s_rank"],
-            dy_home_visited=values["dy_home_visited"],
-            dp_target_convert_cnt=values["dp_target_convert_cnt"],
-            custom_convert_cost=values["custom_convert_cost"],
-            sync_time=datetime.now(),
+        Args:
+            rows: douplus_order_stats行数据列表
+        """
+        stmt = insert(DouplusOrderStats).values(rows)
+        return stmt.on_duplicate_key_update(
+            stat_cost=stmt.inserted.stat_cost,
+            total_play=stmt.inserted.total_play,
+            custom_like=stmt.inserted.custom_like,
+            dy_comment=stmt.inserted.dy_comment,
+            dy_share=stmt.inserted.dy_share,
+            dy_follow=stmt.inserted.dy_follow,
+            play_duration_5s_rank=stmt.inserted.play_duration_5s_rank,
+            dy_home_visited=stmt.inserted.dy_home_visited,
+            dp_target_convert_cnt=stmt.inserted.dp_target_convert_cnt,
+            custom_convert_cost=stmt.inserted.custom_convert_cost,
+            sync_time=stmt.inserted.sync_time,
             update_time=datetime.now()
         )
+    
+    def _upsert_stats(
+        self,
+        db,
+        stats_dict: dict,
+        stat_time: datetime,
+        item_id_map: dict,
+        account_id: int,
+        batch_size: int = 500
+    ) -> int:
+        """
+        批量插入或更新效果数据，并同步写入订单预聚合表
         
-        db.execute(stmt)
+        每批合并为一条多行UPSERT；某批失败时回滚到保存点，
+        再逐条写入以定位并记录出错的订单。效果数据是全量累计值，
+        预聚合指标直接由内存中的本批数据计算，与明细在同一保存点内写入
+        
+        Args:
+            db: 数据库会话
+            stats_dict: 效果数据 {order_id: stats}
+            stat_time: 统计时间
+            item_id_map: 预取的 {order_id: item_id} 映射
+            account_id: 账号ID
+            batch_size: 每条语句写入的行数
+        
+        Returns:
+            list: 成功写入的订单ID
+        """
+        # 报告中出现但未预取到item_id的订单，一次性补查
+        missing = [
+            str(d["order_id"]) for d in stats_dict.values()
+            if not d.get("item_id") and str(d["order_id"]) not in item_id_map
+        ]
+        if missing:
+            for order_id, item_id in db.query(DouplusOrder.order_id, DouplusOrder.item_id).filter(
+                DouplusOrder.order_id.in_(missing)
+            ).all():
+                item_id_map[str(order_id)] = item_id
+        
+        rows = []
+        for order_id, stats_data in stats_dict.items():
+            try:
+                rows.append(self._build_stats_values(stats_data, stat_time, item_id_map))
+            except Exception as e:
+                logger.error(f"解析效果数据失败: order_id={order_id}, error={e}")
+        
+        saved = []
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i+batch_size]
+            try:
+                with db.begin_nested():
+                    db.execute(self._stats_upsert_stmt(batch))
+                    db.execute(order_agg_upsert_stmt([build_order_agg_values(v, account_id) for v in batch]))
+                saved.extend(str(v['order_id']) for v in batch)
+                continue
+            except Exception as e:
+                logger.warning(f"批量保存效果数据失败，回退为逐条保存: count={len(batch)}, error={e}")
+            
+            for values in batch:
+                try:
+                    with db.begin_nested():
+                        db.execute(self._stats_upsert_stmt([values]))
+                        db.execute(order_agg_upsert_stmt([build_order_agg_values(values, account_id)]))
+                    saved.append(str(values['order_id']))
+                except Exception as e:
+                    logger.error(f"保存效果数据失败: order_id={values.get('order_id')}, error={e}")
+        
+        return saved
 
 
+@single_flight('stats_sync')
 def sync_all_accounts_stats():
     """同步所有账号的效果数据"""
     db = get_db()
@@ -229,7 +380,7 @@ def sync_single_account_stats(account_id: int):
         account_id: 账号ID
         
     Returns:
-        tuple: (成功数, 失败数)
+        tuple: (成功数, 失败数)，账号正在由其他任务同步时返回None
     """
     task = StatsSyncTask()
     return task.sync_account_stats(account_id)
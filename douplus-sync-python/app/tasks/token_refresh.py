@@ -2,255 +2,316 @@
 Token自动刷新任务
 
 功能：
-1. 定期检查即将过期的access_token（7天内）
-2. 自动调用抖音API刷新token
-3. 更新数据库中的token信息
+1. 定期扫描即将过期的access_token，按过期时间提前安排刷新
+2. 自动调用抖音API刷新token（多账号并发，共享HTTP连接池）
+3. 更新数据库中的token信息，并使各进程的账号凭证缓存失效
+
+调度方式：
+- 扫描任务每TOKEN_REFRESH_SCAN_MINUTES分钟执行一次
+- 距过期不足TOKEN_REFRESH_LEAD_MINUTES的账号立即并发刷新
+- 在下一次扫描之前进入提前量的账号，按 过期时间 - 提前量 投递延时任务（Redis去重，不重复投递）
+- 每个账号的刷新持有分布式锁，多个Worker不会重复刷新
 """
 
 import os
+import time
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
+import httpx
 from sqlalchemy import text
 from app.models import SessionLocal
-from app.utils.crypto import encrypt_access_token
+from app.utils.crypto import encrypt_access_token, decrypt_access_token
+from app.utils.locks import redis_lock, single_flight
+from app.utils.redis_client import get_redis
+from app.utils.token_cache import invalidate_account_credentials
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+REFRESH_URL = 'https://ad.oceanengine.com/open_api/oauth2/refresh_token/'
+
+# 单个账号刷新的锁时长（秒），需大于一次刷新请求的最长耗时
+REFRESH_LOCK_TTL = 60
+
+# 延时刷新任务去重键：同一账号同一过期时间只投递一次
+REFRESH_SCHEDULED_KEY = 'token_refresh:scheduled:{account_id}:{expires_ts}'
+
+# 进程级共享的HTTP客户端（fork后重建）
+_http_client: Optional[httpx.Client] = None
+_http_client_pid: Optional[int] = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    """获取进程级共享的httpx.Client（线程安全，复用keep-alive连接）"""
+    global _http_client, _http_client_pid
+    
+    with _http_client_lock:
+        if _http_client is None or _http_client_pid != os.getpid():
+            _http_client = httpx.Client(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+            _http_client_pid = os.getpid()
+        return _http_client
+
+
+def _refresh_lead() -> timedelta:
+    """刷新提前量"""
+    return timedelta(minutes=settings.TOKEN_REFRESH_LEAD_MINUTES)
+
+
+def schedule_token_refresh(account_id: int, expires_at: datetime) -> bool:
+    """
+    按过期时间投递延时刷新任务
+    
+    只投递在下一次扫描之前就需要刷新的账号，更晚的由之后的扫描投递，
+    避免延时任务在Broker中积压过久
+    
+    Args:
+        account_id: 账号ID
+        expires_at: token过期时间
+    
+    Returns:
+        是否投递了新任务
+    """
+    refresh_at = expires_at - _refresh_lead()
+    now = datetime.now()
+    if refresh_at > now + timedelta(minutes=settings.TOKEN_REFRESH_SCAN_MINUTES):
+        return False
+    
+    # 同一账号同一过期时间只投递一次
+    countdown = max(0, int((refresh_at - now).total_seconds()))
+    dedupe_key = REFRESH_SCHEDULED_KEY.format(account_id=account_id, expires_ts=int(expires_at.timestamp()))
+    try:
+        if not get_redis().set(dedupe_key, 1, nx=True, ex=countdown + REFRESH_LOCK_TTL * 10):
+            return False
+    except Exception as e:
+        logger.warning(f"投递Token刷新任务去重失败: account_id={account_id}, error={e}")
+    
+    # 显式使用celery_app：未加载Celery应用的进程中current_app是默认应用，投递会失败
+    from celery_app import app as celery_app
+    celery_app.send_task(
+        'app.tasks.token_refresh.refresh_single_account_token',
+        args=[account_id],
+        kwargs={'force': False},
+        countdown=countdown
+    )
+    logger.info(f"已安排Token刷新: account_id={account_id}, expires_at={expires_at}, {countdown}秒后执行")
+    return True
+
+
+def _refresh_account(account_id: int, force: bool = True) -> dict:
+    """
+    刷新单个账号的Token（持有分布式锁）
+    
+    Args:
+        account_id: 账号ID
+        force: 为False时，若token已不在刷新提前量内（已被其他任务刷新）则跳过
+    
+    Returns:
+        dict: 刷新结果 {success, message, tokenExpiresAt}
+    """
+    with redis_lock(f"token_refresh:{account_id}", ttl=REFRESH_LOCK_TTL) as acquired:
+        if not acquired:
+            logger.info(f"账号{account_id}的Token正在由其他任务刷新，跳过")
+            return {'success': False, 'skipped': True, 'message': 'Token正在刷新中'}
+        
+        db = SessionLocal()
+        try:
+            # 持锁后重新读取，避免使用其他任务刷新前的旧refresh_token
+            account = db.execute(text("""
+                SELECT id, nickname, refresh_token, token_expires_at
+                FROM douyin_account
+                WHERE id = :account_id AND deleted = 0
+            """), {'account_id': account_id}).fetchone()
+            
+            if not account:
+                return {'success': False, 'message': '账号不存在'}
+            
+            account_id, nickname, encrypted_refresh_token, expires_at = account
+            
+            if not encrypted_refresh_token:
+                return {'success': False, 'message': '该账号没有refresh_token'}
+            
+            if not force and expires_at and expires_at > datetime.now() + _refresh_lead():
+                logger.info(f"账号{account_id}的Token已刷新过，跳过: expires_at={expires_at}")
+                return {'success': True, 'skipped': True, 'message': 'Token无需刷新',
+                        'tokenExpiresAt': expires_at.isoformat()}
+            
+            app_id = settings.DOUPLUS_APP_ID
+            app_secret = settings.DOUPLUS_APP_SECRET
+            if not app_id or not app_secret:
+                logger.error("缺少DOUPLUS_APP_ID或DOUPLUS_APP_SECRET配置")
+                return {'success': False, 'message': '系统配置错误'}
+            
+            logger.info(f"开始刷新Token: account_id={account_id}, nickname={nickname}, expires_at={expires_at}")
+            
+            # 解密refresh_token（数据库中是Base64编码存储的）
+            refresh_token = decrypt_access_token(encrypted_refresh_token)
+            
+            # 调用抖音API刷新token
+            response = _get_http_client().post(REFRESH_URL, json={
+                'app_id': app_id,
+                'secret': app_secret,
+                'grant_type': 'refresh_token',
+                'refresh_token': refresh_token
+            })
+            result = response.json()
+            
+            if result.get('code') != 0 or 'data' not in result:
+                error_msg = result.get('message', '刷新Token失败')
+                logger.error(f"刷新Token失败: account_id={account_id}, error={error_msg}")
+                return {'success': False, 'message': error_msg}
+            
+            # 获取新token
+            token_data = result['data']
+            new_access_token = token_data.get('access_token')
+            new_refresh_token = token_data.get('refresh_token')
+            expires_in = token_data.get('expires_in', 86400)  # 默认1天
+            
+            if not new_access_token:
+                logger.error(f"刷新Token失败: account_id={account_id}, 未返回access_token")
+                return {'success': False, 'message': '未返回新的access_token'}
+            
+            # 加密并更新（refresh_token与access_token一样以Base64编码存储）
+            new_expires_at = datetime.now() + timedelta(seconds=expires_in)
+            db.execute(text("""
+                UPDATE douyin_account
+                SET access_token = :access_token,
+                    refresh_token = :refresh_token,
+                    token_expires_at = :expires_at,
+                    update_time = NOW()
+                WHERE id = :account_id
+            """), {
+                'access_token': encrypt_access_token(new_access_token),
+                'refresh_token': encrypt_access_token(new_refresh_token or refresh_token),
+                'expires_at': new_expires_at,
+                'account_id': account_id
+            })
+            db.commit()
+            invalidate_account_credentials(account_id)
+            
+            logger.info(f"Token刷新成功: account_id={account_id}, new_expires_at={new_expires_at}")
+        
+        except httpx.HTTPError as e:
+            db.rollback()
+            logger.error(f"Token刷新网络错误: account_id={account_id}, error={str(e)}")
+            return {'success': False, 'message': f'网络错误: {str(e)}'}
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Token刷新失败: account_id={account_id}, error={str(e)}")
+            return {'success': False, 'message': str(e)}
+        finally:
+            db.close()
+    
+    # 新token的下一次刷新（token已保存，投递失败只记录，由扫描任务兜底）
+    try:
+        schedule_token_refresh(account_id, new_expires_at)
+    except Exception as e:
+        logger.warning(f"安排下一次Token刷新失败: account_id={account_id}, error={e}")
+    
+    return {
+        'success': True,
+        'message': 'Token刷新成功',
+        'tokenExpiresAt': new_expires_at.isoformat()
+    }
+
+
+def _refresh_account_safely(account_id: int) -> dict:
+    """扫描任务中刷新单个账号，异常不影响其他账号"""
+    try:
+        return _refresh_account(account_id, force=False)
+    except Exception as e:
+        logger.error(f"Token刷新失败: account_id={account_id}, error={str(e)}")
+        return {'success': False, 'message': str(e)}
 
 
+@single_flight('token_refresh_scan')
 def refresh_expiring_tokens():
     """
-    刷新即将过期的Token
+    扫描即将过期的Token：临近过期的立即并发刷新，稍后过期的按过期时间安排刷新
     
     检查条件：
-    - token_expires_at < now() + 7天
+    - token_expires_at < now() + 提前量 + 扫描间隔
     - refresh_token存在
     - 账号未删除
     """
-    db = SessionLocal()
-    refreshed_count = 0
-    failed_count = 0
+    start = time.time()
+    lead = _refresh_lead()
+    horizon = datetime.now() + lead + timedelta(minutes=settings.TOKEN_REFRESH_SCAN_MINUTES)
     
+    db = SessionLocal()
     try:
-        # 查询即将过期的账号（7天内）
-        query_sql = text("""
-            SELECT id, open_id, nickname, refresh_token, token_expires_at
+        accounts = db.execute(text("""
+            SELECT id, token_expires_at
             FROM douyin_account
-            WHERE deleted = 0 
-            AND refresh_token IS NOT NULL 
+            WHERE deleted = 0
+            AND refresh_token IS NOT NULL
             AND refresh_token != ''
-            AND token_expires_at < DATE_ADD(NOW(), INTERVAL 7 DAY)
+            AND (token_expires_at IS NULL OR token_expires_at < :horizon)
             ORDER BY token_expires_at ASC
-        """)
-        
-        accounts = db.execute(query_sql).fetchall()
-        
-        if not accounts:
-            logger.info("没有需要刷新的Token")
-            return {'refreshed': 0, 'failed': 0, 'message': '没有需要刷新的Token'}
-        
-        logger.info(f"发现 {len(accounts)} 个账号的Token需要刷新")
-        
-        # 获取配置
-        settings = get_settings()
-        app_id = settings.DOUPLUS_APP_ID
-        app_secret = settings.DOUPLUS_APP_SECRET
-        
-        if not app_id or not app_secret:
-            logger.error("缺少DOUPLUS_APP_ID或DOUPLUS_APP_SECRET配置")
-            return {'refreshed': 0, 'failed': len(accounts), 'message': '系统配置错误'}
-        
-        # 遍历刷新
-        for account in accounts:
-            account_id, open_id, nickname, encrypted_refresh_token, expires_at = account
-            
-            try:
-                logger.info(f"开始刷新Token: account_id={account_id}, nickname={nickname}, expires_at={expires_at}")
-                
-                # 解密refresh_token（数据库中是Base64编码存储的）
-                from app.utils.crypto import decrypt_access_token
-                refresh_token = decrypt_access_token(encrypted_refresh_token)
-                
-                # 调用抖音API刷新token
-                refresh_url = 'https://ad.oceanengine.com/open_api/oauth2/refresh_token/'
-                payload = {
-                    'app_id': app_id,
-                    'secret': app_secret,
-                    'grant_type': 'refresh_token',
-                    'refresh_token': refresh_token
-                }
-                
-                response = requests.post(refresh_url, json=payload, timeout=30)
-                result = response.json()
-                
-                if result.get('code') != 0 or 'data' not in result:
-                    error_msg = result.get('message', '未知错误')
-                    logger.error(f"刷新Token失败: account_id={account_id}, error={error_msg}")
-                    failed_count += 1
-                    continue
-                
-                # 获取新token
-                token_data = result['data']
-                new_access_token = token_data.get('access_token')
-                new_refresh_token = token_data.get('refresh_token')
-                expires_in = token_data.get('expires_in', 86400)  # 默认1天
-                
-                if not new_access_token:
-                    logger.error(f"刷新Token失败: account_id={account_id}, 未返回access_token")
-                    failed_count += 1
-                    continue
-                
-                # 加密新token
-                encrypted_token = encrypt_access_token(new_access_token)
-                new_expires_at = datetime.now() + timedelta(seconds=expires_in)
-                
-                # 更新数据库
-                update_sql = text("""
-                    UPDATE douyin_account
-                    SET access_token = :access_token,
-                        refresh_token = :refresh_token,
-                        token_expires_at = :expires_at,
-                        update_time = NOW()
-                    WHERE id = :account_id
-                """)
-                
-                db.execute(update_sql, {
-                    'access_token': encrypted_token,
-                    'refresh_token': new_refresh_token or refresh_token,
-                    'expires_at': new_expires_at,
-                    'account_id': account_id
-                })
-                db.commit()
-                
-                refreshed_count += 1
-                logger.info(f"Token刷新成功: account_id={account_id}, new_expires_at={new_expires_at}")
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Token刷新网络错误: account_id={account_id}, error={str(e)}")
-                failed_count += 1
-                db.rollback()
-            except Exception as e:
-                logger.error(f"Token刷新失败: account_id={account_id}, error={str(e)}")
-                failed_count += 1
-                db.rollback()
-        
-        result = {
-            'refreshed': refreshed_count,
-            'failed': failed_count,
-            'total': len(accounts),
-            'message': f'Token刷新完成: 成功{refreshed_count}个, 失败{failed_count}个'
-        }
-        
-        logger.info(result['message'])
-        return result
-        
+        """), {'horizon': horizon}).fetchall()
     except Exception as e:
         logger.error(f"Token刷新任务执行失败: {str(e)}")
         return {'refreshed': 0, 'failed': 0, 'message': f'任务执行失败: {str(e)}'}
     finally:
         db.close()
+    
+    if not accounts:
+        logger.info("没有需要刷新的Token")
+        return {'refreshed': 0, 'failed': 0, 'scheduled': 0, 'message': '没有需要刷新的Token'}
+    
+    # 1. 稍后过期的账号：投递延时任务
+    refresh_now = []
+    scheduled_count = 0
+    for account_id, expires_at in accounts:
+        if expires_at is None or expires_at - lead <= datetime.now():
+            refresh_now.append(account_id)
+        elif schedule_token_refresh(account_id, expires_at):
+            scheduled_count += 1
+    
+    # 2. 临近过期的账号：并发刷新
+    refreshed_count = 0
+    failed_count = 0
+    if refresh_now:
+        logger.info(f"发现 {len(refresh_now)} 个账号的Token需要立即刷新")
+        max_workers = max(1, min(settings.TOKEN_REFRESH_MAX_WORKERS, len(refresh_now)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='token-refresh') as executor:
+            for account_result in executor.map(_refresh_account_safely, refresh_now):
+                if account_result.get('skipped'):
+                    continue
+                if account_result['success']:
+                    refreshed_count += 1
+                else:
+                    failed_count += 1
+    
+    result = {
+        'refreshed': refreshed_count,
+        'failed': failed_count,
+        'scheduled': scheduled_count,
+        'total': len(accounts),
+        'message': f'Token刷新完成: 成功{refreshed_count}个, 失败{failed_count}个, '
+                   f'安排稍后刷新{scheduled_count}个, 耗时{time.time() - start:.1f}秒'
+    }
+    
+    logger.info(result['message'])
+    return result
 
 
-def refresh_single_account_token(account_id: int):
+def refresh_single_account_token(account_id: int, force: bool = True):
     """
     刷新单个账号的Token
     
     Args:
         account_id: 账号ID
+        force: 是否强制刷新；按过期时间安排的任务为False，执行前已被刷新过则跳过
     
     Returns:
         dict: 刷新结果
     """
-    db = SessionLocal()
-    
-    try:
-        # 查询账号信息
-        query_sql = text("""
-            SELECT id, open_id, nickname, refresh_token, token_expires_at
-            FROM douyin_account
-            WHERE id = :account_id AND deleted = 0
-        """)
-        
-        account = db.execute(query_sql, {'account_id': account_id}).fetchone()
-        
-        if not account:
-            return {'success': False, 'message': '账号不存在'}
-        
-        account_id, open_id, nickname, encrypted_refresh_token, expires_at = account
-        
-        if not encrypted_refresh_token:
-            return {'success': False, 'message': '该账号没有refresh_token'}
-        
-        # 解密refresh_token（数据库中是Base64编码存储的）
-        from app.utils.crypto import decrypt_access_token
-        refresh_token = decrypt_access_token(encrypted_refresh_token)
-        
-        # 获取配置
-        settings = get_settings()
-        app_id = settings.DOUPLUS_APP_ID
-        app_secret = settings.DOUPLUS_APP_SECRET
-        
-        if not app_id or not app_secret:
-            return {'success': False, 'message': '系统配置错误'}
-        
-        # 调用抖音API
-        refresh_url = 'https://ad.oceanengine.com/open_api/oauth2/refresh_token/'
-        payload = {
-            'app_id': app_id,
-            'secret': app_secret,
-            'grant_type': 'refresh_token',
-            'refresh_token': refresh_token
-        }
-        
-        response = requests.post(refresh_url, json=payload, timeout=30)
-        result = response.json()
-        
-        if result.get('code') != 0 or 'data' not in result:
-            error_msg = result.get('message', '刷新Token失败')
-            return {'success': False, 'message': error_msg}
-        
-        # 获取新token
-        token_data = result['data']
-        new_access_token = token_data.get('access_token')
-        new_refresh_token = token_data.get('refresh_token')
-        expires_in = token_data.get('expires_in', 86400)
-        
-        if not new_access_token:
-            return {'success': False, 'message': '未返回新的access_token'}
-        
-        # 加密并更新
-        encrypted_token = encrypt_access_token(new_access_token)
-        new_expires_at = datetime.now() + timedelta(seconds=expires_in)
-        
-        update_sql = text("""
-            UPDATE douyin_account
-            SET access_token = :access_token,
-                refresh_token = :refresh_token,
-                token_expires_at = :expires_at,
-                update_time = NOW()
-            WHERE id = :account_id
-        """)
-        
-        db.execute(update_sql, {
-            'access_token': encrypted_token,
-            'refresh_token': new_refresh_token or refresh_token,
-            'expires_at': new_expires_at,
-            'account_id': account_id
-        })
-        db.commit()
-        
-        logger.info(f"Token刷新成功: account_id={account_id}, expires_at={new_expires_at}")
-        
-        return {
-            'success': True,
-            'message': 'Token刷新成功',
-            'tokenExpiresAt': new_expires_at.isoformat()
-        }
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"刷新Token失败: account_id={account_id}, error={str(e)}")
-        return {'success': False, 'message': str(e)}
-    finally:
-        db.close()
+    return _refresh_account(account_id, force=force)
@@ -4,7 +4,14 @@
 功能：从 douplus_order_stats 聚合到 douplus_video_stats_agg
 策略：按 item_id + stat_time 聚合多个订单的效果数据
 更新频率：每5分钟
+
+汇总层级：5分钟窗口 -> 小时/日汇总（趋势图） + 视频最新数据（排行和列表），随窗口聚合一起维护
+
+合并调度：各账号效果数据同步后只把受影响的 item_id 标记为脏（Redis），
+由一个防抖的聚合任务统一处理，每个窗口只聚合脏视频，而不是每个账号都聚合整个窗口
 """
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from celery import Task
 from datetime import datetime, timedelta
 from sqlalchemy import func, text
@@ -18,139 +25,380 @@ from app.models import (
     get_db
 )
 from app.utils.time_window import get_current_window
+from app.utils.redis_client import get_redis
+from app.utils.response_cache import bump_global_version
+from app.utils.locks import single_flight
+from app.utils.sync_cursor import get_cursor, save_cursor
 from app.config import get_settings
 
 
 settings = get_settings()
 
+# 脏视频标记：有脏数据的窗口集合 + 每个窗口的脏item_id集合
+DIRTY_WINDOWS_KEY = 'video_agg:dirty_windows'
+DIRTY_ITEMS_KEY = 'video_agg:dirty:{window}'
+# 防抖标记：存在时说明已有待执行的聚合任务
+FLUSH_SCHEDULED_KEY = 'video_agg:flush_scheduled'
+# 脏标记过期时间（秒），防止异常情况下无限堆积
+DIRTY_TTL = 24 * 3600
+# 每条聚合语句处理的视频数
+ITEM_CHUNK_SIZE = 500
+
+VIDEO_AGG_TABLE = 'douplus_video_stats_agg'
+# 重建时写入的影子表，全部填充完成后原子替换线上表
+VIDEO_AGG_SHADOW_TABLE = 'douplus_video_stats_agg_rebuild'
+VIDEO_AGG_OLD_TABLE = 'douplus_video_stats_agg_old'
+# 重建按自然日分片，已完成的分片记录在同步游标表中（cursor_key=前缀+日期），与分片数据在同一事务内写入
+REBUILD_CURSOR_PREFIX = 'video_agg_rebuild:'
+
+# 汇总层级：表名 -> 时段起点表达式（{col}为时间列，避免DATE_FORMAT中的%与参数占位冲突）
+ROLLUP_TIERS = {
+    'douplus_video_stats_hourly': "TIMESTAMP(DATE({col}), MAKETIME(HOUR({col}), 0, 0))",
+    'douplus_video_stats_daily': "TIMESTAMP(DATE({col}))",
+}
+VIDEO_LATEST_TABLE = 'douplus_video_stats_latest'
+
+
+def _video_agg_sql(by_items: bool = False, by_range: bool = False, table: str = VIDEO_AGG_TABLE):
+    """
+    构造视频维度聚合SQL
+    
+    效果数据是累计值：已冻结（停止拉取）的订单在之后的窗口中没有明细，
+    聚合时沿用其最后一次的累计值，视频的窗口汇总不会因订单冻结而下降。
+    只为本窗口有新数据的视频生成行，全部订单冻结后该视频不再产生新窗口
+    
+    Args:
+        by_items: 是否只聚合 :item_ids 中的视频
+        by_range: 是否一次聚合 [:start_time, :end_time) 内的所有窗口，否则只聚合 :stat_time 窗口
+        table: 写入的目标表（重建时写入影子表）
+    """
+    item_filter = "AND o.item_id IN :item_ids" if by_items else ""
+    if by_range:
+        stat_time_column = "s.stat_time"
+        window_filter = "s.stat_time >= :start_time AND s.stat_time < :end_time"
+        group_by = "s.stat_time, o.item_id, o.account_id, o.user_id"
+    else:
+        stat_time_column = ":stat_time"
+        window_filter = "s.stat_time = :stat_time"
+        group_by = "o.item_id, o.account_id, o.user_id"
+    
+    return text(f"""
+        INSERT INTO {table} (
+            item_id, account_id, user_id, stat_time,
+            order_count, total_budget, total_cost,
+            total_play, total_like, total_comment, total_share, total_follow,
+            total_convert, total_home_visited,
+            avg_5s_rank, avg_convert_cost,
+            play_per_100_cost, like_rate, share_rate, share_per_100_play,
+            min_order_create_time,
+            agg_time, data_version,
+            create_time, update_time
+        )
+        SELECT 
+            o.item_id,
+            o.account_id,
+            o.user_id,
+            {stat_time_column} as stat_time,
+            
+            -- 基础统计
+            COUNT(DISTINCT o.order_id) as order_count,
+            SUM(o.budget) as total_budget,
+            SUM(s.stat_cost) as total_cost,
+            
+            -- 效果指标
+            SUM(s.total_play) as total_play,
+            SUM(s.custom_like) as total_like,
+            SUM(s.dy_comment) as total_comment,
+            SUM(s.dy_share) as total_share,
+            SUM(s.dy_follow) as total_follow,
+            SUM(s.dp_target_convert_cnt) as total_convert,
+            SUM(s.dy_home_visited) as total_home_visited,
+            
+            -- 平均指标
+            AVG(s.play_duration_5s_rank) as avg_5s_rank,
+            AVG(s.custom_convert_cost) as avg_convert_cost,
+            
+            -- 计算指标（百播放量 = 播放量 / 消耗 * 100）
+            CASE 
+                WHEN SUM(s.stat_cost) > 0 
+                THEN SUM(s.total_play) / SUM(s.stat_cost) * 100
+                ELSE 0 
+            END as play_per_100_cost,
+            
+            -- 点赞率 = 点赞数 / 播放量
+            CASE 
+                WHEN SUM(s.total_play) > 0 
+                THEN SUM(s.custom_like) * 1.0 / SUM(s.total_play)
+                ELSE 0 
+            END as like_rate,
+            
+            -- 转发率 = 转发数 / 播放量
+            CASE 
+                WHEN SUM(s.total_play) > 0 
+                THEN SUM(s.dy_share) * 1.0 / SUM(s.total_play)
+                ELSE 0 
+            END as share_rate,
+            
+            -- 百转发率 = 转发数 / 播放量 * 100
+            CASE 
+                WHEN SUM(s.total_play) > 0 
+                THEN SUM(s.dy_share) / SUM(s.total_play) * 100
+                ELSE 0 
+            END as share_per_100_play,
+            
+            -- 最早订单创建时间（用于时间筛选）
+            MIN(o.order_create_time) as min_order_create_time,
+            
+            NOW() as agg_time,
+            1 as data_version,
+            NOW() as create_time,
+            NOW() as update_time
+        
+        FROM douplus_order o
+        INNER JOIN (
+            -- 本窗口拉取到效果数据的订单
+            SELECT
+                s.order_id, s.stat_time, s.stat_cost, s.total_play, s.custom_like, s.dy_comment,
+                s.dy_share, s.dy_follow, s.dp_target_convert_cnt, s.dy_home_visited,
+                s.play_duration_5s_rank, s.custom_convert_cost
+            FROM douplus_order_stats s
+            WHERE {window_filter}
+            
+            UNION ALL
+            
+            -- 同一视频下最后一次效果数据早于本窗口的订单（已冻结），沿用最后的累计值
+            SELECT
+                ls.order_id, w.stat_time, ls.stat_cost, ls.total_play, ls.custom_like, ls.dy_comment,
+                ls.dy_share, ls.dy_follow, ls.dp_target_convert_cnt, ls.dy_home_visited,
+                ls.play_duration_5s_rank, ls.custom_convert_cost
+            FROM (
+                SELECT DISTINCT s.stat_time, o.item_id, o.account_id
+                FROM douplus_order_stats s
+                INNER JOIN douplus_order o ON o.order_id = s.order_id
+                WHERE {window_filter}
+                  AND o.deleted = 0
+                  {item_filter}
+            ) w
+            INNER JOIN douplus_order fo
+                ON fo.item_id = w.item_id AND fo.account_id = w.account_id AND fo.deleted = 0
+            INNER JOIN douplus_order_agg a
+                ON a.order_id = fo.order_id AND a.stat_time < w.stat_time
+            INNER JOIN douplus_order_stats ls
+                ON ls.order_id = a.order_id AND ls.stat_time = a.stat_time
+        ) s ON o.order_id = s.order_id
+        WHERE o.deleted = 0
+        {item_filter}
+        GROUP BY {group_by}
+        
+        ON DUPLICATE KEY UPDATE
+            order_count = VALUES(order_count),
+            total_budget = VALUES(total_budget),
+            total_cost = VALUES(total_cost),
+            total_play = VALUES(total_play),
+            total_like = VALUES(total_like),
+            total_comment = VALUES(total_comment),
+            total_share = VALUES(total_share),
+            total_follow = VALUES(total_follow),
+            total_convert = VALUES(total_convert),
+            total_home_visited = VALUES(total_home_visited),
+            avg_5s_rank = VALUES(avg_5s_rank),
+            avg_convert_cost = VALUES(avg_convert_cost),
+            play_per_100_cost = VALUES(play_per_100_cost),
+            like_rate = VALUES(like_rate),
+            share_rate = VALUES(share_rate),
+            share_per_100_play = VALUES(share_per_100_play),
+            min_order_create_time = VALUES(min_order_create_time),
+            agg_time = NOW(),
+            data_version = data_version + 1,
+            update_time = NOW()
+    """)
+
+
+def _video_rollup_sql(table: str, by_items: bool = False, by_range: bool = False):
+    """
+    构造小时/日汇总SQL：每个时段保存最后一个5分钟窗口的快照
+    
+    指标是累计值，时段内最新窗口即该时段的结果；已有更新的快照时不覆盖
+    
+    Args:
+        table: 汇总表（ROLLUP_TIERS中的表）
+        by_items: 是否只汇总 :item_ids 中的视频
+        by_range: 是否汇总 [:start_time, :end_time) 内的所有窗口，否则只汇总 :stat_time 窗口
+    """
+    bucket = ROLLUP_TIERS[table]
+    item_filter = "AND v.item_id IN :item_ids" if by_items else ""
+    if by_range:
+        source = f"""
+            douplus_video_stats_agg v
+            INNER JOIN (
+                SELECT item_id, account_id, MAX(stat_time) as max_stat_time
+                FROM douplus_video_stats_agg
+                WHERE stat_time >= :start_time AND stat_time < :end_time
+                GROUP BY item_id, account_id, {bucket.format(col='stat_time')}
+            ) last ON v.item_id = last.item_id
+                AND v.account_id = last.account_id
+                AND v.stat_time = last.max_stat_time
+            WHERE 1 = 1"""
+    else:
+        source = "douplus_video_stats_agg v WHERE v.stat_time = :stat_time"
+    
+    metrics = [
+        'order_count', 'total_budget', 'total_cost', 'total_play', 'total_like',
+        'total_comment', 'total_share', 'total_follow', 'total_convert',
+        'play_per_100_cost', 'share_per_100_play', 'avg_convert_cost',
+    ]
+    updates = ",\n".join(
+        f"            {m} = IF(VALUES(snapshot_time) >= snapshot_time, VALUES({m}), {m})" for m in metrics
+    )
+    return text(f"""
+        INSERT INTO {table} (
+            item_id, account_id, user_id, bucket_time, snapshot_time,
+            {', '.join(metrics)}
+        )
+        SELECT
+            v.item_id, v.account_id, v.user_id,
+            {bucket.format(col='v.stat_time')} as bucket_time,
+            v.stat_time as snapshot_time,
+            {', '.join('v.' + m for m in metrics)}
+        FROM {source}
+        {item_filter}
+        ON DUPLICATE KEY UPDATE
+{updates},
+            -- MySQL按顺序求值SET子句，snapshot_time必须最后更新
+            snapshot_time = GREATEST(snapshot_time, VALUES(snapshot_time))
+    """)
+
+
+def _video_latest_sql(by_items: bool = False, by_window: bool = False):
+    """
+    构造视频最新效果数据SQL
+    
+    按订单最新累计值（douplus_order_agg）汇总，不受已冻结订单不再产生新窗口数据的影响
+    
+    Args:
+        by_items: 是否只刷新 :item_ids 中的视频
+        by_window: 是否只刷新 :stat_time 窗口内有数据的视频
+    """
+    if by_items:
+        item_filter = "AND o.item_id IN :item_ids"
+    elif by_window:
+        item_filter = """AND o.item_id IN (
+                SELECT item_id FROM douplus_video_stats_agg WHERE stat_time = :stat_time
+            )"""
+    else:
+        item_filter = ""
+    
+    return text(f"""
+        INSERT INTO {VIDEO_LATEST_TABLE} (
+            item_id, account_id, user_id, title, cover,
+            order_count, total_budget, total_cost, total_play, total_like,
+            total_comment, total_share, total_follow, total_convert,
+            play_per_100_cost, share_per_100_play, avg_convert_cost,
+            min_order_create_time, max_order_create_time, stat_time
+        )
+        SELECT
+            o.item_id, o.account_id, o.user_id,
+            MAX(o.aweme_title) as title,
+            MAX(o.aweme_cover) as cover,
+            COUNT(*) as order_count,
+            COALESCE(SUM(o.budget), 0) as total_budget,
+            COALESCE(SUM(a.total_cost), 0) as total_cost,
+            COALESCE(SUM(a.total_play), 0) as total_play,
+            COALESCE(SUM(a.total_like), 0) as total_like,
+            COALESCE(SUM(a.total_comment), 0) as total_comment,
+            COALESCE(SUM(a.total_share), 0) as total_share,
+            COALESCE(SUM(a.total_follow), 0) as total_follow,
+            COALESCE(SUM(a.total_convert), 0) as total_convert,
+            CASE 
+                WHEN SUM(a.total_cost) > 0 
+                THEN SUM(a.total_play) / SUM(a.total_cost) * 100
+                ELSE 0 
+            END as play_per_100_cost,
+            CASE 
+                WHEN SUM(a.total_play) > 0 
+                THEN SUM(a.total_share) / SUM(a.total_play) * 100
+                ELSE 0 
+            END as share_per_100_play,
+            CASE 
+                WHEN SUM(a.total_convert) > 0 
+                THEN SUM(a.total_cost) / SUM(a.total_convert)
+                ELSE 0 
+            END as avg_convert_cost,
+            MIN(o.order_create_time) as min_order_create_time,
+            MAX(o.order_create_time) as max_order_create_time,
+            MAX(a.stat_time) as stat_time
+        FROM douplus_order o
+        LEFT JOIN douplus_order_agg a ON a.order_id = o.order_id
+        WHERE o.deleted = 0
+          AND o.item_id IS NOT NULL AND o.item_id != ''
+          {item_filter}
+        GROUP BY o.item_id, o.account_id, o.user_id
+        -- 只保留有效果数据的视频
+        HAVING MAX(a.stat_time) IS NOT NULL
+        ON DUPLICATE KEY UPDATE
+            user_id = VALUES(user_id),
+            title = VALUES(title),
+            cover = VALUES(cover),
+            order_count = VALUES(order_count),
+            total_budget = VALUES(total_budget),
+            total_cost = VALUES(total_cost),
+            total_play = VALUES(total_play),
+            total_like = VALUES(total_like),
+            total_comment = VALUES(total_comment),
+            total_share = VALUES(total_share),
+            total_follow = VALUES(total_follow),
+            total_convert = VALUES(total_convert),
+            play_per_100_cost = VALUES(play_per_100_cost),
+            share_per_100_play = VALUES(share_per_100_play),
+            avg_convert_cost = VALUES(avg_convert_cost),
+            min_order_create_time = VALUES(min_order_create_time),
+            max_order_create_time = VALUES(max_order_create_time),
+            stat_time = VALUES(stat_time)
+    """)
+
 
 class VideoAggTask(Task):
     """视频维度聚合任务基类"""
     
-    def aggregate_video_stats(self, stat_time: datetime = None):
+    def aggregate_video_stats(self, stat_time: datetime = None, item_ids: list = None):
         """
         聚合视频维度效果数据
         
         Args:
             stat_time: 统计时间窗口，默认为当前窗口
+            item_ids: 只聚合这些视频，默认聚合窗口内所有视频
         """
         if stat_time is None:
             stat_time = get_current_window()
         
         db = get_db()
         try:
-            logger.info(f"开始聚合视频数据: stat_time={stat_time}")
-            
             # 使用SQL直接聚合，避免ORM性能问题
-            agg_sql = text("""
-                INSERT INTO douplus_video_stats_agg (
-                    item_id, account_id, user_id, stat_time,
-                    order_count, total_budget, total_cost,
-                    total_play, total_like, total_comment, total_share, total_follow,
-                    total_convert, total_home_visited,
-                    avg_5s_rank, avg_convert_cost,
-                    play_per_100_cost, like_rate, share_rate, share_per_100_play,
-                    min_order_create_time,
-                    agg_time, data_version,
-                    create_time, update_time
-                )
-                SELECT 
-                    o.item_id,
-                    o.account_id,
-                    o.user_id,
-                    :stat_time as stat_time,
-                    
-                    -- 基础统计
-                    COUNT(DISTINCT o.order_id) as order_count,
-                    SUM(o.budget) as total_budget,
-                    SUM(s.stat_cost) as total_cost,
-                    
-                    -- 效果指标
-                    SUM(s.total_play) as total_play,
-                    SUM(s.custom_like) as total_like,
-                    SUM(s.dy_comment) as total_comment,
-                    SUM(s.dy_share) as total_share,
-                    SUM(s.dy_follow) as total_follow,
-                    SUM(s.dp_target_convert_cnt) as total_convert,
-                    SUM(s.dy_home_visited) as total_home_visited,
-                    
-                    -- 平均指标
-                    AVG(s.play_duration_5s_rank) as avg_5s_rank,
-                    AVG(s.custom_convert_cost) as avg_convert_cost,
-                    
-                    -- 计算指标（百播放量 = 播放量 / 消耗 * 100）
-                    CASE 
-                        WHEN SUM(s.stat_cost) > 0 
-                        THEN SUM(s.total_play) / SUM(s.stat_cost) * 100
-                        ELSE 0 
-                    END as play_per_100_cost,
-                    
-                    -- 点赞率 = 点赞数 / 播放量
-                    CASE 
-                        WHEN SUM(s.total_play) > 0 
-                        THEN SUM(s.custom_like) * 1.0 / SUM(s.total_play)
-                        ELSE 0 
-                    END as like_rate,
-                    
-                    -- 转发率 = 转发数 / 播放量
-                    CASE 
-                        WHEN SUM(s.total_play) > 0 
-                        THEN SUM(s.dy_share) * 1.0 / SUM(s.total_play)
-                        ELSE 0 
-                    END as share_rate,
-                    
-                    -- 百转发率 = 转发数 / 播放量 * 100
-                    CASE 
-                        WHEN SUM(s.total_play) > 0 
-                        THEN SUM(s.dy_share) / SUM(s.total_play) * 100
-                        ELSE 0 
-                    END as share_per_100_play,
-                    
-                    -- 最早订单创建时间（用于时间筛选）
-                    MIN(o.order_create_time) as min_order_create_time,
-                    
-                    NOW() as agg_time,
-                    1 as data_version,
-                    NOW() as create_time,
-                    NOW() as update_time
-                    
-                FROM douplus_order o
-                INNER JOIN douplus_order_stats s 
-                    ON o.order_id = s.order_id AND s.stat_time = :stat_time
-                WHERE o.deleted = 0
-                GROUP BY o.item_id, o.account_id, o.user_id
-                
-                ON DUPLICATE KEY UPDATE
-                    order_count = VALUES(order_count),
-                    total_budget = VALUES(total_budget),
-                    total_cost = VALUES(total_cost),
-                    total_play = VALUES(total_play),
-                    total_like = VALUES(total_like),
-                    total_comment = VALUES(total_comment),
-                    total_share = VALUES(total_share),
-                    total_follow = VALUES(total_follow),
-                    total_convert = VALUES(total_convert),
-                    total_home_visited = VALUES(total_home_visited),
-                    avg_5s_rank = VALUES(avg_5s_rank),
-                    avg_convert_cost = VALUES(avg_convert_cost),
-                    play_per_100_cost = VALUES(play_per_100_cost),
-                    like_rate = VALUES(like_rate),
-                    share_rate = VALUES(share_rate),
-                    share_per_100_play = VALUES(share_per_100_play),
-                    min_order_create_time = VALUES(min_order_create_time),
-                    agg_time = NOW(),
-                    data_version = data_version + 1,
-                    update_time = NOW()
-            """)
+            # 5分钟窗口写入后，同一事务内刷新小时/日汇总和视频最新数据
+            if item_ids is None:
+                logger.info(f"开始聚合视频数据: stat_time={stat_time}")
+                params = {'stat_time': stat_time}
+                result = db.execute(_video_agg_sql(), params)
+                affected_rows = result.rowcount
+                for table in ROLLUP_TIERS:
+                    db.execute(_video_rollup_sql(table), params)
+                db.execute(_video_latest_sql(by_window=True), params)
+            else:
+                logger.info(f"开始聚合视频数据: stat_time={stat_time}, 视频数={len(item_ids)}")
+                affected_rows = 0
+                for i in range(0, len(item_ids), ITEM_CHUNK_SIZE):
+                    params = {'stat_time': stat_time, 'item_ids': tuple(item_ids[i:i+ITEM_CHUNK_SIZE])}
+                    result = db.execute(_video_agg_sql(by_items=True), params)
+                    affected_rows += result.rowcount
+                    for table in ROLLUP_TIERS:
+                        db.execute(_video_rollup_sql(table, by_items=True), params)
+                    db.execute(_video_latest_sql(by_items=True), params)
             
-            result = db.execute(agg_sql, {'stat_time': stat_time})
             db.commit()
-            
-            affected_rows = result.rowcount
             logger.info(f"视频数据聚合完成: stat_time={stat_time}, 聚合了{affected_rows}个视频")
             
             return affected_rows
-            
+        
         except Exception as e:
             logger.error(f"视频数据聚合失败: {e}", exc_info=True)
             db.rollback()
@@ -175,14 +423,124 @@ class VideoAggTask(Task):
                 logger.error(f"聚合窗口{stat_time}失败: {e}")
 
 
+def mark_videos_dirty(stat_time: datetime, item_ids):
+    """
+    标记某个窗口中效果数据有变化的视频，并调度一次防抖聚合
+    
+    多个账号在同一窗口内的标记会合并到同一次聚合任务中。
+    Redis不可用时直接同步聚合这些视频，保证数据不丢
+    
+    Args:
+        stat_time: 效果数据的统计时间窗口
+        item_ids: 受影响的视频ID
+    """
+    item_ids = [item_id for item_id in set(item_ids) if item_id]
+    if not item_ids:
+        return
+    
+    window = stat_time.strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        r = get_redis()
+        items_key = DIRTY_ITEMS_KEY.format(window=window)
+        pipe = r.pipeline()
+        pipe.sadd(items_key, *item_ids)
+        pipe.expire(items_key, DIRTY_TTL)
+        pipe.sadd(DIRTY_WINDOWS_KEY, window)
+        pipe.expire(DIRTY_WINDOWS_KEY, DIRTY_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"标记脏视频失败，直接聚合: stat_time={window}, 视频数={len(item_ids)}, error={e}")
+        VideoAggTask().aggregate_video_stats(stat_time, item_ids)
+        return
+    
+    _schedule_flush()
+
+
+def _schedule_flush():
+    """在防抖时间后执行一次聚合，已有待执行的任务时不重复调度"""
+    debounce = settings.VIDEO_AGG_DEBOUNCE_SECONDS
+    try:
+        r = get_redis()
+        if not r.set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=debounce + 60):
+            return
+    except Exception as e:
+        # 调度失败时脏标记仍保留，由Beat定时任务兜底处理
+        logger.warning(f"调度视频聚合任务失败: {e}")
+        return
+    
+    try:
+        # API进程（/stats/refresh直接同步效果数据）中没有加载Celery应用，需显式使用celery_app
+        from celery_app import app as celery_app
+        celery_app.send_task('app.tasks.video_agg.aggregate_current_window', countdown=debounce)
+    except Exception as e:
+        # 投递失败时清除防抖标记，下一次标记脏视频可以重新调度；脏标记仍保留，由Beat定时任务兜底处理
+        logger.warning(f"调度视频聚合任务失败: {e}")
+        try:
+            r.delete(FLUSH_SCHEDULED_KEY)
+        except Exception:
+            pass
+
+
+def _take_dirty_items(r, window: str) -> list:
+    """
+    取出并清空某个窗口的脏视频
+    
+    先移除窗口标记再原子重命名脏集合：两步之间新标记的视频会同时重新标记窗口，不会丢失
+    """
+    r.srem(DIRTY_WINDOWS_KEY, window)
+    items_key = DIRTY_ITEMS_KEY.format(window=window)
+    processing_key = f"{items_key}:processing:{uuid.uuid4().hex}"
+    try:
+        r.rename(items_key, processing_key)
+    except Exception:
+        # 集合不存在（已被处理）
+        return []
+    item_ids = list(r.smembers(processing_key))
+    r.delete(processing_key)
+    return item_ids
+
+
+@single_flight('video_agg_flush', on_skip=_schedule_flush)
 def aggregate_current_window():
     """
-    聚合当前时间窗口的视频数据
+    聚合所有窗口中被标记为脏的视频
     
-    由Celery Beat每5分钟调用一次
+    由效果数据同步后的防抖调度触发，Celery Beat每5分钟兜底调用一次；
+    没有脏视频时不做任何聚合。Redis不可用时退化为聚合当前窗口的全部视频
     """
     task = VideoAggTask()
-    task.aggregate_video_stats()
+    try:
+        r = get_redis()
+        # 先清除防抖标记，之后的新标记会调度下一次聚合
+        r.delete(FLUSH_SCHEDULED_KEY)
+        windows = sorted(r.smembers(DIRTY_WINDOWS_KEY))
+    except Exception as e:
+        logger.warning(f"读取脏视频标记失败，聚合当前窗口全部视频: {e}")
+        task.aggregate_video_stats()
+        bump_global_version()
+        return
+    
+    if not windows:
+        logger.info("没有需要聚合的脏视频")
+        return
+    
+    aggregated = False
+    for window in windows:
+        item_ids = _take_dirty_items(r, window)
+        if not item_ids:
+            continue
+        
+        stat_time = datetime.strptime(window, '%Y-%m-%d %H:%M:%S')
+        try:
+            task.aggregate_video_stats(stat_time, item_ids)
+            aggregated = True
+        except Exception as e:
+            logger.error(f"聚合窗口{window}失败，重新标记{len(item_ids)}个视频: {e}")
+            mark_videos_dirty(stat_time, item_ids)
+    
+    # 视频排行等接口的缓存失效
+    if aggregated:
+        bump_global_version()
 
 
 def aggregate_all_recent():
@@ -197,50 +555,193 @@ def aggregate_all_recent():
     logger.info("聚合完成")
 
 
-def rebuild_video_agg_table():
+def _table_exists(db, table: str) -> bool:
+    """判断当前库中是否存在指定表"""
+    return db.execute(text("""
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = :table
+    """), {'table': table}).scalar() > 0
+
+
+def _rebuild_cursor_key(day_start: datetime) -> str:
+    """重建分片的游标键"""
+    return f"{REBUILD_CURSOR_PREFIX}{day_start.strftime('%Y-%m-%d')}"
+
+
+def _clear_rebuild_cursors(db):
+    """清除重建分片的完成记录，由调用者负责提交"""
+    db.execute(text("DELETE FROM douplus_sync_cursor WHERE cursor_key LIKE :prefix"), {
+        'prefix': f"{REBUILD_CURSOR_PREFIX}%"
+    })
+
+
+def _rebuild_chunk(start_time: datetime, end_time: datetime, record: bool) -> int:
+    """
+    聚合一个自然日分片到影子表
+    
+    分片数据与完成记录在同一事务内写入，游标表中有完成记录的分片直接跳过
+    
+    Args:
+        start_time: 分片起点（当天零点）
+        end_time: 分片终点（次日零点）
+        record: 是否记录完成；重建开始时尚未结束的分片还会写入新窗口，不记录，续跑时重新聚合
+    
+    Returns:
+        int: 写入行数，跳过时返回-1
+    """
+    cursor_key = _rebuild_cursor_key(start_time)
+    db = get_db()
+    try:
+        if get_cursor(db, cursor_key):
+            return -1
+        
+        result = db.execute(
+            _video_agg_sql(by_range=True, table=VIDEO_AGG_SHADOW_TABLE),
+            {'start_time': start_time, 'end_time': end_time}
+        )
+        if record:
+            save_cursor(db, cursor_key, start_time)
+        db.commit()
+        return result.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@single_flight('video_agg_rebuild')
+def rebuild_video_agg_table(resume: bool = True):
     """
     重建整个视频预聚合表
     
+    1. 在影子表中按自然日分片并行聚合全部历史窗口，线上表在此期间照常读写
+    2. 中断后再次执行会跳过游标表中记录为已完成的分片（resume=False时从头开始）；
+       同一时间只允许一个重建任务使用影子表
+    3. 全部完成后 RENAME TABLE 原子替换线上表，读者不会看到空表
+    4. 替换后补聚合重建期间产生的新窗口
+    
     警告：此操作会重新计算所有历史数据，耗时较长
     仅用于数据迁移或表损坏修复
+    
+    Args:
+        resume: 是否续用上次未完成的影子表
     """
+    started_at = get_current_window()
     db = get_db()
     try:
-        logger.warning("开始重建视频预聚合表（清空并重新计算所有数据）")
-        
-        # 1. 清空表
-        db.execute(text("TRUNCATE TABLE douplus_video_stats_agg"))
-        db.commit()
-        logger.info("已清空 douplus_video_stats_agg 表")
-        
-        # 2. 获取所有不同的stat_time
-        result = db.execute(text("""
-            SELECT DISTINCT stat_time 
-            FROM douplus_order_stats 
-            ORDER BY stat_time DESC
-        """))
-        
-        stat_times = [row[0] for row in result.fetchall()]
-        logger.info(f"发现{len(stat_times)}个不同的时间窗口需要聚合")
-        
-        # 3. 逐个窗口聚合
-        task = VideoAggTask()
-        success_count = 0
-        fail_count = 0
+        # 1. 准备影子表
+        if not resume or not _table_exists(db, VIDEO_AGG_SHADOW_TABLE):
+            db.execute(text(f"DROP TABLE IF EXISTS {VIDEO_AGG_SHADOW_TABLE}"))
+            db.execute(text(f"CREATE TABLE {VIDEO_AGG_SHADOW_TABLE} LIKE {VIDEO_AGG_TABLE}"))
+            _clear_rebuild_cursors(db)
+            db.commit()
+            logger.warning(f"开始重建视频预聚合表: 已创建影子表 {VIDEO_AGG_SHADOW_TABLE}")
+        else:
+            logger.warning(f"继续重建视频预聚合表: 续用影子表 {VIDEO_AGG_SHADOW_TABLE}")
         
-        for stat_time in stat_times:
+        # 2. 按自然日切分分片（新窗口优先），分片边界固定，续跑时与上次一致
+        min_time, max_time = db.execute(text("""
+            SELECT MIN(stat_time), MAX(stat_time) FROM douplus_order_stats
+        """)).first()
+    finally:
+        db.close()
+    
+    chunks = []
+    if min_time is not None:
+        first_day = datetime.combine(min_time.date(), datetime.min.time())
+        chunk_start = datetime.combine(max_time.date(), datetime.min.time())
+        while chunk_start >= first_day:
+            chunks.append((chunk_start, chunk_start + timedelta(days=1)))
+            chunk_start -= timedelta(days=1)
+    logger.info(f"共{len(chunks)}个分片需要聚合: {min_time} ~ {max_time}")
+    
+    # 3. 并行聚合各分片
+    success_count = 0
+    skip_count = 0
+    fail_count = 0
+    with ThreadPoolExecutor(max_workers=settings.VIDEO_AGG_REBUILD_WORKERS) as executor:
+        futures = {
+            executor.submit(_rebuild_chunk, start, end, end <= started_at): (start, end)
+            for start, end in chunks
+        }
+        for future in as_completed(futures):
+            start, end = futures[future]
             try:
-                task.aggregate_video_stats(stat_time)
-                success_count += 1
+                if future.result() < 0:
+                    skip_count += 1
+                else:
+                    success_count += 1
             except Exception as e:
-                logger.error(f"聚合窗口{stat_time}失败: {e}")
+                logger.error(f"聚合分片{start}~{end}失败: {e}")
                 fail_count += 1
+    
+    logger.info(f"影子表聚合完成: 成功{success_count}个分片, 跳过{skip_count}个, 失败{fail_count}个")
+    if fail_count:
+        raise RuntimeError(f"视频预聚合表重建未完成: {fail_count}个分片失败，重新执行将从断点继续")
+    
+    # 4. 原子替换线上表
+    db = get_db()
+    try:
+        db.execute(text(f"DROP TABLE IF EXISTS {VIDEO_AGG_OLD_TABLE}"))
+        db.execute(text(f"""
+            RENAME TABLE {VIDEO_AGG_TABLE} TO {VIDEO_AGG_OLD_TABLE},
+                         {VIDEO_AGG_SHADOW_TABLE} TO {VIDEO_AGG_TABLE}
+        """))
+        db.execute(text(f"DROP TABLE {VIDEO_AGG_OLD_TABLE}"))
+        _clear_rebuild_cursors(db)
+        db.commit()
+        logger.info("已用影子表替换 douplus_video_stats_agg")
         
-        logger.info(f"视频预聚合表重建完成: 成功{success_count}个窗口, 失败{fail_count}个窗口")
-        
+        # 5. 补聚合重建期间产生的窗口（这些窗口的增量聚合写入了旧表）
+        result = db.execute(_video_agg_sql(by_range=True), {
+            'start_time': min(started_at, max_time or started_at),
+            'end_time': get_current_window() + timedelta(minutes=5)
+        })
+        db.commit()
+        logger.info(f"视频预聚合表重建完成: 补聚合{result.rowcount}行")
+    
     except Exception as e:
         logger.error(f"重建视频预聚合表失败: {e}", exc_info=True)
         db.rollback()
         raise
     finally:
         db.close()
+    
+    # 6. 汇总表基于新的预聚合表重新计算
+    rebuild_video_rollups()
+
+
+def rebuild_video_rollups():
+    """
+    重新计算小时/日汇总表和视频最新数据表
+    
+    用于汇总表初始化（建表后执行一次）或预聚合表重建后的修复；
+    按天分片写入，每个分片一个事务，可重复执行
+    """
+    db = get_db()
+    try:
+        min_time, max_time = db.execute(text("""
+            SELECT MIN(stat_time), MAX(stat_time) FROM douplus_video_stats_agg
+        """)).first()
+        
+        if min_time is not None:
+            day = min_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day <= max_time:
+                params = {'start_time': day, 'end_time': day + timedelta(days=1)}
+                for table in ROLLUP_TIERS:
+                    db.execute(_video_rollup_sql(table, by_range=True), params)
+                db.commit()
+                day += timedelta(days=1)
+            logger.info(f"小时/日汇总表重建完成: {min_time} ~ {max_time}")
+        
+        result = db.execute(_video_latest_sql())
+        db.commit()
+        logger.info(f"视频最新数据表重建完成: {result.rowcount}行")
+    
+    except Exception as e:
+        logger.error(f"重建视频汇总表失败: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
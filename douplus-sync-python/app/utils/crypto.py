@@ -2,6 +2,7 @@
 加密解密工具
 """
 import base64
+from functools import lru_cache
 
 
 def decrypt_access_token(encrypted_token: str) -> str:
@@ -22,6 +23,20 @@ def decrypt_access_token(encrypted_token: str) -> str:
         raise ValueError(f"解密token失败: {e}")
 
 
+@lru_cache(maxsize=4096)
+def decrypt_access_token_cached(encrypted_token: str) -> str:
+    """
+    带缓存的解密（密文变化即为新token，缓存无需失效）
+    
+    Args:
+        encrypted_token: Base64编码的token
+    
+    Returns:
+        解密后的token
+    """
+    return decrypt_access_token(encrypted_token)
+
+
 def encrypt_access_token(token: str) -> str:
     """
     加密AccessToken
@@ -0,0 +1,259 @@
+"""
+订单数据导出写入工具（同步导出接口、异步导出任务共用）
+
+- 使用服务端游标（stream_results）分块读取，不一次性fetchall
+- Excel使用openpyxl只写模式（write_only），行数据直接落盘，内存占用与行数无关
+- CSV逐块编码输出，可直接作为流式响应体
+"""
+import csv
+import io
+import os
+import tempfile
+from sqlalchemy import text
+
+from app.config import get_settings
+
+
+settings = get_settings()
+
+# 需要安装openpyxl: pip install openpyxl
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment, PatternFill
+    XLSX_AVAILABLE = True
+except ImportError:
+    XLSX_AVAILABLE = False
+
+EXPORT_FORMATS = ('xlsx', 'csv')
+
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# 表头
+EXPORT_HEADERS = [
+    "订单ID", "视频ID", "状态", "预算(元)", "视频标题", "账号",
+    "下单时间", "实际消耗(元)", "播放量", "点赞数", "评论数",
+    "转发数", "关注数", "转化数", "百播放量", "转化成本(元)",
+    "百转发率", "5秒完播率"
+]
+
+# 列宽
+COLUMN_WIDTHS = [20, 20, 12, 12, 40, 15, 18, 12, 12, 10, 10, 10, 10, 10, 12, 12, 12, 12]
+
+# 状态映射
+STATUS_MAP = {
+    'UNPAID': '未支付',
+    'AUDITING': '审核中',
+    'DELIVERING': '投放中',
+    'DELIVERIED': '已完成',
+    'UNDELIVERIED': '投放终止',
+    'AUDIT_PAUSE': '审核暂停',
+    'AUDIT_REJECTED': '审核不通过'
+}
+
+# 临时文件分块读取大小
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def build_export_sql(where_clause: str) -> str:
+    """构建导出查询SQL（WHERE条件由build_order_filters生成）"""
+    return f"""
+        SELECT
+            o.order_id,
+            o.item_id,
+            o.status,
+            o.budget,
+            o.aweme_title,
+            a.nickname as account_nickname,
+            o.order_create_time,
+            oa.total_cost,
+            oa.total_play,
+            oa.total_like,
+            oa.total_comment,
+            oa.total_share,
+            oa.total_follow,
+            oa.total_convert,
+            oa.play_per_100_cost,
+            oa.avg_convert_cost,
+            oa.share_rate,
+            oa.play_duration_5s
+        FROM douplus_order o
+        INNER JOIN douyin_account a ON o.account_id = a.id
+        LEFT JOIN douplus_order_agg oa ON o.order_id = oa.order_id
+        WHERE {where_clause}
+        ORDER BY o.order_create_time DESC, o.id DESC
+    """
+
+
+def format_export_row(row) -> list:
+    """将查询结果转换为导出行"""
+    return [
+        str(row[0]),  # 订单ID
+        str(row[1]),  # 视频ID
+        STATUS_MAP.get(row[2], row[2]),  # 状态
+        float(row[3]) if row[3] else 0,  # 预算
+        str(row[4] or ''),  # 标题
+        str(row[5] or ''),  # 账号
+        row[6].strftime('%Y-%m-%d %H:%M') if row[6] else '',  # 时间
+        float(row[7]) if row[7] else 0,  # 消耗
+        int(row[8]) if row[8] else 0,  # 播放量
+        int(row[9]) if row[9] else 0,  # 点赞
+        int(row[10]) if row[10] else 0,  # 评论
+        int(row[11]) if row[11] else 0,  # 转发
+        int(row[12]) if row[12] else 0,  # 关注
+        int(row[13]) if row[13] else 0,  # 转化
+        float(row[14]) if row[14] else 0,  # 百播放量
+        float(row[15]) if row[15] else 0,  # 转化成本
+        float(row[16]) if row[16] else 0,  # 百转发率
+        float(row[17]) * 100 if row[17] else 0,  # 5秒完播率
+    ]
+
+
+def iter_export_rows(db, sql: str, params: dict, chunk_size: int = None):
+    """
+    使用服务端游标分块读取导出数据
+    
+    注意：迭代结束前会一直占用该会话的数据库连接
+    
+    Args:
+        db: 数据库会话
+        sql: 查询SQL
+        params: 查询参数
+        chunk_size: 每次从服务端拉取的行数，默认EXPORT_CHUNK_SIZE
+    
+    Yields:
+        格式化后的导出行
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    result = db.execute(
+        text(sql).execution_options(stream_results=True, max_row_buffer=chunk_size),
+        params
+    )
+    try:
+        for rows in result.partitions(chunk_size):
+            for row in rows:
+                yield format_export_row(row)
+    finally:
+        result.close()
+
+
+def write_xlsx(rows, fileobj):
+    """
+    以只写模式写入Excel
+    
+    Args:
+        rows: 导出行迭代器
+        fileobj: 文件路径或可写文件对象
+    
+    Returns:
+        写入的数据行数
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("订单数据")
+    
+    # 列宽需在写入数据前设置
+    for col_num, width in enumerate(COLUMN_WIDTHS, 1):
+        ws.column_dimensions[chr(64 + col_num)].width = width
+    
+    # 标题行样式
+    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+    header_alignment = Alignment(horizontal="center", vertical="center")
+    
+    header_cells = []
+    for header in EXPORT_HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header_cells.append(cell)
+    ws.append(header_cells)
+    
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    
+    wb.save(fileobj)
+    return count
+
+
+def write_csv(rows, fileobj):
+    """
+    写入CSV（UTF-8 BOM，Excel可直接打开）
+    
+    Args:
+        rows: 导出行迭代器
+        fileobj: 以二进制模式打开的可写文件对象
+    
+    Returns:
+        写入的数据行数
+    """
+    count = 0
+    
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+    
+    for chunk in iter_csv(counted()):
+        fileobj.write(chunk)
+    return count
+
+
+def iter_csv(rows, batch_rows: int = 500):
+    """
+    逐块生成CSV内容（第一块为BOM+表头，之后每块batch_rows行）
+    
+    Yields:
+        UTF-8编码的字节块
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    writer.writerow(EXPORT_HEADERS)
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    
+    if pending:
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_xlsx_tempfile(rows) -> str:
+    """写入Excel到临时文件，返回文件路径（调用方负责删除）"""
+    fd, path = tempfile.mkstemp(suffix='.xlsx', prefix='douplus_export_')
+    os.close(fd)
+    try:
+        write_xlsx(rows, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def iter_file_and_remove(path: str):
+    """分块读取文件内容，读取完毕（或客户端断开）后删除文件"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
@@ -0,0 +1,174 @@
+"""
+Redis分布式锁与租约
+
+- 锁：SET NX加锁，锁值为随机token，释放时比对token后删除，避免误删其他进程在锁过期后重新获取的锁
+- 租约：持有期间由后台线程定期续期（心跳），持有者崩溃后租约在TTL内自动过期，
+  适合执行时间不确定的任务（同步、聚合），防止同一账号/同一定时任务重叠执行
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.utils.redis_client import get_redis
+
+
+settings = get_settings()
+
+LOCK_KEY = 'lock:{name}'
+
+# 只删除自己持有的锁
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# 只续期自己持有的租约
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def acquire_lock(name: str, ttl: int) -> Optional[str]:
+    """
+    尝试获取锁（不等待）
+    
+    Args:
+        name: 锁名称
+        ttl: 锁过期时间（秒），持有者异常退出时自动释放
+    
+    Returns:
+        获取成功返回锁token，失败返回None
+    """
+    token = uuid.uuid4().hex
+    if get_redis().set(LOCK_KEY.format(name=name), token, nx=True, ex=ttl):
+        return token
+    return None
+
+
+def release_lock(name: str, token: str) -> bool:
+    """
+    释放锁（只释放自己持有的锁）
+    
+    Returns:
+        是否释放成功，锁已过期或被他人持有时返回False
+    """
+    try:
+        return bool(get_redis().eval(_RELEASE_SCRIPT, 1, LOCK_KEY.format(name=name), token))
+    except Exception as e:
+        logger.warning(f"释放锁失败: name={name}, error={e}")
+        return False
+
+
+@contextmanager
+def redis_lock(name: str, ttl: int):
+    """
+    分布式锁上下文，获取失败时不等待
+    
+    用法：
+        with redis_lock(f"token_refresh:{account_id}", ttl=60) as acquired:
+            if not acquired:
+                return
+    
+    Yields:
+        是否获取到锁
+    """
+    token = acquire_lock(name, ttl)
+    try:
+        yield token is not None
+    finally:
+        if token:
+            release_lock(name, token)
+
+
+def _heartbeat(name: str, token: str, ttl: int, stop: threading.Event):
+    """租约心跳：每ttl/3秒续期一次，续期失败（租约已丢失）时停止"""
+    interval = max(1, ttl // 3)
+    while not stop.wait(interval):
+        try:
+            if not get_redis().eval(_RENEW_SCRIPT, 1, LOCK_KEY.format(name=name), token, ttl):
+                logger.warning(f"租约已丢失，停止续期: name={name}")
+                return
+        except Exception as e:
+            logger.warning(f"租约续期失败: name={name}, error={e}")
+
+
+@contextmanager
+def redis_lease(name: str, ttl: int = None):
+    """
+    带心跳的分布式租约，获取失败时不等待
+    
+    Redis不可用时放行（与未加租约前的行为一致），只记录警告
+    
+    用法：
+        with redis_lease(f"order_sync:{account_id}") as acquired:
+            if not acquired:
+                return
+    
+    Args:
+        name: 租约名称
+        ttl: 租约时长（秒），默认SYNC_LEASE_TTL；持有者崩溃后最多ttl秒即可被重新获取
+    
+    Yields:
+        是否获取到租约
+    """
+    ttl = ttl or settings.SYNC_LEASE_TTL
+    
+    try:
+        token = acquire_lock(name, ttl)
+    except Exception as e:
+        logger.warning(f"获取租约失败，直接执行: name={name}, error={e}")
+        token = ''
+    
+    if token is None:
+        yield False
+        return
+    if not token:
+        yield True
+        return
+    
+    stop = threading.Event()
+    threading.Thread(
+        target=_heartbeat,
+        args=(name, token, ttl, stop),
+        name=f"lease-{name}",
+        daemon=True
+    ).start()
+    try:
+        yield True
+    finally:
+        stop.set()
+        release_lock(name, token)
+
+
+def single_flight(name: str, ttl: int = None, on_skip=None):
+    """
+    定时任务防重叠装饰器：上一次执行未结束时跳过本次
+    
+    Args:
+        name: 租约名称
+        ttl: 租约时长（秒），默认SYNC_LEASE_TTL
+        on_skip: 跳过时调用的函数（如重新安排一次执行，合并到下一次）
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with redis_lease(f"job:{name}", ttl) as acquired:
+                if not acquired:
+                    logger.info(f"任务{name}上一次执行尚未结束，跳过本次")
+                    if on_skip:
+                        on_skip()
+                    return {'skipped': True}
+                return f(*args, **kwargs)
+        
+        return decorated_function
+    
+    return decorator
@@ -0,0 +1,117 @@
+"""
+订单列表筛选条件（订单列表、导出共用）
+
+时间筛选使用半开区间 [startDate 00:00, endDate+1天 00:00)，
+不对 order_create_time 套函数，保证能走 (user_id, deleted, order_create_time) 索引
+
+关键词搜索：纯数字先按视频ID精确匹配，命中即只按视频ID筛选；
+否则标题走ngram全文索引（短关键词或关闭全文索引时退回LIKE）
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from app.config import get_settings
+
+
+settings = get_settings()
+
+# ngram分词长度（MySQL默认ngram_token_size=2），短于此长度的关键词无法走全文索引
+NGRAM_TOKEN_SIZE = 2
+
+
+def parse_date(value: str) -> datetime:
+    """
+    解析日期参数（YYYY-MM-DD，允许带时间部分）
+    
+    Raises:
+        ValueError: 日期格式错误
+    """
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f'日期格式错误: {value}，应为YYYY-MM-DD')
+
+
+def _keyword_condition(db, user_id, keyword: str, params: dict) -> str:
+    """
+    构建关键词筛选条件
+    
+    Args:
+        db: 数据库会话，用于探测视频ID是否存在（为None时不探测）
+        user_id: 用户ID
+        keyword: 关键词
+        params: 参数字典（会写入关键词参数）
+    """
+    params['keyword'] = keyword
+    
+    # 1. 纯数字关键词先按视频ID精确匹配（走item_id索引），命中则不再搜索标题
+    if keyword.isdigit() and db is not None:
+        exists = db.execute(text("""
+            SELECT 1 FROM douplus_order
+            WHERE item_id = :keyword AND user_id = :user_id AND deleted = 0
+            LIMIT 1
+        """), {'keyword': keyword, 'user_id': user_id}).first()
+        if exists:
+            return "o.item_id = :keyword"
+    
+    # 2. 标题全文检索（ngram分词，支持中文），短语匹配与子串搜索语义接近；双引号会破坏短语语法，去掉
+    # 视频ID已探测过（或关键词不是数字），MATCH不能放在OR中，否则MySQL无法使用全文索引
+    phrase = keyword.replace('"', ' ').strip()
+    probed = db is not None or not keyword.isdigit()
+    if settings.ORDER_FULLTEXT_SEARCH and len(phrase) >= NGRAM_TOKEN_SIZE and probed:
+        params['keyword_ft'] = f'"{phrase}"'
+        return "MATCH(o.aweme_title) AGAINST(:keyword_ft IN BOOLEAN MODE)"
+    
+    # 3. 退回LIKE模糊搜索
+    params['keyword_like'] = f'%{keyword}%'
+    return "(o.item_id = :keyword OR o.aweme_title LIKE :keyword_like)"
+
+
+def build_order_filters(user_id, status=None, account_id=None, keyword=None, start_date=None, end_date=None, db=None):
+    """
+    构建订单列表查询条件（需JOIN douyin_account a，过滤已解绑账号）
+    
+    Args:
+        user_id: 用户ID
+        status: 状态筛选
+        account_id: 账号筛选
+        keyword: 视频ID精确匹配或标题模糊搜索
+        start_date: 开始日期（YYYY-MM-DD，包含）
+        end_date: 结束日期（YYYY-MM-DD，包含）
+        db: 数据库会话，传入时纯数字关键词会先探测视频ID
+    
+    Returns:
+        tuple: (WHERE条件列表, 参数字典)
+    
+    Raises:
+        ValueError: 日期格式错误
+    """
+    where_conditions = [
+        "o.user_id = :user_id",
+        "o.deleted = 0",
+        "a.deleted = 0"  # 过滤已解绑的账号
+    ]
+    params = {'user_id': user_id}
+    
+    if status:
+        where_conditions.append("o.status = :status")
+        params['status'] = status
+    
+    if account_id:
+        where_conditions.append("o.account_id = :account_id")
+        params['account_id'] = int(account_id)
+    
+    # 支持视频ID精确匹配或标题关键词搜索
+    if keyword and keyword.strip():
+        where_conditions.append(_keyword_condition(db, user_id, keyword.strip(), params))
+    
+    # 时间范围筛选（半开区间）
+    if start_date:
+        where_conditions.append("o.order_create_time >= :start_time")
+        params['start_time'] = parse_date(start_date)
+    
+    if end_date:
+        where_conditions.append("o.order_create_time < :end_time")
+        params['end_time'] = parse_date(end_date) + timedelta(days=1)
+    
+    return where_conditions, params
@@ -0,0 +1,109 @@
+"""
+分布式令牌桶限流（基于Redis）
+
+所有Worker进程共享同一组令牌桶：
+- 应用级：ratelimit:app，限制整个应用对巨量引擎API的总QPS
+- 账号级：ratelimit:account:{aweme_sec_uid}，限制单个账号的QPS
+
+Redis不可用时放行（fail-open），避免限流组件故障导致同步全部中断
+"""
+import time
+import asyncio
+from typing import List, Tuple
+from loguru import logger
+
+from app.config import get_settings
+from app.utils.redis_client import get_redis
+
+
+settings = get_settings()
+
+# 令牌桶脚本：按Redis服务器时间补充令牌，有令牌则扣减并返回0，否则返回需要等待的秒数
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+_script = None
+
+
+def _try_acquire(key: str, rate: float, capacity: float) -> float:
+    """
+    尝试从令牌桶取一个令牌
+    
+    Returns:
+        float: 0表示已取得令牌，否则为需要等待的秒数
+    """
+    global _script
+    
+    if rate <= 0:
+        return 0.0
+    try:
+        if _script is None:
+            _script = get_redis().register_script(_TOKEN_BUCKET_LUA)
+        return float(_script(keys=[key], args=[rate, capacity]))
+    except Exception as e:
+        logger.warning(f"限流器不可用，本次请求直接放行: key={key}, error={e}")
+        return 0.0
+
+
+def _buckets(account_key: str = None) -> List[Tuple[str, float, float]]:
+    """
+    本次请求需要经过的令牌桶 [(key, rate, capacity)]
+    
+    容量至少为1：QPS小于1时，容量等于速率的桶永远攒不满一个令牌
+    """
+    app_qps = settings.API_RATE_LIMIT_APP_QPS
+    buckets = [("ratelimit:app", app_qps, max(1.0, app_qps))]
+    if account_key:
+        account_qps = settings.API_RATE_LIMIT_ACCOUNT_QPS
+        buckets.append((f"ratelimit:account:{account_key}", account_qps, max(1.0, account_qps)))
+    return buckets
+
+
+def acquire(account_key: str = None):
+    """
+    阻塞等待，直到应用级和账号级令牌桶都放行
+    
+    Args:
+        account_key: 账号标识（aweme_sec_uid），为空时只做应用级限流
+    """
+    for key, rate, capacity in _buckets(account_key):
+        while True:
+            wait = _try_acquire(key, rate, capacity)
+            if wait <= 0:
+                break
+            time.sleep(wait)
+
+
+async def acquire_async(account_key: str = None):
+    """
+    异步等待，直到应用级和账号级令牌桶都放行
+    
+    Redis调用放到线程池执行，Redis变慢或不可用时不会阻塞事件循环上的其他请求
+    
+    Args:
+        account_key: 账号标识（aweme_sec_uid），为空时只做应用级限流
+    """
+    loop = asyncio.get_running_loop()
+    for key, rate, capacity in _buckets(account_key):
+        while True:
+            wait = await loop.run_in_executor(None, _try_acquire, key, rate, capacity)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
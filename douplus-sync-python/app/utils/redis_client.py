@@ -0,0 +1,23 @@
+"""
+Redis连接工具
+"""
+from functools import lru_cache
+import redis
+
+from app.config import get_settings
+
+
+@lru_cache()
+def get_redis() -> redis.Redis:
+    """
+    获取Redis客户端单例（复用Celery使用的Redis实例）
+    
+    redis-py内部自带连接池，可在多线程间共享
+    """
+    settings = get_settings()
+    return redis.Redis.from_url(
+        settings.redis_url,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5
+    )
@@ -0,0 +1,129 @@
+"""
+接口响应缓存（基于Redis）
+
+效果数据每个5分钟窗口才变化一次，统计类接口的结果可以直接缓存：
+- 缓存键包含 全局版本号 + 用户版本号 + 用户 + 路径 + 查询参数
+- 效果数据/订单同步提交后递增用户版本号，视频聚合完成后递增全局版本号，旧缓存自然失效
+- Redis不可用时直接查询数据库（fail-open）
+"""
+import hashlib
+import json
+from functools import wraps
+from flask import request, Response
+from loguru import logger
+
+from app.config import get_settings
+from app.utils.redis_client import get_redis
+
+
+settings = get_settings()
+
+GLOBAL_VERSION_KEY = 'respcache:ver:global'
+USER_VERSION_KEY = 'respcache:ver:user:{user_id}'
+CACHE_KEY = 'respcache:{global_ver}:{user_ver}:{user_id}:{path}:{args}'
+VALUE_KEY = 'respcache:value:{global_ver}:{user_ver}:{user_id}:{name}:{args}'
+
+
+def bump_user_version(user_id: int):
+    """使指定用户的响应缓存失效"""
+    try:
+        get_redis().incr(USER_VERSION_KEY.format(user_id=user_id))
+    except Exception as e:
+        logger.warning(f"递增响应缓存版本失败: user_id={user_id}, error={e}")
+
+
+def bump_global_version():
+    """使所有用户的响应缓存失效"""
+    try:
+        get_redis().incr(GLOBAL_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"递增响应缓存全局版本失败: {e}")
+
+
+def cached_value(user_id: int, name: str, params: dict, loader, ttl: int = None):
+    """
+    缓存单个计算结果（如分页总数），与响应缓存共用版本号
+    
+    Args:
+        user_id: 用户ID
+        name: 结果名称
+        params: 影响结果的参数
+        loader: 未命中时调用的计算函数，返回值需可JSON序列化
+        ttl: 缓存时间（秒），默认RESPONSE_CACHE_TTL
+    """
+    try:
+        r = get_redis()
+        global_ver, user_ver = r.mget(GLOBAL_VERSION_KEY, USER_VERSION_KEY.format(user_id=user_id))
+        key = VALUE_KEY.format(
+            global_ver=global_ver or 0,
+            user_ver=user_ver or 0,
+            user_id=user_id,
+            name=name,
+            args=hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        )
+        cached = r.get(key)
+        if cached is not None:
+            return json.loads(cached)
+    except Exception as e:
+        logger.warning(f"读取缓存失败: name={name}, error={e}")
+        return loader()
+    
+    value = loader()
+    try:
+        r.set(key, json.dumps(value), ex=ttl or settings.RESPONSE_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"写入缓存失败: name={name}, error={e}")
+    return value
+
+
+def _cache_key(r, user_id) -> str:
+    """按当前版本号和请求参数生成缓存键"""
+    global_ver, user_ver = r.mget(GLOBAL_VERSION_KEY, USER_VERSION_KEY.format(user_id=user_id))
+    args = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    return CACHE_KEY.format(
+        global_ver=global_ver or 0,
+        user_ver=user_ver or 0,
+        user_id=user_id,
+        path=request.path,
+        args=hashlib.md5(args.encode('utf-8')).hexdigest()
+    )
+
+
+def cached_response(ttl: int = None):
+    """
+    响应缓存装饰器，需放在require_auth之后（依赖request.user_id）
+    
+    只缓存成功的JSON响应
+    
+    Args:
+        ttl: 缓存时间（秒），默认RESPONSE_CACHE_TTL
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                r = get_redis()
+                key = _cache_key(r, request.user_id)
+                body = r.get(key)
+            except Exception as e:
+                logger.warning(f"读取响应缓存失败: {e}")
+                return f(*args, **kwargs)
+            
+            if body is not None:
+                response = Response(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            
+            response = f(*args, **kwargs)
+            # error_response返回 (response, code) 元组，不缓存
+            if isinstance(response, Response) and response.status_code == 200:
+                try:
+                    r.set(key, response.get_data(as_text=True), ex=ttl or settings.RESPONSE_CACHE_TTL)
+                except Exception as e:
+                    logger.warning(f"写入响应缓存失败: {e}")
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        
+        return decorated_function
+    
+    return decorator
@@ -0,0 +1,45 @@
+"""
+同步游标工具（增量同步/增量聚合的高水位）
+"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.dialects.mysql import insert
+
+from app.models import SyncCursor
+
+
+def get_cursor(db, cursor_key: str) -> Optional[SyncCursor]:
+    """
+    读取游标
+    
+    Args:
+        db: 数据库会话
+        cursor_key: 游标键
+    
+    Returns:
+        游标记录，不存在时返回None
+    """
+    return db.query(SyncCursor).filter(SyncCursor.cursor_key == cursor_key).first()
+
+
+def save_cursor(db, cursor_key: str, cursor_time: datetime = None, cursor_value: str = None):
+    """
+    写入游标（不存在则插入，存在则更新），由调用者负责提交
+    
+    Args:
+        db: 数据库会话
+        cursor_key: 游标键
+        cursor_time: 时间高水位
+        cursor_value: 辅助值
+    """
+    stmt = insert(SyncCursor).values(
+        cursor_key=cursor_key,
+        cursor_time=cursor_time,
+        cursor_value=cursor_value
+    )
+    stmt = stmt.on_duplicate_key_update(
+        cursor_time=stmt.inserted.cursor_time,
+        cursor_value=stmt.inserted.cursor_value,
+        update_time=datetime.now()
+    )
+    db.execute(stmt)
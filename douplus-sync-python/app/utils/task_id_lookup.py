@@ -0,0 +1,195 @@
+"""
+订单task_id查询工具
+
+续费API需要task_id（DOU+后台订单号），订单同步时已写入douplus_order.task_id。
+只有task_id缺失时才回退到订单列表API查找：
+- 按下单时间倒序翻页，翻过目标订单的下单时间即停止，最多TASK_ID_LOOKUP_MAX_PAGES页
+- 翻页中遇到的所有缺失task_id的订单一并写回数据库
+- 查到的结果缓存在Redis中，查不到的短时间内不再重复查找
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from loguru import logger
+
+from app.config import get_settings
+from app.douyin_client import DouyinClient
+from app.utils.redis_client import get_redis
+
+
+settings = get_settings()
+
+TASK_ID_CACHE_KEY = 'douplus:task_id:{order_id}'
+TASK_ID_CACHE_TTL = 7 * 24 * 3600
+TASK_ID_MISS_KEY = 'douplus:task_id:miss:{order_id}'
+TASK_ID_MISS_TTL = 300
+# 补全任务已尝试过的订单：超出翻页上限等原因查不到的订单，在此期间不再被补全任务选中（远大于任务间隔）
+TASK_ID_BACKFILL_TRIED_KEY = 'douplus:task_id:backfill_tried:{order_id}'
+TASK_ID_BACKFILL_RETRY_TTL = 7 * 24 * 3600
+
+LOOKUP_PAGE_SIZE = 100
+
+
+def _parse_time(time_str: str) -> Optional[datetime]:
+    """解析API返回的时间字符串"""
+    try:
+        return datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def save_task_ids(db, task_ids: Dict[str, str]):
+    """
+    写回task_id（只补全缺失的值），由调用者负责提交
+    
+    Args:
+        db: 数据库会话
+        task_ids: {order_id: task_id}
+    """
+    if not task_ids:
+        return
+    
+    db.execute(text("""
+        UPDATE douplus_order SET task_id = :task_id
+        WHERE order_id = :order_id AND task_id IS NULL
+    """), [{'order_id': order_id, 'task_id': task_id} for order_id, task_id in task_ids.items()])
+    
+    try:
+        pipe = get_redis().pipeline()
+        for order_id, task_id in task_ids.items():
+            pipe.set(TASK_ID_CACHE_KEY.format(order_id=order_id), task_id, ex=TASK_ID_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"缓存task_id失败: {e}")
+
+
+def fetch_task_ids(client: DouyinClient, aweme_sec_uid: str, targets: Dict[str, Optional[datetime]]) -> Dict[str, str]:
+    """
+    从订单列表API查找task_id
+    
+    Args:
+        client: 抖音API客户端
+        aweme_sec_uid: 抖音号ID
+        targets: {order_id: order_create_time}，下单时间未知时为None（不提前停止翻页）
+    
+    Returns:
+        dict: 翻页中遇到的所有订单 {order_id: task_id}
+    """
+    remaining = set(targets)
+    known_times = [t for t in targets.values() if t]
+    stop_before = min(known_times) if len(known_times) == len(targets) else None
+    
+    found = {}
+    for page in range(1, settings.TASK_ID_LOOKUP_MAX_PAGES + 1):
+        orders = client.get_order_list(aweme_sec_uid=aweme_sec_uid, page=page, page_size=LOOKUP_PAGE_SIZE)
+        
+        page_times = []
+        for order_data in orders:
+            order_info = order_data.get("order", {})
+            order_id = str(order_info.get("order_id"))
+            if order_info.get("task_id"):
+                found[order_id] = str(order_info.get("task_id"))
+                remaining.discard(order_id)
+            create_time = _parse_time(order_info.get("order_create_time"))
+            if create_time:
+                page_times.append(create_time)
+        
+        if not remaining or len(orders) < LOOKUP_PAGE_SIZE:
+            break
+        # 订单列表按下单时间倒序，已翻过最早的目标订单
+        if stop_before and page_times and min(page_times) < stop_before:
+            break
+    
+    return found
+
+
+def filter_backfill_untried(order_ids: List[str]) -> List[str]:
+    """
+    过滤掉补全任务近期已尝试过的订单
+    
+    Redis不可用时不过滤
+    """
+    if not order_ids:
+        return []
+    try:
+        tried = get_redis().mget([TASK_ID_BACKFILL_TRIED_KEY.format(order_id=order_id) for order_id in order_ids])
+    except Exception as e:
+        logger.warning(f"读取task_id补全记录失败: {e}")
+        return list(order_ids)
+    return [order_id for order_id, mark in zip(order_ids, tried) if not mark]
+
+
+def mark_backfill_tried(order_ids):
+    """记录补全任务已尝试过的订单，TASK_ID_BACKFILL_RETRY_TTL内不再尝试"""
+    if not order_ids:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        for order_id in order_ids:
+            pipe.set(TASK_ID_BACKFILL_TRIED_KEY.format(order_id=order_id), 1, ex=TASK_ID_BACKFILL_RETRY_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"记录task_id补全尝试失败: {e}")
+
+
+def resolve_task_ids(db, access_token: str, aweme_sec_uid: str, targets: Dict[str, Optional[datetime]]) -> Dict[str, str]:
+    """
+    为缺失task_id的订单查找task_id（先查缓存，再查订单列表API并写回数据库）
+    
+    Args:
+        db: 数据库会话（会提交写回结果）
+        access_token: 访问令牌（已解密）
+        aweme_sec_uid: 抖音号ID
+        targets: 同一账号下的订单 {order_id: order_create_time}
+    
+    Returns:
+        dict: 查到的 {order_id: task_id}
+    """
+    result = {}
+    pending = dict(targets)
+    
+    try:
+        r = get_redis()
+        order_ids = list(pending)
+        cached = r.mget([TASK_ID_CACHE_KEY.format(order_id=order_id) for order_id in order_ids])
+        missed = r.mget([TASK_ID_MISS_KEY.format(order_id=order_id) for order_id in order_ids])
+        for order_id, task_id, miss in zip(order_ids, cached, missed):
+            if task_id:
+                result[order_id] = task_id
+                pending.pop(order_id)
+            elif miss:
+                pending.pop(order_id)
+    except Exception as e:
+        r = None
+        logger.warning(f"读取task_id缓存失败: {e}")
+    
+    if not pending:
+        return result
+    
+    client = DouyinClient(access_token)
+    try:
+        found = fetch_task_ids(client, aweme_sec_uid, pending)
+    finally:
+        client.close()
+    
+    save_task_ids(db, found)
+    db.commit()
+    
+    misses = []
+    for order_id in pending:
+        if order_id in found:
+            result[order_id] = found[order_id]
+        else:
+            misses.append(order_id)
+    
+    if misses and r is not None:
+        try:
+            pipe = r.pipeline()
+            for order_id in misses:
+                pipe.set(TASK_ID_MISS_KEY.format(order_id=order_id), 1, ex=TASK_ID_MISS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"缓存task_id查找结果失败: {e}")
+    
+    logger.info(f"订单列表API查找task_id: 目标{len(pending)}个, 查到{len(set(pending) & set(found))}个, 顺带补全{len(found)}个")
+    return result
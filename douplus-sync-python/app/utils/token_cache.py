@@ -0,0 +1,186 @@
+"""
+账号凭证进程内缓存
+
+同步、续费等热路径每次都要读取账号的access_token并解密，改为按account_id缓存在进程内：
+- 缓存解密后的token及调用API所需的账号字段，TOKEN_CACHE_TTL秒后重新读库
+- Token刷新后递增Redis中的账号版本号，并通过pub/sub广播失效，各进程后台线程收到后立即淘汰
+- 订阅未就绪或中断期间，读取时比对版本号兜底；订阅恢复前清空本地缓存，避免漏掉失效消息
+- Java端直接写库不会广播，依靠TTL兜底
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+from sqlalchemy import text
+from loguru import logger
+
+from app.config import get_settings
+from app.models import get_db
+from app.utils.crypto import decrypt_access_token_cached
+from app.utils.redis_client import get_redis
+
+
+settings = get_settings()
+
+TOKEN_VERSION_KEY = 'token:ver:{account_id}'
+TOKEN_INVALIDATE_CHANNEL = 'token:invalidate'
+
+# 订阅断开后的重连间隔（秒）
+RESUBSCRIBE_DELAY = 5
+
+
+class AccountCredentials:
+    """账号凭证（access_token已解密）"""
+    
+    __slots__ = ('id', 'user_id', 'access_token', 'aweme_sec_uid', 'advertiser_id', 'version', 'expire_at')
+    
+    def __init__(self, id, user_id, access_token, aweme_sec_uid, advertiser_id, version, expire_at):
+        self.id = id
+        self.user_id = user_id
+        self.access_token = access_token
+        self.aweme_sec_uid = aweme_sec_uid
+        self.advertiser_id = advertiser_id
+        self.version = version
+        self.expire_at = expire_at
+
+
+_cache: Dict[int, AccountCredentials] = {}
+_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+_listener_ready = False
+# 本进程收到的失效次数：读库期间收到失效消息时，读到的可能是旧token，不写入缓存
+_invalidations = 0
+
+
+def _evict(account_id: int):
+    """淘汰本进程缓存"""
+    global _invalidations
+    _invalidations += 1
+    _cache.pop(account_id, None)
+
+
+def _current_version(account_id: int) -> Optional[str]:
+    """读取账号凭证版本号，Redis不可用时返回None"""
+    try:
+        return get_redis().get(TOKEN_VERSION_KEY.format(account_id=account_id)) or '0'
+    except Exception as e:
+        logger.warning(f"读取token版本号失败: account_id={account_id}, error={e}")
+        return None
+
+
+def _listen_invalidations():
+    """订阅失效广播（后台线程）"""
+    global _listener_ready
+    
+    while True:
+        pubsub = None
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(TOKEN_INVALIDATE_CHANNEL)
+            # 订阅建立前可能漏掉了失效消息，清空后重新读库
+            _cache.clear()
+            _listener_ready = True
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message and message.get('type') == 'message':
+                    _evict(int(message['data']))
+        except Exception as e:
+            _listener_ready = False
+            logger.warning(f"token失效订阅中断，{RESUBSCRIBE_DELAY}秒后重连: {e}")
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+        time.sleep(RESUBSCRIBE_DELAY)
+
+
+def _ensure_listener():
+    """启动本进程的失效订阅线程（fork后的子进程重新启动）"""
+    global _listener_pid, _listener_ready
+    
+    if _listener_pid == os.getpid():
+        return
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        _listener_ready = False
+        _cache.clear()
+        threading.Thread(
+            target=_listen_invalidations,
+            name="token-cache-invalidate",
+            daemon=True
+        ).start()
+
+
+def get_account_credentials(account_id: int, db=None) -> Optional[AccountCredentials]:
+    """
+    获取账号凭证（优先使用进程内缓存）
+    
+    Args:
+        account_id: 账号ID
+        db: 数据库会话（可选，未命中缓存时用于读库）
+    
+    Returns:
+        账号凭证，账号不存在时返回None
+    
+    Raises:
+        ValueError: token解密失败
+    """
+    _ensure_listener()
+    
+    entry = _cache.get(account_id)
+    if entry and entry.expire_at > time.monotonic():
+        if _listener_ready or (entry.version is not None and entry.version == _current_version(account_id)):
+            return entry
+    
+    # 先取版本号再读库：读库期间发生刷新时，版本号落后，下次读取会重新加载
+    version = _current_version(account_id)
+    invalidations = _invalidations
+    
+    own_session = db is None
+    if own_session:
+        db = get_db()
+    try:
+        row = db.execute(text("""
+            SELECT id, user_id, access_token, aweme_sec_uid, advertiser_id
+            FROM douyin_account
+            WHERE id = :account_id
+        """), {'account_id': account_id}).fetchone()
+    finally:
+        if own_session:
+            db.close()
+    
+    if not row:
+        _cache.pop(account_id, None)
+        return None
+    
+    credentials = AccountCredentials(
+        id=row[0],
+        user_id=row[1],
+        access_token=decrypt_access_token_cached(row[2]),
+        aweme_sec_uid=row[3],
+        advertiser_id=row[4],
+        version=version,
+        expire_at=time.monotonic() + settings.TOKEN_CACHE_TTL
+    )
+    if invalidations == _invalidations:
+        _cache[account_id] = credentials
+    return credentials
+
+
+def invalidate_account_credentials(account_id: int):
+    """
+    使账号凭证缓存失效（写入新token并提交后调用）
+    
+    递增版本号并广播，所有进程的缓存都会淘汰该账号
+    """
+    _evict(account_id)
+    try:
+        r = get_redis()
+        r.incr(TOKEN_VERSION_KEY.format(account_id=account_id))
+        r.publish(TOKEN_INVALIDATE_CHANNEL, account_id)
+    except Exception as e:
+        logger.warning(f"广播token失效失败: account_id={account_id}, error={e}")
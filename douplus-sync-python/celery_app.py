@@ -53,22 +53,40 @@ app.conf.beat_schedule = {
         'schedule': crontab(minute='*/5'),
     },
     
+    # 每天凌晨全量同步订单(兜底：增量同步遗漏的订单状态变化)
+    'sync-orders-full': {
+        'task': 'app.tasks.order_sync.sync_all_accounts_full',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    
     # 每5分钟同步效果数据(延迟1分钟,确保订单已同步)
     'sync-stats': {
         'task': 'app.tasks.stats_sync.sync_all_accounts_stats',
         'schedule': crontab(minute='1-59/5'),  # 1,6,11,16...
     },
     
-    # 每5分钟聚合视频数据(延迟2分钟,确保效果数据已同步)
+    # 每5分钟兜底聚合脏视频(延迟2分钟;正常由效果数据同步后的防抖任务触发)
     'aggregate-video': {
         'task': 'app.tasks.video_agg.aggregate_current_window',
         'schedule': crontab(minute='2-59/5'),  # 2,7,12,17...
     },
     
-    # 每天凌晨2点自动刷新即将过期的Token
+    # 每小时补全缺失task_id的历史订单
+    'backfill-order-task-ids': {
+        'task': 'app.tasks.order_sync.backfill_missing_task_ids',
+        'schedule': crontab(minute=40),
+    },
+    
+    # 每小时清理过期的导出文件
+    'cleanup-expired-exports': {
+        'task': 'app.tasks.export_job.cleanup_expired_exports',
+        'schedule': crontab(minute=30),
+    },
+    
+    # 每30分钟扫描即将过期的Token(临近过期的立即刷新,稍后过期的按过期时间投递延时刷新)
     'refresh-expiring-tokens': {
         'task': 'app.tasks.token_refresh.refresh_expiring_tokens',
-        'schedule': crontab(hour=2, minute=0),
+        'schedule': crontab(minute='*/30'),
     },
 }
 
@@ -79,7 +97,8 @@ app.autodiscover_tasks(['app.tasks'])
 from app.tasks.order_sync import (
     sync_all_accounts_incremental,
     sync_all_accounts_full,
-    sync_single_account
+    sync_single_account,
+    backfill_missing_task_ids
 )
 from app.tasks.stats_sync import (
     sync_all_accounts_stats,
@@ -88,21 +107,30 @@ from app.tasks.stats_sync import (
 from app.tasks.video_agg import (
     aggregate_current_window,
     aggregate_all_recent,
-    rebuild_video_agg_table
+    rebuild_video_agg_table,
+    rebuild_video_rollups
 )
 from app.tasks.token_refresh import (
     refresh_expiring_tokens,
     refresh_single_account_token
 )
+from app.tasks.export_job import (
+    export_orders,
+    cleanup_expired_exports
+)
 
 # 将函数注册为Celery任务
 app.task(name='app.tasks.order_sync.sync_all_accounts_incremental')(sync_all_accounts_incremental)
 app.task(name='app.tasks.order_sync.sync_all_accounts_full')(sync_all_accounts_full)
 app.task(name='app.tasks.order_sync.sync_single_account')(sync_single_account)
+app.task(name='app.tasks.order_sync.backfill_missing_task_ids')(backfill_missing_task_ids)
 app.task(name='app.tasks.stats_sync.sync_all_accounts_stats')(sync_all_accounts_stats)
 app.task(name='app.tasks.stats_sync.sync_single_account_stats')(sync_single_account_stats)
 app.task(name='app.tasks.video_agg.aggregate_current_window')(aggregate_current_window)
 app.task(name='app.tasks.video_agg.aggregate_all_recent')(aggregate_all_recent)
 app.task(name='app.tasks.video_agg.rebuild_video_agg_table')(rebuild_video_agg_table)
+app.task(name='app.tasks.video_agg.rebuild_video_rollups')(rebuild_video_rollups)
 app.task(name='app.tasks.token_refresh.refresh_expiring_tokens')(refresh_expiring_tokens)
 app.task(name='app.tasks.token_refresh.refresh_single_account_token')(refresh_single_account_token)
+app.task(name='app.tasks.export_job.export_orders')(export_orders)
+app.task(name='app.tasks.export_job.cleanup_expired_exports')(cleanup_expired_exports)
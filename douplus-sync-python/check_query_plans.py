@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+检查订单列表相关查询的执行计划
+
+对订单列表/导出/统计卡片的典型查询执行EXPLAIN，确认douplus_order走联合索引而不是全表扫描，
+标题搜索走ngram全文索引（type=fulltext）
+用法：python3 check_query_plans.py [user_id]
+"""
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app.models import SessionLocal
+from app.utils.order_filters import build_order_filters
+
+db = SessionLocal()
+
+try:
+    if len(sys.argv) > 1:
+        user_id = int(sys.argv[1])
+    else:
+        user_id = db.execute(text("SELECT user_id FROM douplus_order LIMIT 1")).scalar() or 1
+    account_id = db.execute(text(
+        "SELECT account_id FROM douplus_order WHERE user_id = :user_id LIMIT 1"
+    ), {'user_id': user_id}).scalar() or 1
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+    
+    def order_list_sql(order_by, **filters):
+        where_conditions, params = build_order_filters(user_id, db=db, **filters)
+        sql = f"""
+            SELECT o.id
+            FROM douplus_order o
+            INNER JOIN douyin_account a ON o.account_id = a.id
+            WHERE {' AND '.join(where_conditions)}
+            ORDER BY {order_by}
+            LIMIT 20
+        """
+        return sql, params
+    
+    cases = [
+        ("订单列表-默认排序", *order_list_sql("o.create_time DESC, o.id DESC")),
+        ("订单列表-日期范围", *order_list_sql(
+            "o.create_time DESC, o.id DESC", start_date=week_ago, end_date=today
+        )),
+        ("订单列表-账号+状态", *order_list_sql(
+            "o.create_time DESC, o.id DESC", account_id=account_id, status='DELIVERING'
+        )),
+        ("订单列表-标题搜索", *order_list_sql(
+            "o.create_time DESC, o.id DESC", keyword='视频'
+        )),
+        ("订单列表-游标翻页", """
+            SELECT o.id
+            FROM douplus_order o
+            INNER JOIN douyin_account a ON o.account_id = a.id
+            WHERE o.user_id = :user_id AND o.deleted = 0 AND a.deleted = 0
+              AND (o.create_time, o.id) < (:cursor_value, :cursor_id)
+            ORDER BY o.create_time DESC, o.id DESC
+            LIMIT 21
+        """, {'user_id': user_id, 'cursor_value': datetime.now() - timedelta(days=7), 'cursor_id': 2 ** 62}),
+        ("统计卡片-近7天", """
+            SELECT COUNT(*)
+            FROM douplus_order o
+            LEFT JOIN douplus_order_agg s ON o.order_id = s.order_id
+            WHERE o.user_id = :user_id AND o.deleted = 0 AND o.order_create_time >= :start_time
+        """, {'user_id': user_id, 'start_time': datetime.now() - timedelta(days=7)}),
+        ("账号统计卡片-近7天", """
+            SELECT COUNT(*)
+            FROM douplus_order o
+            LEFT JOIN douplus_order_agg s ON o.order_id = s.order_id
+            WHERE o.account_id = :account_id AND o.user_id = :user_id
+              AND o.deleted = 0 AND o.order_create_time >= :start_time
+        """, {'account_id': account_id, 'user_id': user_id, 'start_time': datetime.now() - timedelta(days=7)}),
+    ]
+    
+    # 需要特定访问类型的查询
+    expected_types = {"订单列表-标题搜索": 'fulltext'}
+    
+    problems = 0
+    for name, sql, params in cases:
+        print(f"\n>>> {name}")
+        rows = db.execute(text("EXPLAIN " + sql), params).mappings().fetchall()
+        for row in rows:
+            print(f"  table={row['table']}, type={row['type']}, key={row['key']}, "
+                  f"rows={row['rows']}, Extra={row['Extra']}")
+            if row['table'] == 'o' and (row['type'] == 'ALL' or not row['key']):
+                print(f"  ✗ douplus_order未使用索引")
+                problems += 1
+            elif row['table'] == 'o' and name in expected_types and row['type'] != expected_types[name]:
+                print(f"  ✗ douplus_order未使用{expected_types[name]}访问（实际type={row['type']}）")
+                problems += 1
+    
+    print()
+    if problems:
+        print(f"⚠️  {problems}个查询未走索引，请确认已执行 migrations/add_order_composite_indexes.sql、add_order_title_fulltext.sql")
+        sys.exit(1)
+    print("✅ 所有查询均使用索引")
+
+finally:
+    db.close()
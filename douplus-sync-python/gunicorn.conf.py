@@ -0,0 +1,57 @@
+"""
+gunicorn配置（生产环境API服务）
+
+启动：gunicorn -c gunicorn.conf.py wsgi:app
+- 多进程 × 多线程（gthread），吞吐随CPU核数扩展
+- preload_app：主进程加载一次应用，fork后各Worker重建自己的数据库连接池并预热
+"""
+import multiprocessing
+import os
+
+from app.config import get_settings
+
+settings = get_settings()
+
+os.makedirs('logs', exist_ok=True)
+
+bind = settings.API_BIND
+workers = settings.API_WORKERS or multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gthread'
+threads = settings.API_THREADS
+timeout = settings.API_TIMEOUT
+graceful_timeout = 30
+keepalive = 5
+
+# 定期重启Worker，防止内存缓慢增长
+max_requests = 10000
+max_requests_jitter = 1000
+
+preload_app = True
+
+accesslog = 'logs/api_access.log'
+errorlog = 'logs/gunicorn.log'
+loglevel = settings.LOG_LEVEL.lower()
+
+
+def on_starting(server):
+    pool_capacity = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    if threads > pool_capacity:
+        server.log.warning(
+            f"API_THREADS({threads}) 大于数据库连接池容量({pool_capacity})，高并发时请求会等待连接"
+        )
+    server.log.info(
+        f"API服务启动: workers={workers}, threads={threads}, "
+        f"最大数据库连接数={workers * pool_capacity}"
+    )
+
+
+def post_fork(server, worker):
+    """fork后丢弃从主进程继承的连接（不关闭，避免影响主进程），并预热本进程连接池"""
+    from app.models import engine, warm_up_pool
+    
+    engine.dispose(close=False)
+    try:
+        count = warm_up_pool(threads)
+        server.log.info(f"Worker {worker.pid} 数据库连接池预热完成: {count}个连接")
+    except Exception as e:
+        server.log.warning(f"Worker {worker.pid} 数据库连接池预热失败: {e}")
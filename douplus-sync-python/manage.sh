@@ -33,11 +33,18 @@ case "$1" in
             source load_env.sh
             echo "✓ 环境变量已加载"
         fi
-        nohup python3 api_server.py > logs/api.log 2>&1 &
-        echo $! > logs/api.pid
+        gunicorn -c gunicorn.conf.py wsgi:app --daemon --pid logs/api.pid
         echo "API服务已启动"
         ;;
     
+    api-dev)
+        echo "启动API服务（Flask开发服务器，仅用于本地调试）..."
+        if [ -f load_env.sh ]; then
+            source load_env.sh
+        fi
+        python3 api_server.py
+        ;;
+    
     start)
         echo "启动完整服务..."
         # 加载环境变量
@@ -50,8 +57,7 @@ case "$1" in
         # 启动Beat
         celery -A celery_app beat --loglevel=info --logfile=logs/beat.log --pidfile=logs/beat.pid --detach
         # 启动API服务
-        nohup python3 api_server.py > logs/api.log 2>&1 &
-        echo $! > logs/api.pid
+        gunicorn -c gunicorn.conf.py wsgi:app --daemon --pid logs/api.pid
         echo "所有服务已启动"
         ;;
     
@@ -62,6 +68,7 @@ case "$1" in
             kill $(cat logs/api.pid) 2>/dev/null
             rm logs/api.pid
         fi
+        pkill -f "gunicorn.*wsgi:app"
         pkill -f "python3 api_server.py"
         echo "所有服务已停止"
         ;;
@@ -78,7 +85,7 @@ case "$1" in
         ps aux | grep "celery.*celery_app" | grep -v grep
         echo ""
         echo "=== API Server ==="
-        ps aux | grep "python3 api_server.py" | grep -v grep
+        ps aux | grep -E "gunicorn.*wsgi:app|python3 api_server.py" | grep -v grep
         ;;
     
     logs)
@@ -87,7 +94,7 @@ case "$1" in
         ;;
     
     *)
-        echo "Usage: $0 {install|start|stop|restart|api|worker|beat|status|logs}"
+        echo "Usage: $0 {install|start|stop|restart|api|api-dev|worker|beat|status|logs}"
         exit 1
         ;;
 esac
@@ -0,0 +1,12 @@
+-- 为douplus_order添加与实际查询路径匹配的联合索引
+-- 订单列表/导出/统计卡片：WHERE user_id = ? AND deleted = 0 AND order_create_time >= ? AND order_create_time < ?
+--   （时间筛选已改为半开区间，不再使用 DATE(order_create_time)，可以走索引范围扫描）
+-- 订单列表默认排序：WHERE user_id = ? AND deleted = 0 ORDER BY create_time DESC
+-- 账号维度统计/增量同步边界：WHERE account_id = ? AND status ...
+-- 上线后执行 python3 check_query_plans.py 确认执行计划
+
+ALTER TABLE `douplus_order`
+ADD INDEX `idx_user_deleted_order_create` (`user_id`, `deleted`, `order_create_time`),
+ADD INDEX `idx_user_deleted_create` (`user_id`, `deleted`, `create_time`),
+ADD INDEX `idx_account_status` (`account_id`, `status`),
+ADD INDEX `idx_account_deleted_order_create` (`account_id`, `deleted`, `order_create_time`);
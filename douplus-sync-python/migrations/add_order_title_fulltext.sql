@@ -0,0 +1,8 @@
+-- 为douplus_order.aweme_title添加ngram全文索引
+-- 订单列表/导出的关键词搜索原来使用 LIKE '%关键词%'，需要扫描该用户的全部订单
+-- ngram分词支持中文，查询使用 MATCH(aweme_title) AGAINST('"关键词"' IN BOOLEAN MODE) 短语匹配
+-- 要求 MySQL 5.7.6+；ngram_token_size 使用默认值2，单字关键词自动退回LIKE
+-- 未执行本脚本前请在.env中设置 ORDER_FULLTEXT_SEARCH=false
+
+ALTER TABLE `douplus_order`
+ADD FULLTEXT INDEX `ft_aweme_title` (`aweme_title`) WITH PARSER ngram;
@@ -0,0 +1,14 @@
+-- 添加效果数据冻结字段到douplus_order表
+-- 未结束的订单每个窗口都拉取效果数据；订单进入终态后再拉取若干次（STATS_SETTLE_POLLS）即冻结，
+-- 冻结后不再占用效果报告API配额和数据库写入
+
+ALTER TABLE `douplus_order`
+ADD COLUMN `stats_final_polls` INT NOT NULL DEFAULT 0 COMMENT '进入终态后已拉取效果数据的次数' AFTER `sync_source`,
+ADD COLUMN `stats_frozen` TINYINT NOT NULL DEFAULT 0 COMMENT '1=效果数据已稳定，不再拉取' AFTER `stats_final_polls`,
+ADD INDEX `idx_account_stats_frozen` (`account_id`, `stats_frozen`);
+
+-- 历史订单：结束超过7天的直接冻结，避免上线后集中补拉
+UPDATE `douplus_order`
+SET `stats_frozen` = 1
+WHERE `status` IN ('DELIVERIED', 'UNDELIVERIED', 'AUDIT_REJECTED')
+  AND `order_create_time` < DATE_SUB(NOW(), INTERVAL 7 DAY);
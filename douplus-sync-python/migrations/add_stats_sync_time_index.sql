@@ -0,0 +1,6 @@
+-- 为douplus_order_stats.sync_time添加索引
+-- 订单预聚合改为增量执行：按sync_time高水位（douplus_sync_cursor.cursor_key='order_agg'）
+-- 只查找上次聚合之后有效果数据写入的订单，避免每次全表GROUP BY
+
+ALTER TABLE `douplus_order_stats`
+ADD INDEX `idx_sync_time` (`sync_time`);
@@ -0,0 +1,85 @@
+-- 创建视频维度汇总表
+-- douplus_video_stats_agg 每个视频每5分钟一行（累计值快照），跨窗口SUM既慢又会重复累计
+-- 1. douplus_video_stats_hourly / douplus_video_stats_daily：每小时/每天最后一个窗口的快照，用于趋势图
+-- 2. douplus_video_stats_latest：按订单最新累计值（douplus_order_agg）汇总，用于视频排行和列表
+-- 三张表由视频聚合任务（app/tasks/video_agg.py）随5分钟窗口一起维护
+-- 建表后执行一次 rebuild_video_rollups 初始化历史数据
+
+CREATE TABLE IF NOT EXISTS `douplus_video_stats_hourly` (
+  `id` bigint NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `item_id` varchar(64) NOT NULL COMMENT '视频ID',
+  `account_id` bigint NOT NULL COMMENT '账号ID',
+  `user_id` bigint NOT NULL COMMENT '用户ID',
+  `bucket_time` datetime NOT NULL COMMENT '整点时间',
+  `snapshot_time` datetime NOT NULL COMMENT '该时段内最后一个5分钟窗口',
+  `order_count` int NOT NULL DEFAULT '0' COMMENT '订单数',
+  `total_budget` decimal(10,2) DEFAULT '0.00' COMMENT '总预算(元)',
+  `total_cost` decimal(10,2) DEFAULT '0.00' COMMENT '总消耗(元)',
+  `total_play` bigint DEFAULT '0' COMMENT '总播放量',
+  `total_like` bigint DEFAULT '0' COMMENT '总点赞数',
+  `total_comment` bigint DEFAULT '0' COMMENT '总评论数',
+  `total_share` bigint DEFAULT '0' COMMENT '总转发数',
+  `total_follow` bigint DEFAULT '0' COMMENT '总关注数',
+  `total_convert` bigint DEFAULT '0' COMMENT '总转化数',
+  `play_per_100_cost` decimal(10,2) DEFAULT NULL COMMENT '百播放量 = 播放量/消耗*100',
+  `share_per_100_play` decimal(10,2) DEFAULT NULL COMMENT '百转发率 = 转发/播放*100',
+  `avg_convert_cost` decimal(10,2) DEFAULT NULL COMMENT '转化成本 = 消耗/转化数(元)',
+  `update_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_item_account_bucket` (`item_id`, `account_id`, `bucket_time`),
+  KEY `idx_user_bucket` (`user_id`, `bucket_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='视频维度效果数据小时汇总表';
+
+CREATE TABLE IF NOT EXISTS `douplus_video_stats_daily` (
+  `id` bigint NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `item_id` varchar(64) NOT NULL COMMENT '视频ID',
+  `account_id` bigint NOT NULL COMMENT '账号ID',
+  `user_id` bigint NOT NULL COMMENT '用户ID',
+  `bucket_time` datetime NOT NULL COMMENT '当天零点',
+  `snapshot_time` datetime NOT NULL COMMENT '该时段内最后一个5分钟窗口',
+  `order_count` int NOT NULL DEFAULT '0' COMMENT '订单数',
+  `total_budget` decimal(10,2) DEFAULT '0.00' COMMENT '总预算(元)',
+  `total_cost` decimal(10,2) DEFAULT '0.00' COMMENT '总消耗(元)',
+  `total_play` bigint DEFAULT '0' COMMENT '总播放量',
+  `total_like` bigint DEFAULT '0' COMMENT '总点赞数',
+  `total_comment` bigint DEFAULT '0' COMMENT '总评论数',
+  `total_share` bigint DEFAULT '0' COMMENT '总转发数',
+  `total_follow` bigint DEFAULT '0' COMMENT '总关注数',
+  `total_convert` bigint DEFAULT '0' COMMENT '总转化数',
+  `play_per_100_cost` decimal(10,2) DEFAULT NULL COMMENT '百播放量 = 播放量/消耗*100',
+  `share_per_100_play` decimal(10,2) DEFAULT NULL COMMENT '百转发率 = 转发/播放*100',
+  `avg_convert_cost` decimal(10,2) DEFAULT NULL COMMENT '转化成本 = 消耗/转化数(元)',
+  `update_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_item_account_bucket` (`item_id`, `account_id`, `bucket_time`),
+  KEY `idx_user_bucket` (`user_id`, `bucket_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='视频维度效果数据日汇总表';
+
+CREATE TABLE IF NOT EXISTS `douplus_video_stats_latest` (
+  `id` bigint NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `item_id` varchar(64) NOT NULL COMMENT '视频ID',
+  `account_id` bigint NOT NULL COMMENT '账号ID',
+  `user_id` bigint NOT NULL COMMENT '用户ID',
+  `title` varchar(500) DEFAULT NULL COMMENT '视频标题',
+  `cover` varchar(500) DEFAULT NULL COMMENT '视频封面',
+  `order_count` int NOT NULL DEFAULT '0' COMMENT '订单数',
+  `total_budget` decimal(10,2) DEFAULT '0.00' COMMENT '总预算(元)',
+  `total_cost` decimal(10,2) DEFAULT '0.00' COMMENT '总消耗(元)',
+  `total_play` bigint DEFAULT '0' COMMENT '总播放量',
+  `total_like` bigint DEFAULT '0' COMMENT '总点赞数',
+  `total_comment` bigint DEFAULT '0' COMMENT '总评论数',
+  `total_share` bigint DEFAULT '0' COMMENT '总转发数',
+  `total_follow` bigint DEFAULT '0' COMMENT '总关注数',
+  `total_convert` bigint DEFAULT '0' COMMENT '总转化数',
+  `play_per_100_cost` decimal(10,2) DEFAULT NULL COMMENT '百播放量 = 播放量/消耗*100',
+  `share_per_100_play` decimal(10,2) DEFAULT NULL COMMENT '百转发率 = 转发/播放*100',
+  `avg_convert_cost` decimal(10,2) DEFAULT NULL COMMENT '转化成本 = 消耗/转化数(元)',
+  `min_order_create_time` datetime DEFAULT NULL COMMENT '最早订单创建时间',
+  `max_order_create_time` datetime DEFAULT NULL COMMENT '最新订单创建时间',
+  `stat_time` datetime DEFAULT NULL COMMENT '最新效果数据的统计时间',
+  `update_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_item_account` (`item_id`, `account_id`),
+  KEY `idx_account_min_create` (`account_id`, `min_order_create_time`),
+  KEY `idx_user_min_create` (`user_id`, `min_order_create_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='视频维度最新效果数据表';
@@ -0,0 +1,15 @@
+-- 同步游标表
+-- 用途：记录增量同步/增量聚合的高水位，避免每次从头扫描
+-- cursor_key示例：order_sync:{account_id}（订单增量同步，cursor_time=已同步的最新订单创建时间）
+--              video_agg_rebuild:{日期}（视频预聚合表重建中已完成的自然日分片）
+
+CREATE TABLE IF NOT EXISTS `douplus_sync_cursor` (
+  `id` bigint NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `cursor_key` varchar(100) NOT NULL COMMENT '游标键',
+  `cursor_time` datetime DEFAULT NULL COMMENT '时间高水位',
+  `cursor_value` varchar(255) DEFAULT NULL COMMENT '辅助值（如最新order_id）',
+  `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `update_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_cursor_key` (`cursor_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='同步游标表';
@@ -0,0 +1,11 @@
+"""
+WSGI入口（生产环境）
+
+gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+
+# api_server在导入时创建日志文件处理器，需先确保日志目录存在
+os.makedirs('logs', exist_ok=True)
+
+from api_server import app  # noqa: E402